@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+Request-count benchmark of the geoserver stages of an upload.
+
+Publishes synthetic layers with core.upload.publish against a local
+mock GeoServer (geoserver.mock) and reports the number of requests, the bytes
+and the latency per layer. Every layer is published twice: the first pass
+creates the layers, the rerun overwrites them as a repeated batch does.
+
+    python benchmark_upload.py --layers 20 --delay 0.01 --max-requests 25
+
+The exit code is 1 when a pass needs more requests per layer than
+--max-requests, so a ci job can catch regressions in the number of calls.
+"""
+# system imports
+import os
+import sys
+import json
+import shutil
+import argparse
+from time import perf_counter
+from tempfile import mkdtemp
+
+# Local imports
+from core.postgis import PG_DATABASE
+from core.timing import timer
+from core.wrap import wrap_geoserver
+from geoserver.mock import MockGeoServer
+from geoserver.metrics import METRICS
+from core.upload import publish
+
+# Globals
+WORKSPACE = "benchmark"
+STORE = "benchmark_store"
+EPSG = 28992
+
+# connection parameters of the datastore, the mock does not connect
+PG_DETAILS = {
+    "host": "localhost",
+    "port": 5432,
+    "database": "benchmark",
+    "username": "benchmark",
+    "password": "benchmark",
+}
+
+SLD = """<?xml version="1.0" encoding="UTF-8"?>
+<StyledLayerDescriptor version="1.0.0"
+    xmlns="http://www.opengis.net/sld"
+    xmlns:ogc="http://www.opengis.net/ogc">
+  <NamedLayer>
+    <Name>{name}</Name>
+    <UserStyle>
+      <FeatureTypeStyle>
+        <Rule>
+          <ogc:Filter>
+            <ogc:PropertyIsEqualTo>
+              <ogc:PropertyName>klasse</ogc:PropertyName>
+              <ogc:Literal>{name}</ogc:Literal>
+            </ogc:PropertyIsEqualTo>
+          </ogc:Filter>
+          <PolygonSymbolizer>
+            <Fill><CssParameter name="fill">#3388ff</CssParameter></Fill>
+          </PolygonSymbolizer>
+        </Rule>
+      </FeatureTypeStyle>
+    </UserStyle>
+  </NamedLayer>
+</StyledLayerDescriptor>
+"""
+
+
+def get_parser():
+    """ Return argument parser. """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--layers", type=int, default=10, help="Number of layers.")
+    parser.add_argument(
+        "--delay", type=float, default=0.0, help="Seconds of server delay."
+    )
+    parser.add_argument(
+        "--max-requests",
+        type=float,
+        default=None,
+        help="Fail when a pass needs more requests per layer.",
+    )
+    parser.add_argument("--in-place", action="store_true", help="overwrite_in_place")
+    parser.add_argument(
+        "--skip-identical", action="store_true", help="skip_identical_sld"
+    )
+    parser.add_argument("--shared-styles", action="store_true", help="shared_styles")
+    parser.add_argument("--output", default=None, help="Write the results as json.")
+    return parser
+
+
+class benchmark_setting(object):
+    """ The settings of a layer that publish reads """
+
+    def __init__(self, server_naam, layer_name, sld_path, args):
+        self.server_naam = server_naam
+        self.layer_name = layer_name
+        self.workspace_name = WORKSPACE
+        self.store_name = STORE
+        self.slug = "{}:{}".format(WORKSPACE, layer_name)
+        self.wms_url = server_naam.replace("rest/", "wms")
+        self.epsg = EPSG
+        self.in_sld_path = sld_path
+        self.product_naam = "benchmark"
+
+        self.unchanged = False
+        self.done = set()
+        self.journal = None
+        self.skip_unchanged = False
+        self.skip_pg_upload = True
+        self.skip_gs_upload = False
+        self.skip_sld_check = False
+        self.skip_lizard_wms_layer = True
+        self.use_existing_geoserver_sld = False
+
+        self.overwrite_feature = True
+        self.overwrite_sld = True
+        self.overwrite_in_place = args.in_place
+        self.skip_identical_sld = args.skip_identical
+        self.shared_styles = args.shared_styles
+
+
+def run_pass(server, args, directory, snapshot, layer_timer):
+    """ Publishes all layers once, returns requests, bytes and seconds """
+    server.reset_requests()
+    METRICS.reset()
+    start = perf_counter()
+    for layer in range(args.layers):
+        layer_name = "benchmark_layer_{}".format(layer)
+        sld_path = os.path.join(directory, layer_name + ".sld")
+        setting = benchmark_setting(server.service_url, layer_name, sld_path, args)
+        setting.timer = layer_timer
+        setting.throughput = None
+        setting.server = wrap_geoserver(
+            server.service_url, easy=True, snapshot=snapshot
+        )
+        publish(setting, None)
+
+    seconds = perf_counter() - start
+    summary = METRICS.summary()
+    return {
+        "requests": server.count(),
+        "requests_per_layer": server.count() / args.layers,
+        "methods": {m: server.count(m) for m in ("GET", "POST", "PUT", "DELETE")},
+        "bytes": sum(m["bytes_sent"] + m["bytes_received"] for m in summary.values()),
+        "seconds": round(seconds, 3),
+        "seconds_per_layer": round(seconds / args.layers, 4),
+        "endpoints": summary,
+    }
+
+
+def benchmark(args):
+    directory = mkdtemp(prefix="benchmark_upload_")
+    for layer in range(args.layers):
+        layer_name = "benchmark_layer_{}".format(layer)
+        with open(os.path.join(directory, layer_name + ".sld"), "w") as sld_file:
+            sld_file.write(SLD.format(name=layer_name))
+
+    results = {}
+    try:
+        with MockGeoServer(delay=args.delay) as server:
+            PG_DATABASE[server.service_url] = PG_DETAILS
+            snapshot = wrap_geoserver(server.service_url).snapshot
+            layer_timer = timer()
+            results["first"] = run_pass(server, args, directory, snapshot, layer_timer)
+            results["rerun"] = run_pass(server, args, directory, snapshot, layer_timer)
+            results["stages"] = layer_timer.totals("stage")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def print_results(results):
+    for name in ("first", "rerun"):
+        result = results[name]
+        print(
+            "{}: {} requests, {:.1f} per layer, {} bytes, {}s per layer".format(
+                name,
+                result["requests"],
+                result["requests_per_layer"],
+                result["bytes"],
+                result["seconds_per_layer"],
+            )
+        )
+        for endpoint, metrics in list(result["endpoints"].items())[:10]:
+            line = "    {:>5} {} ({}s mean)"
+            print(line.format(metrics["count"], endpoint, metrics["mean"]))
+
+
+def main():
+    args = get_parser().parse_args()
+    results = benchmark(args)
+    print_results(results)
+
+    if args.output is not None:
+        with open(args.output, "w") as json_file:
+            json.dump(results, json_file, indent=4)
+
+    if args.max_requests is not None:
+        worst = max(results[p]["requests_per_layer"] for p in ("first", "rerun"))
+        if worst > args.max_requests:
+            print(
+                "Regression: {:.1f} requests per layer, maximum {}".format(
+                    worst, args.max_requests
+                )
+            )
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,6 +6,7 @@ from time import sleep
 import logging
 import os
 import requests
+from core.session import get, post
 from catalogue.credentials import username, password
 
 LIZARD_URL = "https://demo.lizard.net/api/v3/"
@@ -45,7 +46,7 @@ def find_scenarios_by_model_slug(model_uuid, limit=RESULT_LIMIT):
 
     url = "{}scenarios/".format(LIZARD_URL)
     payload = {"model_name__icontains": model_uuid, "limit": limit}
-    r = requests.get(url=url, headers=get_headers(), params=payload)
+    r = get(url=url, headers=get_headers(), params=payload)
     r.raise_for_status()
     return r.json()["results"]
 
@@ -54,14 +55,14 @@ def find_scenarios_by_name(name, limit=RESULT_LIMIT):
     """return json containing scenarios based on name"""
     url = "{}scenarios/".format(LIZARD_URL)
     payload = {"name__icontains": name, "limit": limit}
-    r = requests.get(url=url, headers=get_headers(), params=payload)
+    r = get(url=url, headers=get_headers(), params=payload)
     r.raise_for_status()
     return r.json()["results"]
 
 
 def get_netcdf_link(scenario_uuid):
     """return url to raw 3Di results"""
-    r = requests.get(
+    r = get(
         url="{}scenarios/{}".format(LIZARD_URL, scenario_uuid), headers=get_headers()
     )
     r.raise_for_status()
@@ -73,7 +74,7 @@ def get_netcdf_link(scenario_uuid):
 
 def get_aggregation_netcdf_link(scenario_uuid):
     """return url to raw 3Di results"""
-    r = requests.get(
+    r = get(
         url="{}scenarios/{}".format(LIZARD_URL, scenario_uuid), headers=get_headers()
     )
     r.raise_for_status()
@@ -85,7 +86,7 @@ def get_aggregation_netcdf_link(scenario_uuid):
 
 def get_gridadmin_link(scenario_uuid):
     """return url to gridadministration"""
-    r = requests.get(
+    r = get(
         url="{}scenarios/{}".format(LIZARD_URL, scenario_uuid), headers=get_headers()
     )
     r.raise_for_status()
@@ -97,7 +98,7 @@ def get_gridadmin_link(scenario_uuid):
 
 def get_logging_link(scenario_uuid):
     """return url to zipped logging"""
-    r = requests.get(
+    r = get(
         url="{}scenarios/{}".format(LIZARD_URL, scenario_uuid), headers=get_headers()
     )
     r.raise_for_status()
@@ -110,7 +111,7 @@ def get_logging_link(scenario_uuid):
 def get_raster(scenario_uuid, raster_code):
     """return json of raster based on scenario uuid and raster type"""
 
-    r = requests.get(
+    r = get(
         url="{}scenarios/{}".format(LIZARD_URL, scenario_uuid), headers=get_headers()
     )
     r.raise_for_status()
@@ -120,7 +121,7 @@ def get_raster(scenario_uuid, raster_code):
 
 def get_lizard_raster(raster_uuid):
     """return json of raster based on raster uuid"""
-    r = requests.get(
+    r = get(
         url="{}rasters/{}".format(LIZARD_URL, raster_uuid), headers=get_headers()
     )
     r.raise_for_status()
@@ -172,7 +173,7 @@ def create_raster_task(raster, target_srs, resolution=None, bounds=None, time=No
         
     payload.update(geometry)
     
-    r = requests.get(url=url, headers=get_headers(), params=payload)
+    r = get(url=url, headers=get_headers(), params=payload)
     print(r.url)
     r.raise_for_status()
     return r.json()
@@ -182,7 +183,7 @@ def create_raster_task(raster, target_srs, resolution=None, bounds=None, time=No
 def get_task_status(task_uuid):
     """return status of task"""
     url = "{}tasks/{}/".format(LIZARD_URL, task_uuid)
-    r = requests.get(url=url, headers=get_headers())
+    r = get(url=url, headers=get_headers())
     r.raise_for_status()
     return r.json()["task_status"]
 
@@ -191,7 +192,7 @@ def get_task_download_url(task_uuid):
     """return url of successful task"""
     if get_task_status(task_uuid) == "SUCCESS":
         url = "{}tasks/{}/".format(LIZARD_URL, task_uuid)
-        r = requests.get(url=url, headers=get_headers())
+        r = get(url=url, headers=get_headers())
         r.raise_for_status()
         return r.json()["result_url"]
     # What to do if task is not a success?
@@ -200,7 +201,7 @@ def get_task_download_url(task_uuid):
 def download_file(url, path):
     """download url to specified path"""
     logging.debug("Start downloading file: {}".format(url))
-    r = requests.get(url, auth=(get_headers()["username"], get_headers()["password"]))
+    r = get(url, auth=(get_headers()["username"], get_headers()["password"]))
     r.raise_for_status()
     with open(path, "wb") as file:
         for chunk in r.iter_content(100000):
@@ -387,7 +388,7 @@ def download_grid_administration(scenario_uuid, pathname=None):
 def clear_inbox():
     """delete all messages from Lizard inbox"""
     url = "{}inbox/".format(LIZARD_URL)
-    r = requests.get(
+    r = get(
         url=url, headers=get_headers(), params={"limit": RESULT_LIMIT}, timeout=10
     )
     r.raise_for_status()
@@ -395,7 +396,7 @@ def clear_inbox():
     for msg in messages:
         msg_id = msg["id"]
         read_url = "{}inbox/{}/read/".format(LIZARD_URL, msg_id)
-        r = requests.post(url=read_url, headers=get_headers(), timeout=10)
+        r = post(url=read_url, headers=get_headers(), timeout=10)
     return True
 
 
@@ -552,7 +553,7 @@ def get_raster_from_json(scenario, raster_code):
 
 def request_json_from_url(url, params=None):
     """retrieve json object from url"""
-    r = requests.get(url=url, headers=get_headers(), params=params)
+    r = get(url=url, headers=get_headers(), params=params)
     r.raise_for_status()
     if r.status_code == requests.codes.ok:
         return r.json()
@@ -277,9 +277,9 @@ def download_vector(vector, temp_dir, dst_json, x1="", x2="", y1="", y2=""):
 def retrieve_sld(vector, gs_dict, path):
     try:
         gs_dict[vector["geoserver"]].get_layer(vector["slug"])
+        sld_body = gs_dict[vector["geoserver"]].sld_body
     except AttributeError:
         raise MissingSLD("SLD not found for {}".format(vector["slug"]))
-    sld_body = gs_dict[vector["geoserver"]].sld_body
     vector_sld = wrap_sld(sld_body, "body")
     vector_sld.write_xml(path)
 
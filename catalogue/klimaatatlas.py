@@ -7,9 +7,11 @@ Created on Thu May 16 16:55:29 2019
 # Third party imports
 import ogr
 import json
-import requests
 from tqdm import tqdm
 
+# Local imports
+from core.session import get
+
 
 class wrap_atlas:
     def __init__(self, atlas_name):
@@ -50,7 +52,7 @@ class wrap_atlas:
 
     def get_json(self, atlas):
         atlas_api = f"https://{atlas}.klimaatatlas.net/api/"
-        r = requests.get(atlas_api)
+        r = get(atlas_api)
         self.atlas_api_json = r.json()
         return self.atlas_api_json
 
@@ -7,7 +7,13 @@ GET CREDENTIALS
 """
 
 import getpass
+import multiprocessing as mp
 
-username = input("Lizard SSO Username:")
-password = getpass.getpass("Lizard SSO Password:")
+# Background processes only do local work, so they are not prompted
+if mp.current_process().name == "MainProcess":
+    username = input("Lizard SSO Username:")
+    password = getpass.getpass("Lizard SSO Password:")
+else:
+    username = None
+    password = None
 
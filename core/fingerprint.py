@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+Content fingerprints of the data and the style of a layer.
+
+Files are hashed on their bytes, postgis tables on their row count and xmin
+high-water mark. Both are combined with the settings that change the output.
+"""
+# system imports
+import os
+import glob
+import hashlib
+
+# Local imports
+from core.postgis import connect2pg_database
+
+# Globals
+SOURCE_EXTENSIONS = [".shp", ".shx", ".dbf", ".prj", ".cpg", ".gpkg"]
+CHUNK_SIZE = 1024 * 1024
+
+# Settings which change the data of a layer
+DATA_SETTINGS = [
+    "in_datasource",
+    "in_layer",
+    "epsg",
+    "skip_mask",
+    "skip_correction",
+    "skip_delete_excess_field_names",
+]
+
+# Settings which change the style of a layer
+STYLE_SETTINGS = [
+    "use_existing_geoserver_sld",
+    "existing_sld",
+    "skip_sld_check",
+    "shared_styles",
+]
+
+
+def source_files(path):
+    """ Returns the files of a vector source, e.g. .shp, .dbf and .prj """
+    base = os.path.splitext(path)[0]
+    paths = sorted(glob.glob(glob.escape(base) + ".*"))
+    return [p for p in paths if os.path.splitext(p)[1].lower() in SOURCE_EXTENSIONS]
+
+
+def update_file(sha, path):
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            sha.update(chunk)
+
+
+def update_settings(sha, setting, keys):
+    for key in keys:
+        sha.update("{}={}\n".format(key, getattr(setting, key, None)).encode("utf-8"))
+
+
+def table_fingerprint(database, table):
+    """ Returns the row count and the xmin high-water mark of a table """
+    if "." in table:
+        schema, name = table.split(".", 1)
+    else:
+        schema, name = "public", table
+
+    sql = 'SELECT count(*), max(xmin::text::bigint) FROM "{}"."{}"'.format(
+        schema, name
+    )
+    connection = connect2pg_database(database, "psycopg")
+    count, xmin = connection.fetch_sql(sql)[0]
+    return "{} {}".format(count, xmin)
+
+
+def style_fingerprint(setting):
+    """ Returns a hash of the sld of a layer """
+    sha = hashlib.sha256()
+    update_settings(sha, setting, STYLE_SETTINGS)
+
+    in_sld_path = getattr(setting, "in_sld_path", None)
+    if not setting.use_existing_geoserver_sld and in_sld_path:
+        if os.path.isfile(in_sld_path):
+            update_file(sha, in_sld_path)
+    return sha.hexdigest()
+
+
+def data_fingerprint(setting):
+    """
+    Returns a hash of the source of a layer. The sld is part of the hash when
+    fields are pruned on the sld and the mask is part when the layer is
+    clipped.
+    """
+    sha = hashlib.sha256()
+    update_settings(sha, setting, DATA_SETTINGS)
+
+    in_datasource = getattr(setting, "in_datasource", None)
+    if isinstance(in_datasource, dict):
+        sha.update(table_fingerprint(in_datasource, setting.in_layer).encode())
+    elif isinstance(in_datasource, str):
+        for path in source_files(in_datasource):
+            update_file(sha, path)
+
+    if not setting.skip_mask:
+        for path in source_files(setting.mask_path):
+            update_file(sha, path)
+
+    if not setting.skip_delete_excess_field_names:
+        sha.update(style_fingerprint(setting).encode())
+
+    return sha.hexdigest()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Journal of the completed upload stages per layer.
+
+The journal is a sqlite file next to the inifile. Every finished stage is
+stored together with the fingerprint of the input (see core.fingerprint), a
+rerun skips the stages that are finished for an unchanged input.
+
+Intermediate vectors are kept in memory, so a corrected layer is corrected
+again when it is not yet loaded into the database.
+"""
+# system imports
+import sqlite3
+import datetime
+from contextlib import closing
+
+# Stages
+CORRECTED = "corrected"
+PG_LOADED = "pg-loaded"
+PUBLISHED = "published"
+STYLED = "styled"
+WMS_REGISTERED = "wms-registered"
+STAGES = [CORRECTED, PG_LOADED, PUBLISHED, STYLED, WMS_REGISTERED]
+
+CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS stages (
+    layer TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    finished TEXT NOT NULL,
+    PRIMARY KEY (layer, stage)
+)
+"""
+
+
+class journal(object):
+    """ Sqlite journal of the finished stages per layer """
+
+    def __init__(self, path):
+        self.path = path
+        with closing(self.connect()) as conn, conn:
+            conn.execute(CREATE_TABLE)
+
+    def connect(self):
+        return sqlite3.connect(self.path, timeout=60)
+
+    def done(self, layer, fingerprint):
+        """ Returns the finished stages of a layer with the same fingerprint """
+        with closing(self.connect()) as conn:
+            rows = conn.execute(
+                "SELECT stage FROM stages WHERE layer = ? AND fingerprint = ?",
+                (layer, fingerprint),
+            ).fetchall()
+        return set(row[0] for row in rows)
+
+    def add(self, layer, stage, fingerprint):
+        """ Stores a finished stage, stages of another fingerprint are reset """
+        with closing(self.connect()) as conn, conn:
+            conn.execute(
+                "DELETE FROM stages WHERE layer = ? AND fingerprint != ?",
+                (layer, fingerprint),
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO stages VALUES (?, ?, ?, ?)",
+                (layer, stage, fingerprint, datetime.datetime.now().isoformat()),
+            )
+
+    def reset(self, layer=None):
+        with closing(self.connect()) as conn, conn:
+            if layer is None:
+                conn.execute("DELETE FROM stages")
+            else:
+                conn.execute("DELETE FROM stages WHERE layer = ?", (layer,))
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Chunked execution of the geometry operations of core.vector.
+
+A layer is read in chunks of consecutive fids. The wkb of the geometries of
+a chunk is sent to a pool of spawned processes, the field values stay in this
+process. Chunks are read while the results of earlier chunks are written, so
+only a few chunks of a layer are in memory at once.
+An operation gets the wkbs of a chunk and returns per feature:
+    None                    the feature has no geometry, it is lost
+    [wkb or None, ...]      the resulting geometries, None when invalid
+The results are written in fid order with the field values of their feature.
+"""
+# system imports
+import multiprocessing as mp
+from collections import deque
+from itertools import chain, islice
+
+# Third-party imports
+import ogr
+from tqdm import tqdm
+
+# Globals
+CHUNK_SIZE = 2000
+_operation = None
+
+
+def read_chunks(layer, field_indices, chunk_size=CHUNK_SIZE):
+    """ Yields lists of (fid, wkb, values) of consecutive features """
+    chunk = []
+    layer.ResetReading()
+    for feature in layer:
+        geometry = feature.GetGeometryRef()
+        wkb = None if geometry is None else geometry.ExportToWkb()
+        values = [feature.GetField(i) for i in field_indices]
+        chunk.append((feature.GetFID(), wkb, values))
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+
+    if len(chunk) > 0:
+        yield chunk
+    layer.ResetReading()
+
+
+def chunk_wkbs(chunk):
+    return [wkb for fid, wkb, values in chunk]
+
+
+def _initialize(function, arguments):
+    global _operation
+    _operation = (function, arguments)
+
+
+def _run(wkbs):
+    function, arguments = _operation
+    return function(wkbs, *arguments)
+
+
+def run_chunks(chunks, function, arguments=(), workers=1):
+    """
+    Yields every chunk with the result of function(wkbs, *arguments), in
+    order. At most two chunks per worker are read ahead of the results.
+    """
+    # daemonic processes, e.g. the pipeline, are not allowed to have children
+    if workers <= 1 or mp.current_process().daemon:
+        for chunk in chunks:
+            yield chunk, function(chunk_wkbs(chunk), *arguments)
+        return
+
+    # a single chunk is not worth starting the processes for
+    chunks = iter(chunks)
+    ahead = list(islice(chunks, 2))
+    if len(ahead) <= 1:
+        for chunk in ahead:
+            yield chunk, function(chunk_wkbs(chunk), *arguments)
+        return
+
+    # spawn, the uploader forks from its upload threads otherwise
+    context = mp.get_context("spawn")
+    pool = context.Pool(workers, _initialize, (function, arguments))
+    pending = deque()
+    try:
+        for chunk in chain(ahead, chunks):
+            pending.append((chunk, pool.apply_async(_run, (chunk_wkbs(chunk),))))
+            if len(pending) >= 2 * workers:
+                chunk, result = pending.popleft()
+                yield chunk, result.get()
+
+        while len(pending) > 0:
+            chunk, result = pending.popleft()
+            yield chunk, result.get()
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def write_feature(layer, layer_defn, wkb, values):
+    feature = ogr.Feature(layer_defn)
+    feature.SetGeometryDirectly(ogr.CreateGeometryFromWkb(wkb))
+    for field, value in enumerate(values):
+        if value is None:
+            continue
+        try:
+            feature.SetField(field, value)
+        except Exception as e:
+            print(e)
+    layer.CreateFeature(feature)
+
+
+def execute(in_layer, out_layer, function, arguments=(), workers=1, fields=None):
+    """
+    Runs an operation on all features of in_layer with a pool of workers and
+    writes the results to out_layer, which has the fields of in_layer that
+    are not ignored or the given field indices.
+
+    Returns
+    -------
+    missing : list of fids of the features without geometry
+    invalid : list of positions of the invalid results among all results
+    """
+    if fields is None:
+        layer_defn = in_layer.GetLayerDefn()
+        fields = [
+            i
+            for i in range(layer_defn.GetFieldCount())
+            if not layer_defn.GetFieldDefn(i).IsIgnored()
+        ]
+
+    chunks = read_chunks(in_layer, list(fields))
+    total = -(-in_layer.GetFeatureCount() // CHUNK_SIZE)
+
+    missing = []
+    invalid = []
+    position = 0
+    out_layer_defn = out_layer.GetLayerDefn()
+    transaction = out_layer.TestCapability(ogr.OLCTransactions)
+    if transaction:
+        out_layer.StartTransaction()
+
+    results = run_chunks(chunks, function, arguments, workers)
+    for chunk, result in tqdm(results, total=total):
+        for (fid, wkb, values), wkbs in zip(chunk, result):
+            if wkbs is None:
+                missing.append(fid)
+                continue
+
+            for out_wkb in wkbs:
+                if out_wkb is None:
+                    invalid.append(position)
+                else:
+                    write_feature(out_layer, out_layer_defn, out_wkb, values)
+                position += 1
+
+    if transaction:
+        out_layer.CommitTransaction()
+    return missing, invalid
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+Dry-run planning of an upload.
+
+The planner opens the input of a layer without processing it and estimates
+the time of the stages that will run. Cpu and database stages scale with the
+number of vertices, the geoserver and lizard stages take a fixed time per
+layer. Measured throughput is stored in throughput.json next to the inifile
+and replaces the defaults once available.
+"""
+# system imports
+import os
+import json
+import threading
+
+# Third-party imports
+import ogr
+
+# Local imports
+from core.vector import vector as wrap_shape
+from core.postgis import connect2pg_database
+from core.fingerprint import source_files
+from core.journal import PG_LOADED, PUBLISHED, STYLED, WMS_REGISTERED
+
+# Stages
+CORRECTION = "correction"
+CLIP = "clip"
+PRUNE = "field pruning"
+PG_LOAD = "pg load"
+PUBLISH = "publish"
+STYLE = "style"
+WMS = "wms layer"
+
+# Default vertices per second
+VERTEX_RATES = {
+    CORRECTION: 100000.0,
+    CLIP: 200000.0,
+    PRUNE: 1000000.0,
+    PG_LOAD: 50000.0,
+}
+
+# Default seconds per layer
+FIXED_SECONDS = {PUBLISH: 10.0, STYLE: 5.0, WMS: 3.0}
+
+
+class throughput(object):
+    """ Measured throughput per stage, stored as json """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.measured = {}
+        if os.path.exists(path):
+            with open(path) as json_file:
+                self.measured = json.load(json_file)
+
+    def add(self, stage, units, seconds):
+        with self.lock:
+            measured = self.measured.setdefault(stage, [0, 0])
+            measured[0] = measured[0] + units
+            measured[1] = measured[1] + seconds
+
+    def save(self):
+        with self.lock:
+            with open(self.path, "w") as json_file:
+                json.dump(self.measured, json_file, indent=4)
+
+    def seconds(self, stage, vertices):
+        """ Returns the estimated seconds of a stage """
+        units, seconds = self.measured.get(stage, [0, 0])
+        if stage in VERTEX_RATES:
+            rate = units / seconds if seconds > 0 else VERTEX_RATES[stage]
+            return vertices / max(rate, 1)
+        else:
+            return seconds / units if units > 0 else FIXED_SECONDS[stage]
+
+
+def count_vertices(geometry):
+    if geometry is None:
+        return 0
+
+    count = geometry.GetGeometryCount()
+    if count == 0:
+        return geometry.GetPointCount()
+    return sum(count_vertices(geometry.GetGeometryRef(i)) for i in range(count))
+
+
+def layer_vertices(layer, sample=None):
+    """
+    Returns the vertex count of a layer. With a sample only the first
+    features are read and the vertex count is extrapolated.
+    """
+    feature_count = layer.GetFeatureCount()
+
+    vertices = 0
+    read = 0
+    layer.ResetReading()
+    for feature in layer:
+        vertices = vertices + count_vertices(feature.GetGeometryRef())
+        read = read + 1
+        if sample is not None and read >= sample:
+            break
+    layer.ResetReading()
+
+    if read > 0 and read < feature_count:
+        vertices = int(vertices * feature_count / read)
+    return vertices
+
+
+def table_size(database, table):
+    """ Returns the size of a postgis table in bytes """
+    sql = "SELECT pg_total_relation_size('{}')".format(table)
+    return connect2pg_database(database, "psycopg").fetch_sql(sql)[0][0]
+
+
+def layer_info(setting, sample=None):
+    """
+    Returns feature count, vertex count, geometry type, field count and size
+    of the input of a layer. With a sample only the first features are read
+    and the vertex count is extrapolated.
+    """
+    if isinstance(setting.in_datasource, dict):
+        vector = wrap_shape(setting.in_datasource, layer_name=setting.in_layer)
+        size = table_size(setting.in_datasource, setting.in_layer)
+    else:
+        vector = wrap_shape(setting.in_datasource)
+        size = sum(os.path.getsize(p) for p in source_files(setting.in_datasource))
+
+    layer = vector.layer
+    info = {
+        "features": layer.GetFeatureCount(),
+        "vertices": layer_vertices(layer, sample),
+        "geometry": ogr.GeometryTypeToName(layer.GetGeomType()),
+        "fields": layer.GetLayerDefn().GetFieldCount(),
+        "size": size,
+    }
+    vector.close()
+    return info
+
+
+def planned_stages(setting):
+    """ Returns the stages that will run for a layer """
+    if getattr(setting, "unchanged", False):
+        return []
+
+    done = getattr(setting, "done", set())
+    stages = []
+    if PG_LOADED not in done:
+        if not setting.skip_correction:
+            stages.append(CORRECTION)
+        if not setting.skip_mask:
+            stages.append(CLIP)
+        if not setting.skip_delete_excess_field_names:
+            stages.append(PRUNE)
+        if not setting.skip_pg_upload:
+            stages.append(PG_LOAD)
+
+    if not setting.skip_gs_upload:
+        if PUBLISHED not in done:
+            stages.append(PUBLISH)
+        if STYLED not in done:
+            stages.append(STYLE)
+
+    if not setting.skip_lizard_wms_layer and WMS_REGISTERED not in done:
+        stages.append(WMS)
+
+    return stages
+
+
+def estimate(info, stages, measured):
+    """ Returns the estimated seconds per stage """
+    return {stage: measured.seconds(stage, info["vertices"]) for stage in stages}
@@ -4,6 +4,9 @@ Created on Mon Jul 15 18:30:37 2019
 
 @author: chris.kerklaan - N&S
 """
+# system imports
+import threading
+
 # Third-party imports
 from tqdm import tqdm
 import ogr
@@ -11,6 +14,7 @@ import gdal
 
 # Local imports
 from core.pyconnectsql import connect2pg
+from core.sld import cut_field_names
 from nens_gs_uploader.localsecret.localsecret import (
     production_klimaatatlas as pg_atlas,
     staging as pg_staging,
@@ -41,6 +45,95 @@ PG_DATABASE = {
 }
 
 
+# Connections per database when pooling is enabled
+POOL_SIZE = 4
+
+
+class pg_connections(object):
+    """
+    Pools of psycopg2 connections and ogr datasources per PG_DATABASE entry.
+    Ogr datasources are not thread safe and are therefore kept per thread.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.size = POOL_SIZE
+        self.pools = {}
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def enable(self, size=POOL_SIZE):
+        self.enabled = True
+        self.size = size
+
+    def disable(self):
+        """
+        Stops using the pools without closing them, a forked process shares
+        the sockets of the parent and must not close them.
+        """
+        self.enabled = False
+
+    def pool(self, database, connection):
+        """ Returns the psycopg2 pool of a database or None if disabled """
+        if not self.enabled:
+            return None
+
+        key = database_key(database)
+        with self.lock:
+            if key not in self.pools:
+                self.pools[key] = connection.connection_pool(self.size)
+            return self.pools[key]
+
+    def datasource(self, database):
+        """ Returns an open ogr datasource of a database """
+        if not self.enabled:
+            return ogr.Open(connect2pg_database(database), 1)
+
+        if not hasattr(self.local, "datasources"):
+            self.local.datasources = {}
+
+        key = database_key(database)
+        ds = self.local.datasources.get(key)
+        if ds is not None and not datasource_alive(ds):
+            ds = None
+
+        if ds is None:
+            ds = ogr.Open(connect2pg_database(database), 1)
+            self.local.datasources[key] = ds
+        return ds
+
+    def close(self):
+        """ Closes all connections and disables pooling """
+        with self.lock:
+            for pool in self.pools.values():
+                pool.closeall()
+            self.pools = {}
+        self.local = threading.local()
+        self.enabled = False
+
+
+def database_key(database):
+    return (
+        database["host"],
+        database["port"],
+        database["database"],
+        database["username"],
+    )
+
+
+def datasource_alive(ds):
+    """ Returns whether the connection of an ogr datasource still works """
+    try:
+        result = ds.ExecuteSQL("SELECT 1")
+        ds.ReleaseResultSet(result)
+        return True
+    except RuntimeError:
+        return False
+
+
+PG_CONNECTIONS = pg_connections()
+
+
 def check_ogr_columns(ds, layer):
     """
     Checks if ogr column values are compatible with postgis, alters 
@@ -80,11 +173,23 @@ def connect2pg_database(database, con_type="ogr"):
     if con_type == "ogr":
         return connection.ogr_connection()
     else:
+        connection.pool = PG_CONNECTIONS.pool(database, connection)
         return connection
 
 
-def copy2pg_database(ds, ds_layer, layer, layer_name, schema="public", overwrite="YES"):
-
+def copy2pg_database(
+    ds,
+    ds_layer,
+    layer,
+    layer_name,
+    schema="public",
+    overwrite="YES",
+    field_name_length=None,
+):
+    """
+    Copies a layer to a postgis table, the column names are cut to
+    field_name_length as the property names of the sld if given
+    """
     # ds, layer = check_ogr_columns(ds_layer, layer)
 
     options = [
@@ -101,15 +206,32 @@ def copy2pg_database(ds, ds_layer, layer, layer_name, schema="public", overwrite
         new_layer = ds.CreateLayer(
             layer_name, layer.GetSpatialRef(), geom_type, options
         )
-        for x in range(layer.GetLayerDefn().GetFieldCount()):
-            new_layer.CreateField(layer.GetLayerDefn().GetFieldDefn(x))
+        layer_defn = layer.GetLayerDefn()
+        field_defns = [
+            layer_defn.GetFieldDefn(x) for x in range(layer_defn.GetFieldCount())
+        ]
+        field_names = [field_defn.GetName() for field_defn in field_defns]
+        if field_name_length is not None:
+            field_names = cut_field_names(field_names, field_name_length)
+
+        for field_defn, field_name in zip(field_defns, field_names):
+            new_field_defn = ogr.FieldDefn(field_name, field_defn.GetType())
+            new_field_defn.SetSubType(field_defn.GetSubType())
+            new_field_defn.SetWidth(field_defn.GetWidth())
+            new_field_defn.SetPrecision(field_defn.GetPrecision())
+            new_layer.CreateField(new_field_defn)
+
+        # fields are copied on their position, the names can differ
+        new_layer_defn = new_layer.GetLayerDefn()
+        field_map = list(range(len(field_defns)))
 
         layer.ResetReading()
         new_layer.StartTransaction()
-        for fid in tqdm(range(layer.GetFeatureCount())):
+        features = tqdm(layer, total=layer.GetFeatureCount())
+        for fid, feature in enumerate(features):
             #try:
-                new_feature = layer.GetFeature(fid)
-                new_feature.SetFID(-1)
+                new_feature = ogr.Feature(new_layer_defn)
+                new_feature.SetFromWithMap(feature, True, field_map)
                 new_layer.CreateFeature(new_feature)
                 if fid % 128 == 0:
                     new_layer.CommitTransaction()
@@ -150,6 +272,32 @@ def add_metadata_pgdatabase(setting, datasource):
     metadata_layer.CommitTransaction()
 
 
+def get_metadata_fingerprints(layer_name, datasource):
+    """ Returns the data and style hash in the metadata row of a layer """
+    metadata_layer = datasource.GetLayer("metadata")
+    metadata_layer.SetAttributeFilter("pg_layer = '{}'".format(layer_name))
+    try:
+        for feature in metadata_layer:
+            return feature.GetField("data_hash"), feature.GetField("style_hash")
+        return None, None
+    finally:
+        # the datasource can be reused
+        metadata_layer.SetAttributeFilter(None)
+
+
+def add_fingerprint_columns(database):
+    """ Adds the fingerprint columns to the metadata table if not present """
+    connection = connect2pg_database(database, "psycopg")
+    connection.execute_sql(
+        """
+    ALTER TABLE metadata
+        ADD COLUMN IF NOT EXISTS data_hash varchar(64),
+        ADD COLUMN IF NOT EXISTS style_hash varchar(64)
+    ;
+    """
+    )
+
+
 def _clear_connections_database(database, client_adress="10.100.230.131"):
     connection = connect2pg_database(database, "psycopg")
     query_check_1 = "SET extra_float_digits = 3"
@@ -12,36 +12,81 @@ Connectie kan op verschillende manieren:
 1. psycopg
 2. ogr
 
+Met een pool worden psycopg connecties hergebruikt in plaats van per query
+geopend en gesloten.
+
 Credits voor dit script gaan naar de rastercaster:
 https://github.com/nens/threedi-turtle-scripts/blob/master/sql-scripts/rastercaster/rastercaster.py
 
 """
+# system imports
+from contextlib import contextmanager
+
 # third-party imports
 import ogr
 import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
 
 
 class connect2pg:
     def __init__(
-        self, dbname, port="5432", host="localhost", user="postgres", password="nens"
+        self,
+        dbname,
+        port="5432",
+        host="localhost",
+        user="postgres",
+        password="nens",
+        pool=None,
     ):
         self.dbname = dbname
         self.host = host
         self.user = user
         self.password = password
         self.port = port
+        self.pool = pool
 
-    def psycopg2_connection(self):
-        db_conn = ("dbname={} user={} host={} password={}").format(
+    def dsn(self):
+        return ("dbname={} user={} host={} password={}").format(
             self.dbname, self.user, self.host, self.password
         )
+
+    def psycopg2_connection(self):
         try:
-            conn = psycopg2.connect(db_conn)
+            conn = psycopg2.connect(self.dsn())
         except:
             print("I am unable to connect to the database")
 
         return conn
 
+    def connection_pool(self, size):
+        return ThreadedConnectionPool(1, size, self.dsn())
+
+    @contextmanager
+    def connection(self):
+        """ Yields a connection from the pool or a new connection """
+        if self.pool is None:
+            conn = self.psycopg2_connection()
+            try:
+                yield conn
+            finally:
+                conn.close()
+            return
+
+        conn = self.pool.getconn()
+        if conn.closed:
+            # terminated by _clear_connections_database or the server
+            self.pool.putconn(conn, close=True)
+            conn = self.pool.getconn()
+
+        try:
+            yield conn
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            self.pool.putconn(conn, close=bool(conn.closed))
+
     def ogr_connection(self, connection="string", read=1):
         ogr_conn = ("PG:host={} port={} user='{}'" "password='{}' dbname='{}'").format(
             self.host, self.port, self.user, self.password, self.dbname
@@ -63,9 +108,6 @@ class connect2pg:
     def execute_sql_file(self, filename, *args):
         print("Started execute_sql_file:" + filename)
 
-        conn = self.psycopg2_connection()
-        cur = conn.cursor()
-
         with open(filename, "r") as file:
             sql = file.read()
 
@@ -73,46 +115,30 @@ class connect2pg:
                 for num, arg in enumerate(args):
                     sql = sql.replace("arg{}".format(str(num)), str(arg))
 
-        #            if args is not None:
-        #                f = file.read()
-        #                for num,i in enumerate(arg):
-        #                    f = f.replace('arg{}'.format(str(num)),str(i))
-        #                sql = f
-        #            else:
-        #                sql = file.read()
-
         print(sql)
-        cur.execute(sql)
-        conn.commit()
-
-        # except psycopg2.DatabaseError as e:
-
-        if conn:
-            conn.rollback()
-            conn.close()
-
-        conn.close()
-
-        # finally:
-        if conn is not None:
-            conn.close()
+        self.execute_sql(sql)
 
     def execute_sql(self, sql):
-        conn = self.psycopg2_connection()
-        cur = conn.cursor()
-
-        cur.execute(sql)
-        conn.commit()
+        self.run_sql(sql, fetch=False)
 
-        if conn:
-            conn.rollback()
-            conn.close()
+    def fetch_sql(self, sql):
+        return self.run_sql(sql, fetch=True)
 
-        conn.close()
-
-        # finally:
-        if conn is not None:
-            conn.close()
+    def run_sql(self, sql, fetch=False):
+        # a pooled connection can be terminated while idle, retry it once
+        attempts = 1 if self.pool is None else 2
+        for attempt in range(attempts):
+            try:
+                with self.connection() as conn:
+                    cur = conn.cursor()
+                    cur.execute(sql)
+                    rows = cur.fetchall() if fetch else None
+                    conn.commit()
+                    return rows
+
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                if attempt == attempts - 1:
+                    raise
 
 
 if __name__ == "__main__":
@@ -7,7 +7,7 @@ import os
 import json
 import math
 import multiprocessing as mp
-from requests import get, post, codes, delete, put, patch
+from core.session import get, post, delete, patch
 from core.credentials import username
 from core.credentials import password
 from core.project import mk_dir
@@ -298,12 +298,14 @@ def get_call_or(params, url, headers):
     if r.status_code == 200:
         return r.json()
     else:
-        return ValueError(
+        raise ValueError(
             "Call failed with query:",
             "query",
             query,
-            "json:",
-            r.json(),
+            "status:",
+            r.status_code,
+            "text:",
+            r.text,
         )
     
 def post_call_or(params, url, headers):
@@ -317,10 +319,11 @@ def post_call_or(params, url, headers):
         return r.json()
     else:
         print('Post failure')
-        return ValueError("Call failed with query:", 
-                          "url", query['url'], 
-                          "query",query,
-                          "json:", r.json())
+        raise ValueError("Call failed with query:", 
+                         "url", query['url'], 
+                         "query",query,
+                         "status:", r.status_code,
+                         "text:", r.text)
 
 
 def load_slug_dict(raster_url, headers, path, update=True):
@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+"""
+Shared http session for the geoserver and the lizard api.
+
+Every request passes a token bucket of the host it is send to. The rate of
+the bucket adapts to the server: it increases slowly while responses are fast,
+decreases on slow responses and halves on 429 and 5xx responses. All sessions in the
+process share the buckets, thus parallel workers are limited together.
+
+Idempotent requests are retried on connection errors, 429 and 502-504 with
+exponential backoff and full jitter. A stream body is rewound before a retry,
+requests with a body that can not be rewound are not retried. Failures open a
+circuit breaker of the host, after which requests fail fast until the host is
+tried again.
+"""
+# system imports
+import time
+import random
+import threading
+from urllib.parse import urlparse
+
+# Third-party imports
+import requests
+
+# Local imports
+from geoserver.metrics import METRICS
+
+# Globals
+START_RATE = 5.0  # requests per second
+MIN_RATE = 0.2
+MAX_RATE = 50.0
+BURST = 5
+TARGET_LATENCY = 2.0  # seconds
+INCREASE = 0.5  # requests per second per fast response
+DECREASE = 0.5  # factor on 429 and 5xx
+SLOW_DECREASE = 0.9  # factor on a slow response
+
+RETRIES = 3
+BACKOFF = 0.5  # seconds, doubles every attempt
+MAX_BACKOFF = 30.0
+RETRY_STATUS = (429, 502, 503, 504)
+IDEMPOTENT = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+
+FAILURE_THRESHOLD = 5  # consecutive failures that open a circuit
+RESET_TIMEOUT = 30.0  # seconds before an open circuit is tried again
+
+
+class CircuitOpenError(requests.ConnectionError):
+    pass
+
+
+class token_bucket(object):
+    """ Token bucket of which the rate adapts to latency and status codes """
+
+    def __init__(
+        self,
+        rate=START_RATE,
+        burst=BURST,
+        min_rate=MIN_RATE,
+        max_rate=MAX_RATE,
+        target_latency=TARGET_LATENCY,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.target_latency = target_latency
+        self.tokens = burst
+        self.last = time.monotonic()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def acquire(self):
+        """ Blocks until a token is available """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens = self.tokens - 1
+                    return
+
+                wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def update(self, latency, status_code=200, retry_after=None):
+        """ Adapts the rate to the response of the server """
+        with self.lock:
+            if status_code == 429 or status_code >= 500:
+                self.rate = max(self.min_rate, self.rate * DECREASE)
+                self.tokens = 0
+            elif latency > self.target_latency:
+                self.rate = max(self.min_rate, self.rate * SLOW_DECREASE)
+            else:
+                self.rate = min(self.max_rate, self.rate + INCREASE)
+
+            if retry_after:
+                self.paused_until = max(
+                    self.paused_until, time.monotonic() + retry_after
+                )
+
+
+class rate_limiter(object):
+    """ Registry of token buckets per host """
+
+    def __init__(self, **bucket_kwargs):
+        self.bucket_kwargs = bucket_kwargs
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def bucket(self, url):
+        host = urlparse(url).netloc
+        with self.lock:
+            if host not in self.buckets:
+                self.buckets[host] = token_bucket(**self.bucket_kwargs)
+            return self.buckets[host]
+
+    def rates(self):
+        return {host: bucket.rate for host, bucket in self.buckets.items()}
+
+
+LIMITER = rate_limiter()
+
+
+class circuit_breaker(object):
+    """ Fails fast after consecutive failures of a host """
+
+    def __init__(self, threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened = None
+        self.trial = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """ Returns if a request may be send, one trial after the timeout """
+        with self.lock:
+            if self.opened is None:
+                return True
+            if self.trial or time.monotonic() - self.opened < self.reset_timeout:
+                return False
+            self.trial = True
+            return True
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened = None
+            self.trial = False
+
+    def failure(self):
+        with self.lock:
+            self.failures = self.failures + 1
+            if self.trial or self.failures >= self.threshold:
+                self.opened = time.monotonic()
+            self.trial = False
+
+
+class circuit_breakers(object):
+    """ Registry of circuit breakers per host """
+
+    def __init__(self, **breaker_kwargs):
+        self.breaker_kwargs = breaker_kwargs
+        self.breakers = {}
+        self.lock = threading.Lock()
+
+    def breaker(self, url):
+        host = urlparse(url).netloc
+        with self.lock:
+            if host not in self.breakers:
+                self.breakers[host] = circuit_breaker(**self.breaker_kwargs)
+            return self.breakers[host]
+
+    def open_hosts(self):
+        return [host for host, b in self.breakers.items() if b.opened is not None]
+
+
+BREAKERS = circuit_breakers()
+
+
+class limited_session(requests.Session):
+    """
+    requests.Session that waits for the rate limiter of the host, retries
+    idempotent requests and fails fast on an open circuit
+    """
+
+    def __init__(self, limiter=LIMITER, breakers=BREAKERS, retries=RETRIES):
+        super(limited_session, self).__init__()
+        self.limiter = limiter
+        self.breakers = breakers
+        self.retries = retries
+
+    def request(self, method, url, *args, **kwargs):
+        bucket = self.limiter.bucket(url)
+        breaker = self.breakers.breaker(url)
+        retries = self.retries if method.upper() in IDEMPOTENT else 0
+
+        # data is the second positional argument after the url, see requests
+        body = kwargs.get("data", args[1] if len(args) > 1 else None)
+        position = body_position(body)
+        if position is None or kwargs.get("files") is not None:
+            retries = 0
+
+        attempt = 0
+        while True:
+            if not breaker.allow():
+                raise CircuitOpenError("Circuit open for {}".format(url))
+            bucket.acquire()
+            if attempt > 0 and hasattr(body, "seek"):
+                body.seek(position)
+
+            start = time.monotonic()
+            try:
+                r = super(limited_session, self).request(
+                    method, url, *args, **kwargs
+                )
+            except (requests.ConnectionError, requests.Timeout):
+                bucket.update(time.monotonic() - start, 503)
+                breaker.failure()
+                if attempt >= retries:
+                    raise
+            else:
+                bucket.update(
+                    time.monotonic() - start, r.status_code, retry_after(r.headers)
+                )
+                # a 500 is an answer, a gateway error means the host is down
+                if r.status_code >= 500 and r.status_code in RETRY_STATUS:
+                    breaker.failure()
+                else:
+                    breaker.success()
+
+                if r.status_code not in RETRY_STATUS or attempt >= retries:
+                    return r
+                r.close()
+
+            # the bucket waits for a Retry-After of the server
+            time.sleep(backoff(attempt))
+            attempt = attempt + 1
+
+
+def backoff(attempt):
+    """ Returns the exponential backoff of an attempt with full jitter """
+    return random.uniform(0, min(MAX_BACKOFF, BACKOFF * 2 ** attempt))
+
+
+def body_position(body):
+    """
+    Returns the position a stream body is rewound to before a retry, None if
+    the body can not be sent again
+    """
+    if body is None or isinstance(body, (bytes, str, dict, list, tuple)):
+        return 0
+    try:
+        if body.seekable():
+            return body.tell()
+    except (AttributeError, OSError, ValueError):
+        pass
+    return None
+
+
+def retry_after(headers):
+    """ Returns the Retry-After header in seconds if given in seconds """
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+_local = threading.local()
+
+
+def session():
+    """ Returns the limited session of the current thread, with metrics """
+    if not hasattr(_local, "session"):
+        _local.session = limited_session()
+        _local.session.hooks["response"].append(METRICS.hook())
+    return _local.session
+
+
+def get(url, **kwargs):
+    return session().get(url, **kwargs)
+
+
+def post(url, **kwargs):
+    return session().post(url, **kwargs)
+
+
+def put(url, **kwargs):
+    return session().put(url, **kwargs)
+
+
+def patch(url, **kwargs):
+    return session().patch(url, **kwargs)
+
+
+def delete(url, **kwargs):
+    return session().delete(url, **kwargs)
@@ -6,7 +6,12 @@ Created on Wed Jul 24 08:24:31 2019
 """
 # Third-party imports
 import copy
+import hashlib
 from xml.dom import minidom
+from xml.etree import ElementTree
+
+# Globals
+FIELD_NAME_LENGTH = 10  # esri shape standard of the published field names
 
 
 class wrap_sld:
@@ -49,7 +54,7 @@ class wrap_sld:
             original = item.firstChild.nodeValue
             item.firstChild.nodeValue = original.lower()
 
-    def cut_len_all_property_names(self, _len=10):
+    def cut_len_all_property_names(self, _len=FIELD_NAME_LENGTH):
         items = self.root_copy.getElementsByTagName("ogc:PropertyName")
         for item in items:
             original = item.firstChild.nodeValue
@@ -70,12 +75,58 @@ class wrap_sld:
     def get_xml(self):
         return self.root_copy.toxml()
 
+    def get_hash(self):
+        return sld_hash(self.get_xml())
+
     def write_xml(self, file_name):
         file_handle = open("{}".format(file_name), "w")
         self.root_copy.writexml(file_handle)
         file_handle.close()
 
 
+def cut_field_names(field_names, length=FIELD_NAME_LENGTH):
+    """
+    Returns the field names cut to a length as by cut_len_all_property_names,
+    a cut name that is already taken ends with a number as in a shapefile
+    """
+    cut_names = []
+    for field_name in field_names:
+        cut_name = field_name[:length]
+        number = 1
+        while cut_name in cut_names:
+            suffix = "_{}".format(number)
+            cut_name = field_name[: length - len(suffix)] + suffix
+            number = number + 1
+        cut_names.append(cut_name)
+    return cut_names
+
+
+def normalize_element(element):
+    """
+    Returns a canonical string of an element: namespaces expanded, attributes
+    sorted and whitespace and comments ignored. GeoServer may store an sld
+    with other prefixes and indentation than it was uploaded with.
+    """
+    attributes = " ".join(
+        "{}={!r}".format(key, value) for key, value in sorted(element.attrib.items())
+    )
+    text = (element.text or "").strip()
+    children = "".join(
+        normalize_element(child)
+        for child in element
+        if isinstance(child.tag, str)
+    )
+    return "<{} {}>{}{}</>".format(element.tag, attributes, text, children)
+
+
+def sld_hash(xml):
+    """ Returns the sha256 of the normalized sld """
+    if isinstance(xml, str):
+        xml = xml.encode("utf-8")
+    normalized = normalize_element(ElementTree.fromstring(xml))
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
 def percentage_match(shape_field_name, sld_field_name):
 
     len_sld_field_name = len(sld_field_name)
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+Temporary datasources of the intermediate vector results.
+
+Every operation of core.vector writes its result to a new temporary
+datasource. A vector frees its previous result when an operation replaces
+it and its current result when it is closed. Results of helper vectors are
+freed at the end of a scope, after the helper vectors are closed:
+
+    with TEMP_DATASOURCES.scope():
+        extent = vector(path)
+        extent.correct(extent.layer)
+        ...
+        extent.close()
+
+Backends:
+    memory      ogr Memory driver, freed with the last reference
+    vsimem      geopackage in /vsimem, freed with gdal.Unlink
+    spill       geopackage in /vsimem, on disk while more than spill_size
+                bytes are in /vsimem
+"""
+# system imports
+import os
+import shutil
+import threading
+from tempfile import mkdtemp
+from contextlib import contextmanager
+
+# Third-party imports
+import ogr
+import gdal
+
+# Globals
+BACKENDS = ("memory", "vsimem", "spill")
+SPILL_SIZE = 1024 ** 3  # bytes
+DRIVER_OGR_GPKG = ogr.GetDriverByName("GPKG")
+DRIVER_OGR_MEM = ogr.GetDriverByName("Memory")
+
+
+def vsimem_bytes():
+    """ Returns the size of all files in /vsimem """
+    size = 0
+    for name in gdal.ReadDirRecursive("/vsimem/") or []:
+        stat = gdal.VSIStatL("/vsimem/" + name)
+        if stat is not None and not stat.IsDirectory():
+            size += stat.size
+    return size
+
+
+class temp_datasources(object):
+    """
+    Creates, tracks and frees the temporary datasources of a process.
+    Datasources that are not temporary are never freed.
+    """
+
+    def __init__(self, backend="memory", spill_size=SPILL_SIZE):
+        self.backend = backend
+        self.spill_size = spill_size
+        self.directory = None
+        self.count = 0
+        self.paths = set()
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def configure(self, backend="memory", spill_size=SPILL_SIZE):
+        if backend not in BACKENDS:
+            raise ValueError("temporary backend should be one of", BACKENDS)
+        self.backend = backend
+        self.spill_size = spill_size
+
+    def scopes(self):
+        if not hasattr(self.local, "scopes"):
+            self.local.scopes = []
+        return self.local.scopes
+
+    def spill_directory(self):
+        with self.lock:
+            if self.directory is None:
+                self.directory = mkdtemp(prefix="nens_vector_")
+            return self.directory
+
+    def create(self, name="mem"):
+        """ Returns a new empty datasource of the configured backend """
+        with self.lock:
+            self.count = self.count + 1
+            # pid, forked processes share the spill directory
+            name = "{}_{}_{}".format(name, os.getpid(), self.count)
+
+        if self.backend == "memory":
+            return DRIVER_OGR_MEM.CreateDataSource(name)
+
+        path = "/vsimem/{}.gpkg".format(name)
+        if self.backend == "spill" and vsimem_bytes() > self.spill_size:
+            path = os.path.join(self.spill_directory(), name + ".gpkg")
+
+        ds = DRIVER_OGR_GPKG.CreateDataSource(path)
+        with self.lock:
+            self.paths.add(path)
+
+        scopes = self.scopes()
+        if len(scopes) > 0:
+            scopes[-1].append(path)
+        return ds
+
+    def free(self, path):
+        """ Unlinks a temporary file, returns False if it is not freed """
+        with self.lock:
+            if path not in self.paths:
+                return False
+
+        try:
+            freed = gdal.Unlink(path) == 0
+        except RuntimeError:
+            # e.g. a file on disk that is still open on windows
+            freed = False
+
+        if freed:
+            with self.lock:
+                self.paths.discard(path)
+        return freed
+
+    def keep(self, ds):
+        """ Moves a datasource of the current scope to the enclosing scope """
+        scopes = self.scopes()
+        path = ds.GetName()
+        if len(scopes) > 0 and path in scopes[-1]:
+            scopes[-1].remove(path)
+            if len(scopes) > 1:
+                scopes[-2].append(path)
+
+    @contextmanager
+    def scope(self):
+        """ Frees the temporary datasources created in the scope """
+        paths = []
+        self.scopes().append(paths)
+        try:
+            yield self
+        finally:
+            self.scopes().remove(paths)
+            for path in paths:
+                self.free(path)
+
+    def live(self):
+        """ Returns the number of temporary files and the bytes in /vsimem """
+        with self.lock:
+            count = len(self.paths)
+        return count, vsimem_bytes()
+
+    def clear(self):
+        """ Frees all temporary datasources and the spill directory """
+        with self.lock:
+            paths = list(self.paths)
+        for path in paths:
+            self.free(path)
+
+        with self.lock:
+            if self.directory is not None:
+                shutil.rmtree(self.directory, ignore_errors=True)
+                self.directory = None
+
+
+TEMP_DATASOURCES = temp_datasources()
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Structured timing of the upload stages.
+
+Every stage of a layer becomes a json line in timing.jsonl next to the
+inifile with the layer, stage, duration, processed features, input vertices,
+http bytes and http requests. The measured throughput of core.planner is
+derived from these records. The http counters come from the request metrics
+of geoserver.metrics and are counted per thread, so parallel workers do not
+count each other's requests.
+"""
+# system imports
+import json
+import datetime
+import threading
+from time import perf_counter
+from contextlib import contextmanager
+
+# Local imports
+from geoserver.metrics import METRICS
+
+# Globals
+SUMMARY_SIZE = 10
+
+
+class timer(object):
+    """ Collects timing records and appends them to a json lines file """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.batch = datetime.datetime.now().isoformat()
+        self.records = []
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, layer, stage):
+        """ Times a stage, the yielded record can be given a feature count """
+        record = {
+            "batch": self.batch,
+            "layer": layer,
+            "stage": stage,
+            "features": None,
+            "vertices": None,
+        }
+        requests, http_bytes = METRICS.thread_counts()
+        start = perf_counter()
+        try:
+            yield record
+        except Exception as e:
+            record["error"] = str(e)
+            raise
+        finally:
+            record["duration"] = round(perf_counter() - start, 3)
+            end_requests, end_bytes = METRICS.thread_counts()
+            record["requests"] = end_requests - requests
+            record["bytes"] = end_bytes - http_bytes
+            self.add([record])
+
+    def add(self, records):
+        with self.lock:
+            self.records.extend(records)
+            if self.path is None:
+                return
+
+            with open(self.path, "a") as jsonl_file:
+                for record in records:
+                    jsonl_file.write(json.dumps(record) + "\n")
+
+    def totals(self, key):
+        """ Returns the summed duration per layer or per stage, slowest first """
+        totals = {}
+        for record in self.records:
+            totals[record[key]] = totals.get(record[key], 0) + record["duration"]
+        return sorted(totals.items(), key=lambda x: x[1], reverse=True)
+
+    def summary(self, size=SUMMARY_SIZE):
+        """ Returns the slowest stages, layers and layer stages """
+        records = sorted(self.records, key=lambda r: r["duration"], reverse=True)
+        return {
+            "stages": self.totals("stage")[:size],
+            "layers": self.totals("layer")[:size],
+            "slowest": [
+                (r["layer"], r["stage"], r["duration"]) for r in records[:size]
+            ],
+            "requests": sum(r["requests"] for r in self.records),
+            "bytes": sum(r["bytes"] for r in self.records),
+        }
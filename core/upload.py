@@ -0,0 +1,407 @@
+# -*- coding: utf-8 -*-
+"""
+The stages of the upload of a single layer.
+
+prepare runs the cpu stages (corrections, mask and field pruning) and returns
+the vector to publish, publish runs the network stages (postgis, geoserver,
+sld and lizard). nens_gs_uploader runs them per layer of a batch,
+benchmark_upload runs publish against a mock geoserver.
+"""
+# system imports
+from contextlib import contextmanager
+
+# Local imports
+from core.postgis import (
+    PG_DATABASE,
+    copy2pg_database,
+    add_metadata_pgdatabase,
+    get_metadata_fingerprints,
+    _clear_connections_database,
+)
+from core.project import log_time, print_list
+from core.vector import vector_to_geom
+from core.vector import vector as wrap_shape
+from core.wrap import wrap_geoserver
+from core.sld import wrap_sld, FIELD_NAME_LENGTH
+from core.fingerprint import data_fingerprint, style_fingerprint
+from core.planner import (
+    layer_vertices,
+    VERTEX_RATES,
+    CORRECTION,
+    CLIP,
+    PRUNE,
+    PG_LOAD,
+    PUBLISH,
+    STYLE,
+    WMS,
+)
+from core.journal import (
+    CORRECTED,
+    PG_LOADED,
+    PUBLISHED,
+    STYLED,
+    WMS_REGISTERED,
+)
+
+# Number of features read to estimate the cost of a layer
+COST_SAMPLE = 1000
+
+
+@contextmanager
+def timed(setting, stage):
+    """ Logs a numbered stage of a layer and writes its timing record """
+    log_time("info", setting.layer_name, stage)
+    with setting.timer.stage(setting.layer_name, stage) as record:
+        record["vertices"] = getattr(setting, "vertices", None)
+        yield record
+
+
+def measure_vertices(setting, vector):
+    """
+    Estimates the vertices of a layer for the measured throughput when they
+    are not estimated by the planner, from the first features as the planner
+    does, before the vertex based stages
+    """
+    if getattr(setting, "throughput", None) is None:
+        return
+
+    if getattr(setting, "vertices", None) is None:
+        info = getattr(setting, "info", None)
+        if info is None:
+            setting.vertices = layer_vertices(vector.layer, COST_SAMPLE)
+        else:
+            setting.vertices = info["vertices"]
+
+
+def measure(setting, stage, *records):
+    """ Adds the duration of the timing records of a stage to the throughput """
+    if getattr(setting, "throughput", None) is None:
+        return
+
+    if stage in VERTEX_RATES:
+        units = records[0]["vertices"]
+        if units is None:
+            return
+    else:
+        units = 1
+    seconds = sum(record["duration"] for record in records)
+    setting.throughput.add(stage, units, seconds)
+
+
+def prepare(setting):
+    """ Returns the corrected, clipped and pruned vector (cpu stages) """
+    log_time("info", setting.layer_name, "0. starting.....")
+
+    if isinstance(setting.in_datasource, dict) and setting.clear_connections:
+        _clear_connections_database(setting.in_datasource)
+
+    vector = None
+    if setting.unchanged:
+        return vector
+
+    if PG_LOADED in setting.done:
+        log_time("info", setting.layer_name, "1. Skipping corrections (journal).")
+        return vector
+
+    if not (setting.skip_gs_upload and setting.skip_pg_upload):
+        vector = wrap_shape(setting.in_datasource, setting.in_layer)
+
+    # fields that are not in the sld are not read, the input datasource is
+    # kept until its ignored fields are reset
+    in_datasource, in_layer = None, None
+    if vector is not None and not setting.skip_delete_excess_field_names:
+        sld_fields = sld_field_names(setting)
+        if len(sld_fields) > 0:
+            in_datasource, in_layer = vector.ds, vector.layer
+            ignored = vector.project(sld_fields)
+            log_time("info", setting.layer_name, f"Ignoring {len(ignored)} fields")
+
+    if vector is not None:
+        measure_vertices(setting, vector)
+
+    if not setting.skip_correction:
+        with timed(setting, "1. vector corrections") as record:
+            vector.correct(
+                vector.layer,
+                setting.layer_name,
+                setting.epsg,
+                engine=getattr(setting, "correct_engine", "ogr"),
+                workers=getattr(setting, "geometry_workers", 1),
+            )
+            setting.layer_name = vector.layer_name
+            record["features"] = vector.layer.GetFeatureCount()
+        measure(setting, CORRECTION, record)
+
+    if not setting.skip_mask:
+        with timed(setting, "1.2 vector corrections - mask") as record:
+            vector_geom = vector_to_geom(setting.mask_path, setting.epsg)
+            vector.clip(
+                vector.layer,
+                vector_geom,
+                workers=getattr(setting, "geometry_workers", 1),
+            )
+            record["features"] = vector.layer.GetFeatureCount()
+        measure(setting, CLIP, record)
+
+    if (not setting.skip_mask) or (not setting.skip_correction):
+        if vector.ds[0].GetFeatureCount() == 0:
+            log_time("error", setting.layer_name, "vector feature count is 0")
+        if vector.ds == None:
+            log_time("error", setting.layer_name, "Datasource is none")
+        if vector.ds[0][0] == None:
+            log_time("error", setting.layer_name, "Feature is none")
+
+    if not setting.skip_delete_excess_field_names:
+        with timed(setting, "1.3 delete excess field names") as record:
+            if in_layer is not None:
+                if vector.layer is in_layer:
+                    # not copied by the corrections or the clip
+                    vector.prune()
+                in_layer.SetIgnoredFields([])
+                in_datasource, in_layer = None, None
+
+                vector.info(vector.layer)
+                for field_name in vector.get_all_field_names():
+                    log_time("info", f"Keeping '{field_name.lower()}' field in vector")
+            record["features"] = vector.layer.GetFeatureCount()
+        measure(setting, PRUNE, record)
+
+    if (not setting.skip_mask) or (not setting.skip_correction):
+        finish_stage(setting, CORRECTED)
+
+    return vector
+
+
+def sld_field_names(setting):
+    """ Returns the lowered property names of the sld of a layer """
+    sld = wrap_sld(setting.in_sld_path, _type="path")
+    sld.lower_all_property_names()
+    return sld.get_all_property_names()
+
+
+def publish(setting, vector):
+    """ Uploads to postgis, geoserver and lizard (network stages) """
+    if setting.unchanged:
+        log_time("info", setting.layer_name, "1-12. Unchanged data and style.")
+        return setting.wms_url, setting.slug
+
+    if PG_LOADED in setting.done:
+        log_time("info", setting.layer_name, "2. Already in pg database (journal).")
+
+    elif not setting.skip_pg_upload:
+        measure_vertices(setting, vector)
+        with timed(setting, "2. Upload shape to pg database.") as record:
+            if setting.clear_connections:
+                _clear_connections_database(PG_DATABASE[setting.server_naam])
+
+            pg_database = wrap_shape(get_pg_details(setting))
+            if not setting.product_naam == "flooding" and setting.set_metadata:
+                add_metadata_pgdatabase(setting, pg_database.ds)
+
+            schema_layers = [layer.split(".")[-1] for layer in pg_database.layers]
+            pg_layer_present = setting.layer_name in schema_layers
+
+            if not pg_layer_present or setting.overwrite_postgres:
+                # the columns are cut as the property names of the checked sld
+                field_name_length = FIELD_NAME_LENGTH
+                if setting.skip_sld_check:
+                    field_name_length = None
+
+                copy2pg_database(
+                    pg_database.ds,
+                    vector.ds,
+                    vector.layer,
+                    setting.layer_name,
+                    setting.schema_name,
+                    field_name_length=field_name_length,
+                )
+                record["features"] = vector.layer.GetFeatureCount()
+
+            else:
+                log_time("info", setting.layer_name, "Layer already in database.")
+
+            pg_database.get_layer(setting.layer_name.lower())
+            pg_database.lower_all_field_names()
+        measure(setting, PG_LOAD, record)
+        finish_stage(setting, PG_LOADED)
+
+    if not setting.skip_gs_upload:
+        server = setting.server
+        if PUBLISHED in setting.done:
+            log_time("info", setting.layer_name, "3-5. Already published (journal).")
+            server.workspace_name = setting.workspace_name
+            server.get_layer(setting.slug, easy=True)
+
+        else:
+            with timed(setting, "3. Create workspace.") as workspace_record:
+                server.create_workspace(setting.workspace_name)
+
+            with timed(setting, "4. Create store.") as store_record:
+                pg_details = PG_DATABASE[setting.server_naam]
+                server.create_postgis_datastore(
+                    setting.store_name, setting.workspace_name, pg_details
+                )
+
+            with timed(setting, "5. Publish featuretype.") as publish_record:
+                server.publish_layer(
+                    setting.layer_name,
+                    setting.workspace_name,
+                    setting.overwrite_feature,
+                    setting.epsg,
+                    reload=True,
+                    in_place=setting.overwrite_in_place,
+                )
+            measure(setting, PUBLISH, workspace_record, store_record, publish_record)
+            finish_stage(setting, PUBLISHED)
+
+        if STYLED in setting.done:
+            log_time("info", setting.layer_name, "6-9. Already styled (journal).")
+
+        elif setting.use_existing_geoserver_sld:
+            with timed(setting, "6-9. Setting existing sld.") as record:
+                server.set_sld_for_layer(
+                    workspace_name=None,
+                    style_name=setting.existing_sld,
+                    use_custom=True,
+                    skip_identical=setting.skip_identical_sld,
+                )
+            measure(setting, STYLE, record)
+            finish_stage(setting, STYLED)
+
+        else:
+            records = []
+            with timed(setting, "6. Load Style Layer Descriptor.") as record:
+                sld = wrap_sld(setting.in_sld_path, _type="path")
+            records.append(record)
+
+            if not setting.skip_sld_check:
+                with timed(setting, "7. Check sld.") as record:
+                    # lower all and cut field names to esri shape standards
+                    sld.lower_all_property_names()
+                    sld.cut_len_all_property_names(_len=FIELD_NAME_LENGTH)
+                records.append(record)
+
+            with timed(setting, "8. Upload sld.") as record:
+                if setting.shared_styles:
+                    server.upload_shared_sld(setting.workspace_name, sld.get_xml())
+
+                else:
+                    style_name = setting.layer_name + "_style"
+                    server.upload_sld(
+                        style_name,
+                        setting.workspace_name,
+                        sld.get_xml(),
+                        setting.overwrite_sld,
+                        in_place=setting.overwrite_in_place,
+                        skip_identical=setting.skip_identical_sld,
+                    )
+            records.append(record)
+
+            with timed(setting, "9. Connect sld to layer.") as record:
+                server.set_sld_for_layer(skip_identical=setting.skip_identical_sld)
+            records.append(record)
+            measure(setting, STYLE, *records)
+            finish_stage(setting, STYLED)
+
+        # log_time("info", setting.layer_name, "10. Add to abstract.")
+        # if setting.overwrite_abstract:
+        #     server.write_abstract(setting.abstract_data)
+
+        # log_time("info", setting.layer_name, "11. Add to title.")
+        # if setting.overwrite_title:
+        #     server.write_title(setting.title_data)
+
+    if WMS_REGISTERED in setting.done:
+        log_time("info", setting.layer_name, "12. Already a wms layer (journal).")
+
+    elif not setting.skip_lizard_wms_layer:
+        with timed(setting, "12. Add wms layer.") as record:
+            if not setting.skip_gs_upload:
+                gs_wms_server = setting.server
+                gs_wms_server.get_layer(setting.slug)
+                setting.wmslayer.configuration["wms_url"] = setting.wms_url
+                download_url = setting.wmslayer.get_download_url(
+                    setting.wms_url, setting.slug
+                )
+                setting.wmslayer.configuration["download_url"] = download_url
+                setting.wmslayer.configuration["slug"] = setting.slug[:64]
+
+            else:
+                gs_wms_server = wrap_geoserver(setting.wmsserver, easy=True)
+                gs_wms_server.get_layer(setting.wmsslug)
+
+            latlon_bbox = gs_wms_server.layer_latlon_bbox
+            setting.wmslayer.configuration["spatial_bounds"] = {
+                "south": latlon_bbox[2],
+                "west": latlon_bbox[0],
+                "north": latlon_bbox[3],
+                "east": latlon_bbox[1],
+            }
+
+            setting.wmslayer.create(setting.wmslayer.configuration, overwrite=True)
+        measure(setting, WMS, record)
+        finish_stage(setting, WMS_REGISTERED)
+
+    if use_fingerprint_metadata(setting):
+        with timed(setting, "Writing fingerprints to metadata."):
+            setting.metadata["data_hash"] = setting.data_hash
+            setting.metadata["style_hash"] = setting.style_hash
+            pg_database = wrap_shape(get_pg_details(setting))
+            add_metadata_pgdatabase(setting, pg_database.ds)
+
+    log_time("info", setting.layer_name, "13. Returning wms, slug")
+    return setting.wms_url, setting.slug
+
+
+def get_pg_details(setting):
+    """ Returns the pg database details of the server for this layer """
+    pg_details = dict(PG_DATABASE[setting.server_naam])
+    if setting.database_name is not None:
+        pg_details["database"] = setting.database_name
+    return pg_details
+
+
+def use_fingerprint_metadata(setting):
+    return (
+        setting.skip_unchanged
+        and not setting.skip_pg_upload
+        and not setting.product_naam == "flooding"
+    )
+
+
+def set_fingerprints(setting):
+    """
+    Sets the data and style hash of a layer and whether they match the hashes
+    in the metadata table of the pg database.
+    """
+    setting.data_hash = None
+    setting.style_hash = None
+    setting.unchanged = False
+    if not (setting.skip_unchanged or setting.journal is not None):
+        return setting
+
+    setting.data_hash = data_fingerprint(setting)
+    setting.style_hash = style_fingerprint(setting)
+
+    if use_fingerprint_metadata(setting):
+        pg_database = wrap_shape(get_pg_details(setting))
+        stored = get_metadata_fingerprints(setting.layer_name, pg_database.ds)
+        setting.unchanged = stored == (setting.data_hash, setting.style_hash)
+    return setting
+
+
+def set_journal(setting):
+    """ Sets the fingerprint and the stages already finished for a layer """
+    setting.fingerprint = None
+    setting.done = set()
+    if setting.journal is not None:
+        setting.fingerprint = setting.data_hash + ":" + setting.style_hash
+        setting.done = setting.journal.done(setting.slug, setting.fingerprint)
+        if len(setting.done) > 0:
+            print_list(sorted(setting.done), "Finished stages " + setting.slug)
+    return setting
+
+
+def finish_stage(setting, stage):
+    if setting.journal is not None:
+        setting.journal.add(setting.slug, stage, setting.fingerprint)
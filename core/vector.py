@@ -15,7 +15,9 @@ import gdal
 import rtree
 from tqdm import tqdm
 
-from core.postgis import connect2pg_database
+from core.postgis import PG_CONNECTIONS
+from core.parallel import execute
+from core.temporary import TEMP_DATASOURCES
 
 
 # Global DRIVERS
@@ -23,7 +25,9 @@ DRIVER_GDAL_MEM = gdal.GetDriverByName("MEM")
 DRIVER_OGR_SHP = ogr.GetDriverByName("ESRI Shapefile")
 DRIVER_OGR_GPKG = ogr.GetDriverByName("GPKG")
 DRIVER_OGR_MEM = ogr.GetDriverByName("Memory")
-_mem_num = 0
+
+# Difference geometries and their rtree of the current process
+_difference_index = None
 
 # Shapes
 POLYGON = "POLYGON (({x1} {y1},{x2} {y1},{x2} {y2},{x1} {y2},{x1} {y1}))"
@@ -42,7 +46,7 @@ class vector(object):
         if type(ds) is str:
             self.ds = ogr.Open(ds, 1)
         elif type(ds) is dict:
-            self.ds = ogr.Open(connect2pg_database(ds), 1)
+            self.ds = PG_CONNECTIONS.datasource(ds)
         else:
             self.ds = ds
 
@@ -126,6 +130,22 @@ class vector(object):
     def get_all_field_names(self):
         return [str(field_name) for field_name in self.get_field_names()]
 
+    def project(self, field_names):
+        """
+        Ignores the fields that are not in field_names when reading, the
+        operations do not copy ignored fields. Returns the ignored fields.
+        """
+        keep = [field_name.lower() for field_name in field_names]
+        ignored = [f for f in self.field_names if f.lower() not in keep]
+        self.layer.SetIgnoredFields(ignored)
+        return ignored
+
+    def prune(self):
+        """ Replaces the layer by a copy without its ignored fields """
+        ds = copy_layer(self.layer, self.layer.GetName())
+        self.change_source(ds, ds[0])
+        self.info(self.layer)
+
     def copy_shell(self, layer_name="mem", geom_type=ogr.wkbPolygon):
         return copymem(self.layer, layer_name="mem", geom_type=geom_type)
 
@@ -176,8 +196,12 @@ class vector(object):
         self.layer.SetSpatialFilter(None)
 
     def close(self):
+        """ Closes the datasource, a temporary datasource is freed """
+        path = None if self.ds is None else self.ds.GetName()
         self.layer = None
         self.ds = None
+        if path is not None:
+            TEMP_DATASOURCES.free(path)
 
     def lower_all_field_names(self):
         for field_defn in self.get_field_defns():
@@ -261,47 +285,49 @@ class vector(object):
         append_feature(self.layer, self.layer_defn, geometry, attributes)
 
     def change_source(self, in_ds, in_layer):
+        """ Replaces the datasource, a temporary datasource is freed """
+        path = None
+        if self.ds is not None and self.ds is not in_ds:
+            path = self.ds.GetName()
         self.ds = None
         self.layer = None
         self.ds = in_ds
         self.layer = in_layer
+        if path is not None:
+            TEMP_DATASOURCES.free(path)
 
-    def correct(self, layer, name="", epsg=28992):
-        self.ds_correct, layer_name = correct(layer, layer_name=name, epsg=epsg)
-        self.layer_correct = self.ds_correct[0]
-        self.change_source(self.ds_correct, self.layer_correct)
+    def correct(self, layer, name="", epsg=28992, engine="ogr", workers=1):
+        ds, layer_name = correct(
+            layer, layer_name=name, epsg=epsg, engine=engine, workers=workers
+        )
+        self.change_source(ds, ds[0])
         self.layer_name = layer_name
 
-    def clip(self, layer, clip_geom):
-        self.ds_clip = clip(layer, clip_geom)
-        self.layer_clip = self.ds_clip[0]
-        self.change_source(self.ds_clip, self.layer_clip)
+    def clip(self, layer, clip_geom, workers=1):
+        ds = clip(layer, clip_geom, workers)
+        self.change_source(ds, ds[0])
 
-    def buffer(self, layer, buffer_size):
-        self.ds_buffer = buffer(layer, buffer_size)
-        self.layer_buffer = self.ds_buffer[0]
-        self.change_source(self.ds_buffer, self.layer_buffer)
+    def buffer(self, layer, buffer_size, workers=1):
+        ds = buffer(layer, buffer_size, workers)
+        self.change_source(ds, ds[0])
 
     def dissolve(self, layer, value=None):
-        self.ds_dissolve = dissolve(layer, value)
-        self.layer_dissolve = self.ds_dissolve[0]
-        self.change_source(self.ds_dissolve, self.layer_dissolve)
+        ds = dissolve(layer, value)
+        self.change_source(ds, ds[0])
 
-    def difference(self, vector_layer, difference_layer):
-        self.ds_difference = difference(vector_layer, difference_layer)
-        self.layer_difference = self.ds_difference[0]
-        self.change_source(self.ds_difference, self.layer_difference)
+    def difference(self, vector_layer, difference_layer, workers=1):
+        ds = difference(vector_layer, difference_layer, workers)
+        self.change_source(ds, ds[0])
 
-    def multi2single(self, vector_layer):
-        self.ds_single = multiparts_to_singleparts(vector_layer)
-        self.layer_single = self.ds_single[0]
-        self.change_source(self.ds_single, self.layer_single)
+    def multi2single(self, vector_layer, workers=1):
+        ds = multiparts_to_singleparts(vector_layer, workers)
+        self.change_source(ds, ds[0])
 
 
 def get_data(vector_layer):
     data = {}
-    for fid in range(vector_layer.GetFeatureCount()):
-        feature = vector_layer[fid]
+    vector_layer.ResetReading()
+    for feature in vector_layer:
         count = 0
         if feature:
             count = +1
@@ -338,10 +364,8 @@ def create_prj_file(path, epsg=28992):
 
 
 def create_mem_ds():
-    global _mem_num
-    mem_datasource = DRIVER_OGR_SHP.CreateDataSource("/vsimem/mem{}".format(_mem_num))
-    _mem_num = _mem_num + 1
-    return mem_datasource
+    """ Returns a temporary datasource, see core.temporary """
+    return TEMP_DATASOURCES.create()
 
 
 def create_mem_layer(layer_name, geom_type, epsg):
@@ -362,11 +386,11 @@ def geom_transform(in_spatial_ref, out_epsg):
 def create_index(layer):
     layer.ResetReading()
     index = rtree.index.Index(interleaved=False)
-    for fid1 in range(0, layer.GetFeatureCount()):
-        feature1 = layer.GetFeature(fid1)
+    for feature1 in layer:
         geometry1 = feature1.GetGeometryRef()
         xmin, xmax, ymin, ymax = geometry1.GetEnvelope()
-        index.insert(fid1, (xmin, xmax, ymin, ymax))
+        index.insert(feature1.GetFID(), (xmin, xmax, ymin, ymax))
+    layer.ResetReading()
     return index
 
 
@@ -384,9 +408,36 @@ def copymem(vector_layer, layer_name="mem", geom_type=ogr.wkbPolygon):
         layer_name, vector_layer.GetSpatialRef(), geom_type
     )
 
+    # ignored fields are not copied, see vector.project
     vector_layer_defn = vector_layer.GetLayerDefn()
     for i in range(vector_layer_defn.GetFieldCount()):
-        out_layer.CreateField(vector_layer_defn.GetFieldDefn(i))
+        field_defn = vector_layer_defn.GetFieldDefn(i)
+        if not field_defn.IsIgnored():
+            out_layer.CreateField(field_defn)
+
+    out_layer = None
+    return out_datasource
+
+
+def copy_layer(in_layer, layer_name="mem"):
+    """ Copies a layer to a temporary datasource, without ignored fields """
+    out_datasource = copymem(in_layer, layer_name, in_layer.GetGeomType())
+    out_layer = out_datasource[0]
+    out_layer_defn = out_layer.GetLayerDefn()
+
+    transaction = out_layer.TestCapability(ogr.OLCTransactions)
+    if transaction:
+        out_layer.StartTransaction()
+
+    in_layer.ResetReading()
+    for in_feat in in_layer:
+        out_feat = ogr.Feature(out_layer_defn)
+        out_feat.SetFrom(in_feat)
+        out_layer.CreateFeature(out_feat)
+    in_layer.ResetReading()
+
+    if transaction:
+        out_layer.CommitTransaction()
 
     out_layer = None
     return out_datasource
@@ -445,16 +496,33 @@ def append_feature(layer, layer_defn, geometry, attributes):
 
     feature.SetGeometry(geometry)
     for key, value in attributes.items():
+        if layer_defn.GetFieldIndex(str(key)) < 0:
+            continue  # e.g. an ignored field
         feature[str(key)] = value
     layer.CreateFeature(feature)
     feature = None
     return layer
 
 
-def multiparts_to_singleparts(vector_layer):
-    out_datasource, out_layer = copymem(vector_layer, geom_type=ogr.wkbPolygon)
-    multipoly2poly(vector_layer, out_layer)
-    out_layer = None
+def singleparts(wkbs):
+    """ Returns the parts of the multipolygons and multilinestrings """
+    results = []
+    for wkb in wkbs:
+        if wkb is None:
+            results.append(None)
+            continue
+
+        geom = ogr.CreateGeometryFromWkb(wkb)
+        if geom.GetGeometryName() in ("MULTIPOLYGON", "MULTILINESTRING"):
+            results.append([geom_part.ExportToWkb() for geom_part in geom])
+        else:
+            results.append([wkb])
+    return results
+
+
+def multiparts_to_singleparts(vector_layer, workers=1):
+    out_datasource = copymem(vector_layer, geom_type=ogr.wkbPolygon)
+    execute(vector_layer, out_datasource[0], singleparts, workers=workers)
     return out_datasource
 
 
@@ -542,7 +610,7 @@ def fix_geometry(geometry):
     return geometry, geometry.IsValid()
 
 
-def correct(in_layer, layer_name="", epsg=3857):
+def correct(in_layer, layer_name="", epsg=3857, engine="ogr", workers=1):
     """
     This function standardizes a vector layer:
         1. Multipart to singleparts
@@ -557,6 +625,12 @@ def correct(in_layer, layer_name="", epsg=3857):
         The default is ''.
     epsg : int, optional
         The default is 3857.
+    engine : string, optional
+        'ogr' corrects feature by feature, 'shapely' corrects arrays of
+        geometries, see core.vectorized. The default is 'ogr'.
+    workers : int, optional
+        Number of processes of the 'ogr' engine, see core.parallel.
+        The default is 1.
 
     Raises
     ------
@@ -568,83 +642,125 @@ def correct(in_layer, layer_name="", epsg=3857):
     out_datasource : ogr datasource
 
     """
+    if engine == "shapely":
+        # imported here, core.vectorized imports this module
+        from core.vectorized import correct_arrays
+
+        return correct_arrays(in_layer, layer_name, epsg)
+
+    # retrieving lost features
+    in_feature_count = in_layer.GetFeatureCount()
+
+    # Get inspatial reference and geometry from in shape
+    geom_type = in_layer.GetGeomType()
+    in_spatial_ref = in_layer.GetSpatialRef()
+
+    flatten = False
+    geom_name = ogr.GeometryTypeToName(geom_type)
+    if "3D" in geom_name:
+        print("warning", "geom type: " + geom_name)
+        print("info", "Flattening to 2D")
+        flatten = True
+
+    elif geom_type < 0:
+        print("error", "geometry invalid, most likely has a z-type")
+        raise ValueError(
+            "geometry invalid, most likely has a z-type", "geom type: ", geom_name,
+        )
 
-    try:
-        # retrieving lost features
-        lost_features = []
-        in_feature_count = in_layer.GetFeatureCount()
-
-        # Get inspatial reference and geometry from in shape
-        geom_type = in_layer.GetGeomType()
-        in_spatial_ref = in_layer.GetSpatialRef()
-        in_layer.ResetReading()
-
-        mem_datasource = create_mem_ds()
-
-        mem_layer = mem_datasource.CreateLayer(layer_name, 
-                                               in_spatial_ref,
-                                               geom_type)
+    # Create output dataset and force dataset to multiparts
+    if geom_type == 6:
+        geom_type = 3  # polygon
 
-        layer_defn = in_layer.GetLayerDefn()
-        for i in range(layer_defn.GetFieldCount()):
-            field_defn = layer_defn.GetFieldDefn(i)
-            mem_layer.CreateField(field_defn)
+    elif geom_type == 5:
+        geom_type = 2  # linestring
 
-        print("info", "check - Multipart to singlepart")
-        lost_feat = multipoly2poly(in_layer, mem_layer)
-        lost_features = lost_features + lost_feat
+    elif geom_type == 4:
+        geom_type = 1  # point
 
-        if mem_layer.GetFeatureCount() == 0:
-            print("error", "Multipart to singlepart failed")
-            return 1
+    spatial_ref_3857 = osr.SpatialReference()
+    spatial_ref_3857.ImportFromEPSG(int(epsg))
 
-        spatial_ref_3857 = osr.SpatialReference()
-        spatial_ref_3857.ImportFromEPSG(int(epsg))
-        reproject = osr.CoordinateTransformation(in_spatial_ref, spatial_ref_3857)
+    out_datasource = create_mem_ds()
+    out_layer = out_datasource.CreateLayer(
+        layer_name or "mem", spatial_ref_3857, geom_type
+    )
 
-        flatten = False
-        geom_name = ogr.GeometryTypeToName(geom_type)
-        if "3D" in geom_name:
-            print("warning", "geom type: " + geom_name)
-            print("info", "Flattening to 2D")
-            flatten = True
+    # Copy fields to output dataset, except ogc_fid and ignored fields
+    fields = []
+    layer_defn = in_layer.GetLayerDefn()
+    for i in range(layer_defn.GetFieldCount()):
+        field_defn = layer_defn.GetFieldDefn(i)
+        if field_defn.name != "ogc_fid" and not field_defn.IsIgnored():
+            out_layer.CreateField(field_defn)
+            fields.append(i)
+
+    print("info", "check - Multipart to singlepart")
+    print("info", "check - Reproject layer to {}".format(str(epsg)))
+    in_wkt = None if in_spatial_ref is None else in_spatial_ref.ExportToWkt()
+    arguments = (geom_type, flatten, in_wkt, int(epsg))
+    missing, invalid = execute(
+        in_layer, out_layer, correct_geometries, arguments, workers, fields
+    )
+    for fid in missing:
+        print("warning", "FID {} has no geometry.".format(fid))
 
-        elif geom_type < 0:
-            print("error", "geometry invalid, most likely has a z-type")
-            raise ValueError(
-                "geometry invalid, most likely has a z-type", "geom type: ", geom_name,
-            )
+    if out_layer.GetFeatureCount() == 0 and len(invalid) == 0:
+        print("error", "Multipart to singlepart failed")
+        return 1
 
-        # Create output dataset and force dataset to multiparts
-        if geom_type == 6:
-            geom_type = 3  # polygon
+    print("info", "check  - Features count")
+    out_feature_count = out_layer.GetFeatureCount()
 
-        elif geom_type == 5:
-            geom_type = 2  # linestring
+    # fids of features without geometry, positions of invalid singleparts
+    lost_features = missing + invalid
+    if len(lost_features) > 0:
+        print(
+            "warning", "Lost {} features during corrections".format(len(lost_features)),
+        )
+        print("warning", "FIDS: {}".format(lost_features))
 
-        elif geom_type == 4:
-            geom_type = 1  # point
+    elif in_feature_count > out_feature_count:
+        print("warning", "In feature count greater than out feature count")
 
-        out_datasource = create_mem_ds()
-        out_layer = out_datasource.CreateLayer(layer_name, spatial_ref_3857, geom_type)
-        layer_defn = in_layer.GetLayerDefn()
+    out_layer = None
+    print("Finished vector corrections")
+    return out_datasource, layer_name
 
-        # Copy fields from memory layer to output dataset
-        for i in range(layer_defn.GetFieldCount()):
-            out_layer.CreateField(layer_defn.GetFieldDefn(i))
 
-        print("info", "check - Reproject layer to {}".format(str(epsg)))
-        for out_feat in tqdm(mem_layer):
-            out_geom = out_feat.GetGeometryRef()
+def correct_geometries(wkbs, geom_type, flatten, in_wkt, epsg):
+    """
+    Returns the corrected singleparts per geometry, see correct.
+    The spatial references are given as wkt and epsg, they do not pickle.
+    """
+    in_spatial_ref = osr.SpatialReference()
+    if in_wkt is not None:
+        in_spatial_ref.ImportFromWkt(in_wkt)
+        if hasattr(osr, "OAMS_TRADITIONAL_GIS_ORDER"):
+            # as the spatial reference of a layer
+            in_spatial_ref.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+
+    spatial_ref_3857 = osr.SpatialReference()
+    spatial_ref_3857.ImportFromEPSG(epsg)
+    reproject = osr.CoordinateTransformation(in_spatial_ref, spatial_ref_3857)
+
+    results = []
+    for parts in singleparts(wkbs):
+        if parts is None:
+            results.append(None)
+            continue
 
+        out_wkbs = []
+        for wkb in parts:
             try:
-                out_geom, valid = fix_geometry(out_geom)
+                out_geom, valid = fix_geometry(ogr.CreateGeometryFromWkb(wkb))
             except Exception as e:
                 print(e)
-                print(out_feat.GetFID())
+                valid = False
+
             if not valid:
                 print("warning", "geometry invalid even with buffer, skipping")
-                lost_features.append(out_feat.GetFID())
+                out_wkbs.append(None)
                 continue
 
             # Force and transform geometry
@@ -655,44 +771,9 @@ def correct(in_layer, layer_name="", epsg=3857):
             if flatten:
                 out_geom.FlattenTo2D()
 
-            # Set geometry and create feature
-            out_feat.SetGeometry(out_geom)
-            out_layer.CreateFeature(out_feat)
-
-        print("info", "check  - delete ogc_fid if exists")
-        out_layer_defn = out_layer.GetLayerDefn()
-        for n in range(out_layer_defn.GetFieldCount()):
-            field = out_layer_defn.GetFieldDefn(n)
-            if field.name == "ogc_fid":
-                out_layer.DeleteField(n)
-                break
-
-        print("info", "check  - Features count")
-        out_feature_count = out_layer.GetFeatureCount()
-
-        if len(lost_features) > 0:
-            print(
-                "warning",
-                "Lost {} features during corrections".format(len(lost_features)),
-            )
-            print("warning", "FIDS: {}".format(lost_features))
-
-        elif in_feature_count > out_feature_count:
-            print("warning", "In feature count greater than out feature count")
-
-        else:
-            pass
-
-    except Exception as e:
-        print(e)
-
-    finally:
-        mem_layer = None
-        mem_datasource = None
-        out_layer = None
-
-        print("Finished vector corrections")
-    return out_datasource, layer_name
+            out_wkbs.append(out_geom.ExportToWkb())
+        results.append(out_wkbs)
+    return results
 
 
 def dissolve(vector_layer, field=None, simplify=0):
@@ -720,8 +801,8 @@ def dissolve(vector_layer, field=None, simplify=0):
 
     if field:
         unique_dict = {}
-        for fid in range(0, vector_layer.GetFeatureCount()):
-            feature = vector_layer[fid]
+        for feature in vector_layer:
+            fid = feature.GetFID()
             field_name = feature[field]
             if not field_name in unique_dict:
                 unique_dict[field_name] = [fid]
@@ -741,8 +822,7 @@ def dissolve(vector_layer, field=None, simplify=0):
             append_feature(out_layer, out_layer_defn, union, feature.items())
     else:
         multi = ogr.Geometry(ogr.wkbMultiPolygon)
-        for fid in tqdm(range(0, vector_layer.GetFeatureCount())):
-            feature = vector_layer[fid]
+        for feature in tqdm(vector_layer):
             geometry = feature.geometry()
             if geometry:
                 if geometry.GetGeometryType() > 3:  # multipolygon
@@ -762,11 +842,13 @@ def dissolve(vector_layer, field=None, simplify=0):
     return out_datasource
 
 
-def difference(vector_layer, difference_layer):
+def difference(vector_layer, difference_layer, workers=1):
     """
     This function takes a difference between vector layer and difference layer.
     - Takes into account multiparts and single parts.
     - It also leaves geometries which are not valid. 
+    - The difference layer is fixed once and indexed with an rtree, every
+    geometry is subtracted by the union of its intersecting geometries.
 
     Parameters
     ----------
@@ -774,6 +856,8 @@ def difference(vector_layer, difference_layer):
         input vector.
     difference_layer : ogr layer
         difference layer.
+    workers : int, optional
+        Number of processes. The default is 1.
 
     Returns
     -------
@@ -789,66 +873,113 @@ def difference(vector_layer, difference_layer):
     elif vector_layer_geom_type == 3:
         geometry_types = [3, 6]
     else:
-        pass
+        geometry_types = [vector_layer_geom_type]
 
     out_datasource = copymem(vector_layer, geom_type=vector_layer_geom_type)
     out_layer = out_datasource[0]
-    vector_layer_defn = vector_layer.GetLayerDefn()
+
+    difference_wkbs = []
+    difference_layer.ResetReading()
+    for difference_feat in difference_layer:
+        difference_geom, valid = fix_geometry(difference_feat.GetGeometryRef())
+        if not valid:
+            print("Difference layer geometry not valid, skipping")
+            continue
+        difference_wkbs.append(difference_geom.ExportToWkb())
+    difference_layer.ResetReading()
 
     print("starting to make a difference_layer")
+    arguments = (difference_wkbs, geometry_types, vector_layer_geom_type)
+    execute(vector_layer, out_layer, difference_geometries, arguments, workers)
 
-    vector_layer.ResetReading()
-    for vector_feat in tqdm(vector_layer):
-        vector_geom = vector_feat.GetGeometryRef()
-        vector_geom, valid = fix_geometry(vector_geom)
+    out_layer = None
+    return out_datasource
 
-        if not valid:
-            print("Input geometry not valid, skipping")
-            continue
 
-        difference_layer.ResetReading()
-        difference_layer.SetSpatialFilter(vector_geom)
+def difference_index(difference_wkbs):
+    """
+    Returns the difference geometries and their rtree, these are built once
+    per process for the chunks of a difference.
+    """
+    global _difference_index
+    cached = _difference_index
+    if cached is None or cached[0] is not difference_wkbs:
+        geometries = [ogr.CreateGeometryFromWkb(wkb) for wkb in difference_wkbs]
+        index = rtree.index.Index(interleaved=False)
+        if len(geometries) > 0:
+            # bulk loaded
+            envelopes = ((i, g.GetEnvelope(), None) for i, g in enumerate(geometries))
+            index = rtree.index.Index(envelopes, interleaved=False)
+
+        cached = (difference_wkbs, geometries, index)
+        _difference_index = cached
+    return cached[1], cached[2]
+
+
+def union_geometries(geometries):
+    """ Returns the union of geometries, cascaded for polygons """
+    if len(geometries) == 1:
+        return geometries[0]
+
+    polygons = (ogr.wkbPolygon, ogr.wkbMultiPolygon)
+    if all(geometry.GetGeometryType() in polygons for geometry in geometries):
+        multi = ogr.Geometry(ogr.wkbMultiPolygon)
+        for geometry in geometries:
+            if geometry.GetGeometryType() == ogr.wkbMultiPolygon:
+                for single_geom in geometry:
+                    multi.AddGeometry(single_geom)
+            else:
+                multi.AddGeometry(geometry)
+        return multi.UnionCascaded()
 
-        for fid, difference_feat in enumerate(difference_layer):
-            difference_geom = difference_feat.GetGeometryRef()
-            difference_geom, valid = fix_geometry(difference_geom)
+    union = geometries[0]
+    for geometry in geometries[1:]:
+        union = union.Union(geometry)
+    return union
 
-            if not valid:
-                print("Difference layer geometry not valid, skipping")
-                continue
 
-            if difference_geom.Intersects(vector_geom):
-                difference = vector_geom.Difference(difference_geom)
+def difference_geometries(wkbs, difference_wkbs, geometry_types, geom_type):
+    """ Returns the difference per geometry, see difference """
+    difference_geoms, index = difference_index(difference_wkbs)
 
-                diff_part_type = difference.GetGeometryType()
-                if diff_part_type not in geometry_types:
+    results = []
+    for wkb in wkbs:
+        vector_geom = None if wkb is None else ogr.CreateGeometryFromWkb(wkb)
+        vector_geom, valid = fix_geometry(vector_geom)
 
-                    # Check if geometry collection
-                    if diff_part_type == ogr.wkbGeometryCollection:
-                        for geom_part in difference:
-                            if geom_part.GetGeometryType() == vector_layer_geom_type:
-                                vector_geom, valid = fix_geometry(geom_part)
+        if not valid:
+            print("Input geometry not valid, skipping")
+            results.append([])
+            continue
 
-                    else:
-                        name = ogr.GeometryTypeToName(diff_part_type)
-                        print("Found foreign geometry:", name)
-                        continue
+        candidates = [
+            difference_geoms[i]
+            for i in sorted(index.intersection(vector_geom.GetEnvelope()))
+            if difference_geoms[i].Intersects(vector_geom)
+        ]
 
-                else:
-                    vector_geom, valid = fix_geometry(difference)
+        if len(candidates) > 0:
+            difference = vector_geom.Difference(union_geometries(candidates))
 
-            else:
-                pass
+            diff_part_type = difference.GetGeometryType()
+            if diff_part_type in geometry_types:
+                vector_geom, valid = fix_geometry(difference)
 
-        out_layer = append_feature(
-            out_layer, vector_layer_defn, vector_geom, vector_feat.items()
-        )
+            # Check if geometry collection
+            elif diff_part_type == ogr.wkbGeometryCollection:
+                for geom_part in difference:
+                    if geom_part.GetGeometryType() == geom_type:
+                        vector_geom, valid = fix_geometry(geom_part)
 
-    out_layer = None
-    return out_datasource
+            else:
+                name = ogr.GeometryTypeToName(diff_part_type)
+                print("Found foreign geometry:", name)
+
+        results.append([vector_geom.ExportToWkb()])
+    return results
 
 
-def buffer(in_layer, buffer_size):
+def buffer(in_layer, buffer_size, workers=1):
     """
     Buffers all in_layer geometries .
 
@@ -856,6 +987,8 @@ def buffer(in_layer, buffer_size):
     ----------
     in_layer : ogr layer
     buffer : integer or float
+    workers : int, optional
+        Number of processes. The default is 1.
 
     Returns
     -------
@@ -864,23 +997,31 @@ def buffer(in_layer, buffer_size):
     """
 
     in_layer_geom_type = in_layer.GetGeomType()
-    in_layer.ResetReading()
 
     out_datasource = copymem(in_layer, geom_type=in_layer_geom_type)
     out_layer = out_datasource[0]
 
     print("starting buffer")
-    for out_feat in tqdm(in_layer):
-        out_geom = out_feat.GetGeometryRef().Buffer(buffer_size)
-        out_feat.SetGeometry(out_geom)
-        out_layer.CreateFeature(out_feat)
+    execute(in_layer, out_layer, buffer_geometries, (buffer_size,), workers)
 
     out_layer = None
 
     return out_datasource
 
 
-def clip(in_layer, clip_geom):
+def buffer_geometries(wkbs, buffer_size):
+    """ Returns the buffer per geometry """
+    results = []
+    for wkb in wkbs:
+        if wkb is None:
+            results.append(None)
+            continue
+        out_geom = ogr.CreateGeometryFromWkb(wkb).Buffer(buffer_size)
+        results.append([out_geom.ExportToWkb()])
+    return results
+
+
+def clip(in_layer, clip_geom, workers=1):
     """
     Clips in_layer geometries and clip_geom.
     - Multipart geometries are set as single part
@@ -893,6 +1034,8 @@ def clip(in_layer, clip_geom):
     ----------
     in_layer : ogr layer
     clip_geom : ogr geometry
+    workers : int, optional
+        Number of processes. The default is 1.
 
     Returns
     -------
@@ -901,17 +1044,32 @@ def clip(in_layer, clip_geom):
     """
 
     in_layer_geom_type = in_layer.GetGeomType()
-    in_layer.ResetReading()
     in_layer.SetSpatialFilter(clip_geom)
 
     out_datasource = copymem(in_layer, geom_type=in_layer_geom_type)
     out_layer = out_datasource[0]
 
     print("starting clip")
-    for out_feat in tqdm(in_layer):
-        out_geom = out_feat.GetGeometryRef()
+    arguments = (clip_geom.ExportToWkb(), in_layer_geom_type)
+    execute(in_layer, out_layer, clip_geometries, arguments, workers)
+
+    out_layer = None
+
+    return out_datasource
+
+
+def clip_geometries(wkbs, clip_wkb, geom_type):
+    """ Returns the clipped singleparts per geometry, see clip """
+    clip_geom = ogr.CreateGeometryFromWkb(clip_wkb)
+    clip_boundary = clip_geom.Boundary()
+
+    results = []
+    for wkb in wkbs:
+        out_wkbs = []
+        results.append(out_wkbs)
         try:
-            if out_geom.Intersects(clip_geom.Boundary()):
+            out_geom = ogr.CreateGeometryFromWkb(wkb)
+            if out_geom.Intersects(clip_boundary):
                 intersect = out_geom.Intersection(clip_geom)
                 intersect_type = intersect.GetGeometryType()
 
@@ -930,21 +1088,18 @@ def clip(in_layer, clip_geom):
                                 continue
 
                         geom_part_type = geom_part.GetGeometryType()
-                        if geom_part_type != in_layer_geom_type:
+                        if geom_part_type != geom_type:
                             name = ogr.GeometryTypeToName(geom_part_type)
                             print("Found foreign type:", name)
                             continue
 
-                        out_feat.SetGeometry(geom_part)
-                        out_layer.CreateFeature(out_feat)
+                        out_wkbs.append(geom_part.ExportToWkb())
 
                 else:
-                    out_feat.SetGeometry(intersect)
-                    out_layer.CreateFeature(out_feat)
+                    out_wkbs.append(intersect.ExportToWkb())
 
             elif out_geom.Within(clip_geom):
-                out_feat.SetGeometry(out_geom)
-                out_layer.CreateFeature(out_feat)
+                out_wkbs.append(wkb)
 
             else:
                 pass
@@ -952,9 +1107,7 @@ def clip(in_layer, clip_geom):
         except Exception as e:
             print(e)
 
-    out_layer = None
-
-    return out_datasource
+    return results
 
 
 def merge_directory(vector_path_list, simplify=0):
@@ -991,12 +1144,17 @@ def merge_directory(vector_path_list, simplify=0):
 
 
 def vector_to_geom(extent_path, epsg=28992):
-    extent_vector = vector(extent_path)
-    extent_vector.correct(extent_vector.layer, epsg=epsg)
-    extent_vector.dissolve(extent_vector.layer)
-    extent_feature = extent_vector.layer[0]
-    extent_geom = extent_feature.GetGeometryRef()
-    extent_geom = extent_geom.Buffer(0)
+    with TEMP_DATASOURCES.scope():
+        extent_vector = vector(extent_path)
+        extent_vector.correct(extent_vector.layer, epsg=epsg)
+        extent_vector.dissolve(extent_vector.layer)
+        extent_vector.layer.ResetReading()
+        extent_feature = extent_vector.layer.GetNextFeature()
+        extent_geom = extent_feature.GetGeometryRef().Buffer(0)
+
+        # closed before the scope frees its datasources
+        extent_feature = None
+        extent_vector.close()
     return extent_geom
 
 
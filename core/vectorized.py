@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+Array based geometry corrections.
+
+core.vector.correct handles a layer feature by feature. This engine reads
+all geometries of a layer once, corrects them as shapely arrays and writes
+the result back in one pass:
+    1. Multipolygons and multilinestrings to singleparts
+    2. Repair of the invalid polygons only
+    3. Reprojection of all coordinates at once with pyproj
+    4. 3D to 2D
+
+Lost features are reported the same way as by core.vector.correct. Shapely 2
+and pyproj are optional dependencies, see available().
+"""
+# Third-party imports
+import ogr
+import osr
+
+try:
+    import numpy as np
+    import shapely
+    from pyproj import CRS, Transformer
+except ImportError:
+    shapely = None
+
+# Local imports
+from core.vector import create_mem_ds
+
+# Globals
+MULTI_TYPES = [5, 6]  # shapely type ids of multilinestring and multipolygon
+POLYGON_TYPE = 3
+
+# ogr single type per multi type and the shapely type id of the single types
+SINGLE_TYPES = {
+    ogr.wkbMultiPolygon: ogr.wkbPolygon,
+    ogr.wkbMultiLineString: ogr.wkbLineString,
+    ogr.wkbMultiPoint: ogr.wkbPoint,
+}
+SHAPELY_TYPES = {ogr.wkbPoint: 0, ogr.wkbLineString: 1, ogr.wkbPolygon: 3}
+
+
+def available():
+    """ Returns whether shapely 2 and pyproj are installed """
+    if shapely is None:
+        return False
+    return int(shapely.__version__.split(".")[0]) >= 2
+
+
+def read_layer(layer, field_indices):
+    """ Returns the fids, wkb geometries and field values of all features """
+    fids = []
+    wkbs = []
+    records = []
+    layer.ResetReading()
+    for feature in layer:
+        geometry = feature.GetGeometryRef()
+        fids.append(feature.GetFID())
+        wkbs.append(None if geometry is None else geometry.ExportToWkb())
+        records.append([feature.GetField(i) for i in field_indices])
+    layer.ResetReading()
+    return fids, wkbs, records
+
+
+def explode(geometries):
+    """
+    Returns the singleparts of the multipolygons and multilinestrings and
+    the position of their source geometry, in the order of the input
+    """
+    multi = np.isin(shapely.get_type_id(geometries), MULTI_TYPES)
+    single = np.flatnonzero(~multi)
+    parts, part_index = shapely.get_parts(geometries[multi], return_index=True)
+
+    positions = np.concatenate([single, np.flatnonzero(multi)[part_index]])
+    order = np.argsort(positions, kind="stable")
+    exploded = np.concatenate([geometries[single], parts])
+    return exploded[order], positions[order]
+
+
+def force_type(geometries, geom_type):
+    """ ogr.ForceTo on the few geometries that have another type """
+    target = SHAPELY_TYPES.get(geom_type)
+    if target is None:
+        return geometries
+
+    for i in np.flatnonzero(shapely.get_type_id(geometries) != target):
+        geometry = ogr.CreateGeometryFromWkb(shapely.to_wkb(geometries[i]))
+        geometry = ogr.ForceTo(geometry, geom_type)
+        geometries[i] = shapely.from_wkb(geometry.ExportToWkb())
+    return geometries
+
+
+def reproject(geometries, in_spatial_ref, out_spatial_ref, include_z=False):
+    """ Transforms the coordinates of all geometries at once """
+    transformer = Transformer.from_crs(
+        CRS.from_wkt(in_spatial_ref.ExportToWkt()),
+        CRS.from_wkt(out_spatial_ref.ExportToWkt()),
+        always_xy=True,
+    )
+
+    def transform(coordinates):
+        return np.column_stack(transformer.transform(*coordinates.T))
+
+    return shapely.transform(geometries, transform, include_z=include_z)
+
+
+def correct_arrays(in_layer, layer_name="", epsg=3857):
+    """
+    Array based variant of core.vector.correct with the same output.
+
+    Parameters
+    ----------
+    in_layer : ogr layer
+    layer_name : string, optional
+        The default is ''.
+    epsg : int, optional
+        The default is 3857.
+
+    Returns
+    -------
+    out_datasource : ogr datasource
+    layer_name : string
+
+    """
+    if not available():
+        raise ImportError("The shapely correct engine requires shapely>=2 and pyproj")
+
+    in_feature_count = in_layer.GetFeatureCount()
+    geom_type = in_layer.GetGeomType()
+    in_spatial_ref = in_layer.GetSpatialRef()
+
+    # ogc_fid and ignored fields are not copied, see core.vector.correct
+    layer_defn = in_layer.GetLayerDefn()
+    field_defns = [
+        layer_defn.GetFieldDefn(i) for i in range(layer_defn.GetFieldCount())
+    ]
+    field_indices = [
+        i
+        for i, f in enumerate(field_defns)
+        if f.name != "ogc_fid" and not f.IsIgnored()
+    ]
+
+    print("info", "check - Multipart to singlepart")
+    fids, wkbs, records = read_layer(in_layer, field_indices)
+
+    lost_features = []
+    present = []
+    for count, (fid, wkb) in enumerate(zip(fids, wkbs)):
+        if wkb is None:
+            print("warning", "FID {} has no geometry.".format(count))
+            lost_features.append(fid)
+        else:
+            present.append(count)
+
+    # unreadable geometries, e.g. a linestring of one point, become None
+    geometries = shapely.from_wkb([wkbs[i] for i in present], on_invalid="ignore")
+    geometries, positions = explode(geometries)
+    sources = np.array(present, dtype=int)[positions]
+
+    if len(geometries) == 0:
+        print("error", "Multipart to singlepart failed")
+        return 1
+
+    flatten = False
+    geom_name = ogr.GeometryTypeToName(geom_type)
+    if "3D" in geom_name:
+        print("warning", "geom type: " + geom_name)
+        print("info", "Flattening to 2D")
+        flatten = True
+
+    elif geom_type < 0:
+        print("error", "geometry invalid, most likely has a z-type")
+        raise ValueError(
+            "geometry invalid, most likely has a z-type", "geom type: ", geom_name,
+        )
+    geom_type = SINGLE_TYPES.get(geom_type, geom_type)
+
+    print("info", "check - Reproject layer to {}".format(str(epsg)))
+    polygons = shapely.get_type_id(geometries) == POLYGON_TYPE
+    repair = polygons & ~shapely.is_valid(geometries)
+    geometries[repair] = shapely.buffer(geometries[repair], 0)
+
+    # lost features are numbered on the singleparts, as in core.vector.correct
+    valid = shapely.is_valid(geometries)
+    for position in np.flatnonzero(~valid):
+        print("warning", "geometry invalid even with buffer, skipping")
+        lost_features.append(int(position))
+    geometries = force_type(geometries[valid], geom_type)
+    sources = sources[valid]
+
+    out_spatial_ref = osr.SpatialReference()
+    out_spatial_ref.ImportFromEPSG(int(epsg))
+    if in_spatial_ref is None:
+        print("warning", "Layer has no spatial reference, not reprojecting")
+    elif not in_spatial_ref.IsSame(out_spatial_ref):
+        geometries = reproject(geometries, in_spatial_ref, out_spatial_ref, flatten)
+
+    if flatten:
+        geometries = shapely.force_2d(geometries)
+
+    out_datasource = create_mem_ds()
+    out_layer = out_datasource.CreateLayer(
+        layer_name or "mem", out_spatial_ref, geom_type
+    )
+    for i in field_indices:
+        out_layer.CreateField(field_defns[i])
+    out_layer_defn = out_layer.GetLayerDefn()
+
+    transaction = out_layer.TestCapability(ogr.OLCTransactions)
+    if transaction:
+        out_layer.StartTransaction()
+
+    for wkb, source in zip(shapely.to_wkb(geometries), sources):
+        out_feat = ogr.Feature(out_layer_defn)
+        out_feat.SetGeometryDirectly(ogr.CreateGeometryFromWkb(wkb))
+        for field, value in enumerate(records[source]):
+            if value is None:
+                continue
+            try:
+                out_feat.SetField(field, value)
+            except Exception as e:
+                print(e)
+        out_layer.CreateFeature(out_feat)
+
+    if transaction:
+        out_layer.CommitTransaction()
+
+    print("info", "check  - Features count")
+    out_feature_count = out_layer.GetFeatureCount()
+
+    if len(lost_features) > 0:
+        print(
+            "warning", "Lost {} features during corrections".format(len(lost_features)),
+        )
+        print("warning", "FIDS: {}".format(lost_features))
+
+    elif in_feature_count > out_feature_count:
+        print("warning", "In feature count greater than out feature count")
+
+    out_layer = None
+    print("Finished vector corrections")
+    return out_datasource, layer_name
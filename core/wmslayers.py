@@ -7,9 +7,10 @@ Tool & cmd tool to publish wmslayers in Lizard
 """
 # Third-party imports
 import json
-from requests import get, post, codes, delete
+from requests import codes
 
 # Local imports
+from core.session import get, post, delete
 from core.wrap import wrap_geoserver
 from core.credentials import username, password
 
@@ -6,14 +6,29 @@ Created on Mon Jul 22 21:39:39 2019
 """
 
 # Third-party imports
-import requests
 import os
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from bs4 import BeautifulSoup as bs
 from geoserver.catalog import Catalog
+from geoserver.index import load_index
+from geoserver.style import Style
 from geoserver.util import shapefile_and_friends
 from tqdm import tqdm
 from core.credentials import username, password
+from core.session import limited_session, session
+from core.sld import sld_hash
+
+# Shared styles are named on the hash of their sld
+SHARED_STYLE_PREFIX = "sld_"
+SHARED_STYLE_LENGTH = 16
+
+# Serializes the creation of shared styles by the workers of a batch
+SHARED_STYLE_LOCK = threading.Lock()
+
+# Concurrent requests of get_layers_info
+LAYER_WORKERS = 8
 
 REST = {
     "STAGING": "https://maps2.staging.lizard.net/geoserver/rest/",
@@ -33,11 +48,67 @@ SERVERS = {
 }
 
 
+class layer_property(object):
+    """ Attribute of the current layer that is fetched once on first use """
+
+    def __init__(self, fetch):
+        self.fetch = fetch
+        self.name = fetch.__name__
+        self.__doc__ = fetch.__doc__
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        cache = obj.__dict__.setdefault("_layer_cache", {})
+        if self.name not in cache:
+            cache[self.name] = self.fetch(obj)
+        return cache[self.name]
+
+    def __set__(self, obj, value):
+        obj.__dict__.setdefault("_layer_cache", {})[self.name] = value
+
+
+class catalog_snapshot:
+    """
+    Names of the layers, stores, workspaces and styles of a geoserver. A
+    snapshot is loaded once, shared by the layers of a batch and updated
+    when these create or delete objects.
+    """
+
+    def __init__(self, catalog):
+        self.lock = threading.Lock()
+        index = load_index(catalog)
+        self.layer_names = set(index.layers)
+        self.store_names = index.store_names()
+        self.workspace_names = set(index.workspaces)
+        self.style_names = index.style_names()
+        self.style_slugs = set(
+            name if workspace is None else "{}:{}".format(workspace, name)
+            for workspace, name in index.styles
+        )
+
+        # normalized sld hash per style slug, see wrap_geoserver.same_style
+        self.style_hashes = {}
+
+    def add(self, names, name):
+        with self.lock:
+            names.add(name)
+
+    def remove(self, names, name):
+        with self.lock:
+            names.discard(name)
+
+
 class wrap_geoserver:
     """ Geoserver (gsconfig) wrapper """
 
     def __init__(
-        self, geoserver_name, username=username, password=password, easy=False
+        self,
+        geoserver_name,
+        username=username,
+        password=password,
+        easy=False,
+        snapshot=None,
     ):
         if geoserver_name in list(REST.keys()):
             self.path = REST[geoserver_name]
@@ -46,30 +117,37 @@ class wrap_geoserver:
         self.wms = self.path.replace("rest/", "wms")
 
         self.name = geoserver_name
-        self.catalog = Catalog(self.path, username, password)
+        self.catalog = Catalog(
+            self.path, username, password, session=limited_session()
+        )
 
-        if not easy:
-            self.layers = []
-            self.layer_names = []
+        if snapshot is not None:
+            self.snapshot = snapshot
+        elif not easy:
+            self.snapshot = catalog_snapshot(self.catalog)
+        else:
+            self.snapshot = None
 
-            for layer in self.catalog.get_layers():
-                self.layers.append(layer)
-                self.layer_names.append(layer.name)
+        if self.snapshot is not None:
+            self.style_hashes = self.snapshot.style_hashes
+        else:
+            self.style_hashes = {}
 
-            self.stores = [store for store in self.catalog.get_stores()]
-            self.store_names = [store.name for store in self.stores]
+    @property
+    def layer_names(self):
+        return self.snapshot.layer_names
 
-            styles = []
-            self.workspaces = []
-            self.workspace_names = []
+    @property
+    def store_names(self):
+        return self.snapshot.store_names
 
-            for workspace in self.catalog.get_workspaces():
-                styles = styles + self.catalog.get_styles(workspace)
-                self.workspace_names.append(workspace._name)
-                self.workspaces.append(workspace)
+    @property
+    def workspace_names(self):
+        return self.snapshot.workspace_names
 
-            self.styles = styles + [style for style in self.catalog.get_styles()]
-            self.style_names = [style.name for style in self.styles]
+    @property
+    def style_names(self):
+        return self.snapshot.style_names
 
     def unpack(self, workspace_name, store_type="datastore"):
         layers_and_styles = {}
@@ -89,28 +167,85 @@ class wrap_geoserver:
             )
             features = features + get(url, between_quotes=True)
 
+        slugs = {}
         for feature in features:
             layer_name = os.path.basename(feature).split(".")[0]
-            self.get_layer(self.get_slug(workspace.name, layer_name))
-            layers_and_styles[layer_name] = self.layer.default_style
+            slugs[layer_name] = self.get_slug(workspace.name, layer_name)
+
+        infos = self.get_layers_info(list(slugs.values()))
+        for layer_name, slug in slugs.items():
+            info = infos[slug]
+            layers_and_styles[layer_name] = info["style"] if info else None
 
         setattr(self, workspace_name + "_data", layers_and_styles)
         return layers_and_styles
 
     def get_layer(self, layer, easy=False):
+        """
+        Gets a layer, its resource, style and the attributes below are
+        fetched on first use. easy is kept for backwards compatibility.
+        """
         self.layer = self.catalog.get_layer(layer)
-
-        if not easy:
-            self.resource = self.layer.resource
-            self.layer_name = self.layer.resource.name
-            self.sld_name = self.layer.default_style.name
-            self.sld_body = self.layer.default_style.sld_body
-            self.layer_latlon_bbox = self.layer.resource.latlon_bbox
-            self.layer_title = self.layer.resource.title
-            self.layer_abstract = self.layer.resource.abstract
+        self._layer_cache = {}
+
+    @layer_property
+    def resource(self):
+        return self.layer.resource
+
+    @layer_property
+    def layer_name(self):
+        return self.resource.name
+
+    @layer_property
+    def sld_name(self):
+        return self.layer.default_style.name
+
+    @layer_property
+    def sld_body(self):
+        return self.layer.default_style.sld_body
+
+    @layer_property
+    def layer_latlon_bbox(self):
+        return self.resource.latlon_bbox
+
+    @layer_property
+    def layer_title(self):
+        return self.resource.title
+
+    @layer_property
+    def layer_abstract(self):
+        return self.resource.abstract
+
+    def layer_info(self, slug, sld_body=False):
+        """ Returns the bbox, title, abstract and style of a layer or None """
+        layer = self.catalog.get_layer(slug)
+        if layer is None:
+            return None
+
+        resource = layer.resource
+        style = layer.default_style
+        info = {
+            "layer": layer,
+            "resource": resource,
+            "layer_name": resource.name,
+            "latlon_bbox": resource.latlon_bbox,
+            "title": resource.title,
+            "abstract": resource.abstract,
+            "style": style,
+            "sld_name": style.name if style is not None else None,
+        }
+        if sld_body and style is not None:
+            info["sld_body"] = style.sld_body
+        return info
+
+    def get_layers_info(self, slugs, sld_body=False, max_workers=LAYER_WORKERS):
+        """ Returns the layer_info per slug, fetched concurrently """
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            infos = executor.map(lambda s: self.layer_info(s, sld_body), slugs)
+            return dict(zip(slugs, infos))
 
     def get_store(self, layer):
-        self.store = self.layer.resource._store
+        self.store = self.layer.resource.store
 
     def get_resource(self):
         self.resource = self.catalog.get_resource(self.layer.name, self.store)
@@ -139,6 +274,7 @@ class wrap_geoserver:
 
         if not workspace_exists:
             self.workspace = self.catalog.create_workspace(workspace_name)
+            self.snapshot.add(self.workspace_names, workspace_name)
 
         else:
             print("workspace already exists, using existing workspace")
@@ -167,22 +303,43 @@ class wrap_geoserver:
             )
 
             self.save(ds)
+            self.snapshot.add(self.store_names, store_name)
             self.store = self.catalog.get_store(store_name, self.workspace_name)
             self.store_name = store_name
 
     def publish_layer(
-        self, layer_name, workspace_name, overwrite=False, epsg="3857", reload=False
+        self,
+        layer_name,
+        workspace_name,
+        overwrite=False,
+        epsg="3857",
+        reload=False,
+        in_place=False,
     ):
 
-        layer_exists = layer_name in self.layer_names
         # if layer_name in self.workspace_layers[workspace_name]:
         slug = self.get_slug(workspace_name, layer_name)
-        if overwrite and layer_exists:
+        layer_exists = layer_name in self.layer_names or slug in self.layer_names
+        if overwrite and layer_exists and in_place:
+            print("Layer exists, updating featuretype")
+            feature_type = self.catalog.get_resource(layer_name, self.store)
+            if feature_type is not None:
+                feature_type.dirty["srs"] = "EPSG:{}".format(str(epsg))
+                feature_type.dirty["nativeCRS"] = "EPSG:{}".format(str(epsg))
+                self.catalog.save(
+                    feature_type, params={"recalculate": "nativebbox,latlonbbox"}
+                )
+                self.feature_type = feature_type
+            layer_exists = feature_type is not None
+
+        elif overwrite and layer_exists:
             print("Layer exists, deleting layer")
             try:
 
                 self.layer = self.catalog.get_layer(slug)
                 self.delete(self.layer)
+                self.snapshot.remove(self.layer_names, layer_name)
+                self.snapshot.remove(self.layer_names, slug)
                 self.reload()
 
                 layer_exists = False
@@ -201,6 +358,7 @@ class wrap_geoserver:
                 srs="EPSG:{}".format(str(epsg)),
             )
             self.save(feature_type)
+            self.snapshot.add(self.layer_names, slug)
             self.feature_type = feature_type
 
         else:
@@ -235,13 +393,77 @@ class wrap_geoserver:
         ft = self.catalog.create_featurestore(layer_name, shapefile, self.workspace)
         self.save(ft)
 
-    def upload_sld(self, sld_name, workspace_name, sld, overwrite=True):
+    def same_style(self, sld_name, workspace_name, sld):
+        """
+        Returns whether the style on the geoserver has the same normalized
+        sld. The hash of the server body is cached for the batch.
+        """
+        slug = self.get_slug(workspace_name, sld_name)
+        stored = self.style_hashes.get(slug)
+        if stored is None:
+            style = Style(self.catalog, sld_name, workspace_name)
+            r = self.catalog.session.get(style.body_href)
+            if r.status_code != 200:
+                return False
+
+            try:
+                stored = sld_hash(r.content)
+            except Exception as e:
+                print(e)
+                return False
+            self.style_hashes[slug] = stored
+        return stored == sld_hash(sld)
+
+    def layer_has_style(self, style_slug):
+        """ Returns whether the fetched layer has the style as default style """
+        layer = getattr(self, "layer", None)
+        if layer is None or layer.dom is None:
+            return False
+
+        element = layer.dom.find("defaultStyle")
+        if element is None:
+            return False
+
+        name = element.findtext("name")
+        workspace = element.findtext("workspace")
+        if workspace and ":" not in name:
+            name = self.get_slug(workspace, name)
+        return name == style_slug
+
+    def upload_sld(
+        self,
+        sld_name,
+        workspace_name,
+        sld,
+        overwrite=True,
+        in_place=False,
+        skip_identical=False,
+    ):
         style_exists = sld_name in self.style_names
+        slug = self.get_slug(workspace_name, sld_name)
+
+        if skip_identical and style_exists:
+            if self.same_style(sld_name, workspace_name, sld):
+                print("Style is identical, skipping upload")
+                self.style_name = sld_name
+                return
+
+        if overwrite and style_exists and in_place:
+            print("Overwriting style body")
+            try:
+                self.catalog.create_style(sld_name, sld, True, workspace_name, "sld11")
+            except Exception as e:
+                print(e)
+                self.catalog.create_style(sld_name, sld, True, workspace_name, "sld10")
+            self.style_hashes.pop(slug, None)
+            self.style_name = sld_name
+            return
 
         if overwrite and style_exists:
             print("Overwriting style")
             style = self.catalog.get_style(sld_name, workspace_name)
             self.delete(style)
+            self.snapshot.remove(self.style_names, sld_name)
             self.reload()
             style_exists = False
             
@@ -255,6 +477,8 @@ class wrap_geoserver:
                 self.delete(style)
                 self.reload()
                 self.catalog.create_style(sld_name, sld, False, workspace_name, "sld10")
+            self.snapshot.add(self.style_names, sld_name)
+            self.style_hashes.pop(slug, None)
             self.style_name = sld_name
 
         else:
@@ -262,7 +486,47 @@ class wrap_geoserver:
                 print("Style already exists, using current style")
                 self.style_name = sld_name
 
-    def set_sld_for_layer(self, workspace_name=None, style_name=None, use_custom=False):
+    def upload_shared_sld(self, workspace_name, sld):
+        """
+        Uploads an sld once per workspace under a name derived from the hash
+        of the normalized sld. Returns the style name.
+        """
+        style_name = SHARED_STYLE_PREFIX + sld_hash(sld)[:SHARED_STYLE_LENGTH]
+        slug = self.get_slug(workspace_name, style_name)
+
+        snapshot = self.snapshot
+        with SHARED_STYLE_LOCK:
+            known = snapshot is not None and slug in snapshot.style_slugs
+            if known:
+                print("Using shared style {}".format(slug))
+
+            elif self.catalog.get_style(style_name, workspace_name) is None:
+                print("Uploading shared style {}".format(slug))
+                try:
+                    self.catalog.create_style(
+                        style_name, sld, False, workspace_name, "sld11"
+                    )
+                except Exception as e:
+                    print(e)
+                    # the style can be created without a valid body
+                    self.catalog.create_style(
+                        style_name, sld, True, workspace_name, "sld10"
+                    )
+
+            if snapshot is not None and not known:
+                snapshot.add(snapshot.style_names, style_name)
+                snapshot.add(snapshot.style_slugs, slug)
+
+        self.style_name = style_name
+        return style_name
+
+    def set_sld_for_layer(
+        self,
+        workspace_name=None,
+        style_name=None,
+        use_custom=False,
+        skip_identical=False,
+    ):
         if not use_custom:
             workspace_name = self.workspace_name
             style_name = self.style_name
@@ -274,6 +538,10 @@ class wrap_geoserver:
             else:
                 self.style_slug = self.get_slug(workspace_name, style_name)
 
+        if skip_identical and self.layer_has_style(self.style_slug):
+            print("Layer already has {}, skipping".format(self.style_slug))
+            return
+
         self.style = self.catalog.get_style(self.style_slug)
 
         print("Setting {} for {}".format(self.style.name, self.layer.name))
@@ -302,7 +570,7 @@ class wrap_geoserver:
 
 
 def get(url, _type="a", between_quotes=False):
-    r = requests.get(url)
+    r = session().get(url)
     soup = bs(r.content, "html.parser")
     _list = []
     for i in soup.find_all(_type):
@@ -0,0 +1,295 @@
+# coding: utf-8
+
+"""
+Asynchronous variant of the catalog operations that are used to publish a
+batch of layers: workspaces, datastores, featuretypes, styles and the default
+style of a layer.
+
+The catalog objects of gsconfig are reused for their urls and xml messages,
+only the requests are made with aiohttp. Requests are limited per host, so a
+batch can gather dozens of publications at once:
+
+    async with AsyncCatalog(url, username, password) as catalog:
+        await asyncio.gather(*[publish(catalog, name) for name in names])
+"""
+
+import asyncio
+import logging
+from urllib.parse import urljoin, urlsplit
+from xml.etree.ElementTree import XML, Element
+from xml.parsers.expat import ExpatError
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from geoserver import settings
+from geoserver.catalog import (
+    FailedRequestError,
+    UploadError,
+    ConflictingDataError,
+    _name,
+)
+from geoserver.workspace import Workspace
+from geoserver.store import DataStore, UnsavedDataStore
+from geoserver.resource import FeatureType
+from geoserver.layer import Layer
+from geoserver.style import Style
+
+
+LOGGER = logging.getLogger("gsconfig2.aio")
+
+OK = 200
+NOT_FOUND = 404
+
+
+class AsyncCatalog:
+    """
+    Asyncio client of the GeoServer REST api.
+
+    Unlike Catalog it does not cache responses, every lookup is a request.
+    :param max_per_host: The maximum number of concurrent requests per host.
+    :param session: An aiohttp.ClientSession, created on first use if None.
+    """
+
+    def __init__(
+        self,
+        service_url,
+        username=settings.DEFAULT_USERNAME,
+        password=settings.DEFAULT_PASSWORD,
+        max_per_host=settings.MAX_PER_HOST,
+        session=None,
+    ):
+        if aiohttp is None:
+            raise ImportError("AsyncCatalog requires aiohttp, pip install aiohttp")
+        self._service_url = service_url
+        self._username = username
+        self._password = password
+        self.max_per_host = max_per_host
+        self._session = session
+        self._semaphores = dict()
+
+    @property
+    def service_url(self):
+        return self._service_url
+
+    @property
+    def username(self):
+        return self._username
+
+    @property
+    def password(self):
+        return self._password
+
+    @property
+    def session(self):
+        # created lazily, a ClientSession belongs to the running event loop
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                auth=aiohttp.BasicAuth(self.username, self.password)
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def _semaphore(self, url):
+        host = urlsplit(url).netloc
+        if host not in self._semaphores:
+            self._semaphores[host] = asyncio.Semaphore(self.max_per_host)
+        return self._semaphores[host]
+
+    async def request(self, method, url, data=None, headers=None, params=None):
+        """
+        :return: The status code and text of the response.
+        """
+        LOGGER.debug("{} {}".format(method, url))
+        if params is not None:
+            params = {k: str(v) for k, v in params.items() if v is not None}
+        async with self._semaphore(url):
+            async with self.session.request(
+                method, url, data=data, headers=headers, params=params
+            ) as r:
+                return r.status, await r.text()
+
+    async def get_xml(self, rest_url):
+        status, text = await self.request("GET", rest_url)
+        if status != OK:
+            msg = "Tried to make a GET request to {} but got a {} status code: \n{}"
+            error = FailedRequestError(msg.format(rest_url, status, text))
+            error.status_code = status
+            raise error
+        try:
+            return XML(text)
+        except (ExpatError, SyntaxError) as e:
+            msg = "GeoServer gave non-XML response for [GET {}]: {}".format(
+                rest_url, text
+            )
+            raise Exception(msg, e)
+
+    async def fetch(self, obj):
+        """
+        Asynchronous ResourceInfo.fetch.
+        :return: The object with its dom.
+        """
+        obj.dom = await self.get_xml(obj.href)
+        return obj
+
+    async def _get(self, obj):
+        """
+        :return: The fetched object or None on a 404.
+        """
+        try:
+            return await self.fetch(obj)
+        except FailedRequestError as e:
+            if getattr(e, "status_code", None) == NOT_FOUND:
+                return None
+            raise
+
+    async def save(self, obj, content_type="application/xml", params=None):
+        """
+        Save an object to the REST service, e.g. a layer with a new default
+        style or an UnsavedDataStore.
+        :return: The text of the response.
+        """
+        if obj.dom is None:
+            # properties of an unsaved object would be fetched synchronously
+            obj.dom = Element(obj.resource_type)
+        headers = {"Content-type": content_type, "Accept": content_type}
+        status, text = await self.request(
+            obj.save_method, obj.href, obj.message(), headers, params
+        )
+        if 400 <= status < 600:
+            raise FailedRequestError(
+                "Error code ({}) from GeoServer: {}".format(status, text)
+            )
+        return text
+
+    async def delete(self, obj, purge=None, recurse=False):
+        """
+        Send a delete request.
+        :param recurse: True if underlying objects must be deleted recursively.
+        :return: The text of the response.
+        """
+        headers = {"Content-type": "application/xml", "Accept": "application/xml"}
+        params = {"purge": purge, "recurse": recurse}
+        status, text = await self.request("DELETE", obj.href, None, headers, params)
+        if status != OK:
+            msg = "Tried to make a DELETE request to {} but got a {} status code: \n{}"
+            raise FailedRequestError(msg.format(obj.href, status, text))
+        return text
+
+    async def get_workspace(self, name):
+        return await self._get(Workspace(self, name))
+
+    async def create_workspace(self, name):
+        xml = "<workspace><name>{name}</name></workspace>".format(name=name)
+        headers = {"Content-Type": "application/xml"}
+        workspace_url = urljoin(self.service_url, "workspaces/")
+        status, text = await self.request("POST", workspace_url, xml, headers)
+        if not 200 <= status < 300:
+            msg = "Tried to create workspace but got {}: {}"
+            raise FailedRequestError(msg.format(status, text))
+        return Workspace(self, name)
+
+    def _workspace(self, workspace):
+        if isinstance(workspace, Workspace):
+            return workspace
+        return Workspace(self, _name(workspace))
+
+    async def get_store(self, name, workspace):
+        return await self._get(DataStore(self, self._workspace(workspace), name))
+
+    def create_datastore(self, name, workspace):
+        """
+        :return: An UnsavedDataStore, save it with the catalog.
+        """
+        return UnsavedDataStore(self, name, self._workspace(workspace))
+
+    async def publish_featuretype(
+        self, name, store, native_crs, srs=None, native_bbox=None
+    ):
+        """
+        Publish a featuretype from data in an existing store.
+        :return: The fetched FeatureType.
+        """
+        if native_crs is None:
+            raise ValueError("must specify native_crs")
+        feature_type = FeatureType(self, store.workspace, store, name)
+        feature_type.dom = Element(feature_type.resource_type)
+        feature_type.dirty["name"] = name
+        feature_type.dirty["srs"] = srs or native_crs
+        feature_type.dirty["nativeCRS"] = native_crs
+        if native_bbox is not None:
+            feature_type.native_bbox = native_bbox
+        feature_type.enabled = True
+        feature_type.title = name
+        headers = {"Content-type": "application/xml", "Accept": "application/xml"}
+        status, text = await self.request(
+            "POST", store.resource_url, feature_type.message(), headers
+        )
+        if status < 200 or status > 299:
+            raise UploadError(text)
+        feature_type.dirty.clear()
+        return await self.fetch(feature_type)
+
+    async def get_resource(self, name, store, workspace=None):
+        workspace = self._workspace(workspace or store.workspace)
+        return await self._get(FeatureType(self, workspace, store, name))
+
+    async def get_layer(self, name):
+        return await self._get(Layer(self, name))
+
+    async def get_style(self, name, workspace=None):
+        if ":" in name:
+            workspace, name = name.split(":", 1)
+        return await self._get(Style(self, name, _name(workspace)))
+
+    async def create_style(
+        self,
+        name,
+        data,
+        overwrite=False,
+        workspace=None,
+        style_format="sld10",
+        raw=False,
+    ):
+        style = Style(self, name, _name(workspace), style_format)
+        exists = await self._get(Style(self, name, _name(workspace))) is not None
+        if exists and not overwrite:
+            msg = "There is already a style named {}".format(name)
+            raise ConflictingDataError(msg)
+        if not exists:
+            headers = {"Content-type": "application/xml", "Accept": "application/xml"}
+            xml = "<style><name>{0}</name><filename>{0}.sld</filename></style>"
+            status, text = await self.request(
+                "POST", style.create_href, xml.format(name), headers
+            )
+            if status < 200 or status > 299:
+                raise UploadError(text)
+        headers = {"Content-type": style.content_type, "Accept": "application/xml"}
+        body_href = style.body_href
+        if raw:
+            body_href += "?raw=true"
+        status, text = await self.request("PUT", body_href, data, headers)
+        if status < 200 or status > 299:
+            raise UploadError(text)
+        return style
+
+    async def set_default_style(self, layer, style):
+        """
+        Save the default style of a layer, given as Style or (qualified) name.
+        """
+        if isinstance(layer, str):
+            layer = await self.fetch(Layer(self, layer))
+        layer.default_style = style
+        return await self.save(layer)
@@ -0,0 +1,119 @@
+# coding: utf-8
+
+import re
+import threading
+from time import monotonic
+from collections import OrderedDict
+from urllib.parse import urlsplit, urlunsplit
+
+from geoserver import settings
+
+
+# Resource types that are also listed in layers.xml
+LAYER_TYPES = ["featuretypes", "coverages", "wmslayers", "layers"]
+
+EXTENSION = re.compile(r"\.(xml|json|sld|html)$")
+
+
+class CacheEntry:
+    __slots__ = ("text", "stored", "etag", "last_modified")
+
+    def __init__(self, text, etag=None, last_modified=None):
+        self.text = text
+        self.stored = monotonic()
+        self.etag = etag
+        self.last_modified = last_modified
+
+
+class ResponseCache:
+    """
+    Size bounded LRU cache of GET responses of the REST api.
+
+    Every resource type has its own time to live, see settings.CACHE_TTL.
+    Writes invalidate the url of an object, the urls below it and the
+    listing it is part of instead of the whole cache.
+    """
+
+    def __init__(self, max_size=settings.CACHE_SIZE, ttl=None):
+        self.max_size = max_size
+        self.ttl = dict(settings.CACHE_TTL)
+        if ttl is not None:
+            self.ttl.update(ttl)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def resource_type(self, url):
+        """
+        :return: The last collection in the path of an url, e.g. datastores
+        for workspaces/topp/datastores/states.xml.
+        """
+        parts = [p for p in EXTENSION.sub("", urlsplit(url).path).split("/") if p]
+        for part in reversed(parts):
+            if part in self.ttl:
+                return part
+        return None
+
+    def time_to_live(self, url):
+        return self.ttl.get(self.resource_type(url), settings.DEFAULT_CACHE_TTL)
+
+    def get(self, url):
+        """
+        :return: The entry of an url, also when expired, or None.
+        """
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is not None:
+                self._entries.move_to_end(url)
+            return entry
+
+    def fresh(self, url, entry):
+        return monotonic() - entry.stored <= self.time_to_live(url)
+
+    def put(self, url, text, headers=None):
+        headers = headers or {}
+        entry = CacheEntry(text, headers.get("ETag"), headers.get("Last-Modified"))
+        with self._lock:
+            self._entries[url] = entry
+            self._entries.move_to_end(url)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def touch(self, url):
+        """
+        Restart the time to live of an entry, e.g. after a 304 response.
+        """
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is not None:
+                entry.stored = monotonic()
+
+    def pop(self, url, default=None):
+        with self._lock:
+            return self._entries.pop(url, default)
+
+    def invalidate(self, url):
+        """
+        Remove the url of a written object, the urls below it and the listing
+        of its parent. Objects of a layer type also invalidate layers.xml.
+        """
+        scheme, netloc, path, query, fragment = urlsplit(url)
+        base = urlunsplit((scheme, netloc, EXTENSION.sub("", path), "", ""))
+        base = base.rstrip("/")
+        parent = base.rsplit("/", 1)[0]
+
+        prefixes = [base + ".", base + "/", parent + "."]
+        if self.resource_type(url) in LAYER_TYPES:
+            service = base.split("/workspaces/")[0].split("/layers/")[0]
+            prefixes.append(service + "/layers.")
+
+        with self._lock:
+            for key in list(self._entries):
+                if key in (url, base) or key.startswith(tuple(prefixes)):
+                    del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -4,20 +4,24 @@ from urllib.parse import urljoin
 import os
 import json
 import logging
-from datetime import datetime, timedelta
 from xml.etree.ElementTree import XML
 from xml.parsers.expat import ExpatError
 
 import requests
 
 from geoserver import settings
-from geoserver.resource import FeatureType, Coverage
+from geoserver.cache import ResponseCache
+from geoserver.metrics import METRICS
+from geoserver.resource import FeatureType, Coverage, WmsLayer
 from geoserver.support import prepare_upload_bundle, _decode_dict
 from geoserver.workspace import workspace_from_index, Workspace
 from geoserver.store import (
     coveragestore_from_index,
     wmsstore_from_index,
     datastore_from_index,
+    DataStore,
+    CoverageStore,
+    WmsStore,
     UnsavedDataStore,
     UnsavedCoverageStore,
     UnsavedWmsStore,
@@ -29,6 +33,20 @@ from geoserver.style import Style
 
 LOGGER = logging.getLogger("gsconfig2.catalog")
 
+# (url part, class) of the store types, in lookup order
+STORE_TYPES = [
+    ("datastores", DataStore),
+    ("coveragestores", CoverageStore),
+    ("wmsstores", WmsStore),
+]
+
+# resource class per store resource_type
+RESOURCE_TYPES = {
+    "dataStore": FeatureType,
+    "coverageStore": Coverage,
+    "wmsStore": WmsLayer,
+}
+
 
 class Catalog:
     """
@@ -51,15 +69,28 @@ class Catalog:
         username=settings.DEFAULT_USERNAME,
         password=settings.DEFAULT_PASSWORD,
         disable_ssl_certificate_validation=False,
+        session=None,
+        cache_size=settings.CACHE_SIZE,
+        cache_ttl=None,
+        metrics=METRICS,
     ):
+        """
+        :param metrics: RequestMetrics that record the requests of the
+        session, None to not record them.
+        """
         self._service_url = service_url
         self._username = username
         self._password = password
         self._disable_ssl_validation = disable_ssl_certificate_validation
-        self._cache = dict()
+        self._cache = ResponseCache(cache_size, cache_ttl)
+        # name index of looked up workspaces, stores and resources
+        self._index = dict()
         self._version = None
-        self._session = requests.Session()
+        self._session = session if session is not None else requests.Session()
         self._session.auth = (self.username, self.password)
+        self.metrics = metrics
+        if metrics is not None:
+            self._session.hooks["response"].append(metrics.hook(service_url))
 
     @property
     def service_url(self):
@@ -132,6 +163,8 @@ class Catalog:
         headers = {"Content-type": "application/xml", "Accept": "application/xml"}
         r = self.session.delete(rest_url, params=params, headers=headers)
         if r.status_code == requests.codes.ok:
+            self.invalidate(rest_url)
+            self._unindex(config_object)
             return r.text
         else:
             msg = (
@@ -142,24 +175,40 @@ class Catalog:
             )
             raise FailedRequestError(msg)
 
+    def invalidate(self, rest_url):
+        """
+        Remove the cached responses affected by a write to an url.
+        """
+        self._cache.invalidate(rest_url)
+
     def get_xml(self, rest_url):
         LOGGER.debug("GET {}".format(rest_url))
-        cached_response = self._cache.get(rest_url)
-        if cached_response is not None:
-            last_cache = datetime.now() - cached_response[0]
-            text = cached_response[1]
-        cache_expire = timedelta(seconds=5)
-        if cached_response is None or last_cache > cache_expire:
-            r = self.session.get(rest_url)
-            text = r.text
-            if r.status_code == requests.codes.ok:
-                self._cache[rest_url] = (datetime.now(), text)
+        entry = self._cache.get(rest_url)
+        if entry is not None and self._cache.fresh(rest_url, entry):
+            text = entry.text
+        else:
+            # revalidate an expired response if the server gave validators
+            headers = {}
+            if entry is not None and entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry is not None and entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+            r = self.session.get(rest_url, headers=headers)
+            if entry is not None and r.status_code == requests.codes.not_modified:
+                self._cache.touch(rest_url)
+                text = entry.text
+            elif r.status_code == requests.codes.ok:
+                text = r.text
+                self._cache.put(rest_url, text, r.headers)
             else:
+                text = r.text
                 msg = (
                     "Tried to make a GET request to {}"
                     + " but got a {} status code: \n{}"
                 )
-                raise FailedRequestError(msg.format(rest_url, r.status_code, text))
+                error = FailedRequestError(msg.format(rest_url, r.status_code, text))
+                error.status_code = r.status_code
+                raise error
         try:
             return XML(text)
         except (ExpatError, SyntaxError) as e:
@@ -168,6 +217,41 @@ class Catalog:
             )
             raise Exception(msg, e)
 
+    def _lookup(self, rest_url):
+        """
+        GET a single object.
+        :return: True if it exists, False on a 404 and None on other errors.
+        """
+        try:
+            self.get_xml(rest_url)
+            return True
+        except FailedRequestError as e:
+            if getattr(e, "status_code", None) == requests.codes.not_found:
+                return False
+            return None
+
+    def _unindex(self, obj):
+        """
+        Remove an object and the objects below it from the name index.
+        """
+        resource_type = getattr(obj, "resource_type", None)
+        name = _name(obj)
+        if resource_type == "workspace":
+            stale = [k for k in self._index if k[1] == name]
+            stale += [k for k in self._index if k[0] == "store" and k[1] is None]
+        elif resource_type in RESOURCE_TYPES:
+            workspace = _name(obj.workspace)
+            stale = [("store", workspace, name), ("store", None, name)]
+            stale += [
+                k
+                for k in self._index
+                if k[0] == "resource" and k[1:3] == (workspace, name)
+            ]
+        else:
+            stale = [k for k in self._index if k[0] == "resource" and k[-1] == name]
+        for key in stale:
+            self._index.pop(key, None)
+
     def reload(self):
         """
         Send a reload request to the GeoServer and clear the cache.
@@ -176,6 +260,7 @@ class Catalog:
         reload_url = urljoin(self.service_url, "reload")
         r = self.session.post(reload_url)
         self._cache.clear()
+        self._index.clear()
         return r
 
     def reset(self):
@@ -186,14 +271,16 @@ class Catalog:
         reset_url = urljoin(self.service_url, "reset")
         r = self.session.post(reset_url)
         self._cache.clear()
+        self._index.clear()
         return r
 
-    def save(self, obj, content_type="application/xml"):
+    def save(self, obj, content_type="application/xml", params=None):
         """
         saves an object to the REST service
         gets the object's REST location and the data from the object,
         then POSTS the request.
         :param obj: The object to save.
+        :param params: Query parameters, e.g. recalculate for a featuretype.
         :return: The response given by the server.
         """
         rest_url = obj.href
@@ -202,20 +289,58 @@ class Catalog:
         LOGGER.debug("{} {}".format(save_method, rest_url))
         methods = {settings.POST: self.session.post, settings.PUT: self.session.put}
         headers = {"Content-type": content_type, "Accept": content_type}
-        r = methods[save_method](rest_url, data=message, headers=headers)
-        self._cache.clear()
+        r = methods[save_method](
+            rest_url, data=message, headers=headers, params=params
+        )
+        self.invalidate(rest_url)
+        self._unindex(obj)
         if 400 <= r.status_code < 600:
             raise FailedRequestError(
                 "Error code ({}) from GeoServer: {}".format(r.status_code, r.text)
             )
         return r
 
+    def _invalidate_store(self, workspace, store_type, name):
+        """
+        Uploads change a store, its resources and the layers.
+        """
+        path = "workspaces/{}/{}/{}.xml".format(_name(workspace), store_type, name)
+        self.invalidate(urljoin(self.service_url, path))
+        self.invalidate(urljoin(self.service_url, "layers.xml"))
+        self._index.pop(("store", None, name), None)
+
+    def _lookup_store(self, name, workspace):
+        """
+        GET a store by name in every store type of a workspace.
+        :return: The store, None if it does not exist and False if unknown.
+        """
+        for url_part, store_class in STORE_TYPES:
+            path = "workspaces/{}/{}/{}.xml".format(workspace.name, url_part, name)
+            found = self._lookup(urljoin(self.service_url, path))
+            if found:
+                return store_class(self, workspace, name)
+            elif found is None:
+                return False
+        return None
+
     def get_store(self, name, workspace=None):
         # Make sure workspace is a workspace object and not a string.
         # If the workspace does not exist,
         # continue as if no workspace had been defined.
         if isinstance(workspace, str):
             workspace = self.get_workspace(workspace)
+
+        key = ("store", _name(workspace), name)
+        if key in self._index:
+            return self._index[key]
+
+        if workspace is not None:
+            store = self._lookup_store(name, workspace)
+            if store is None:
+                raise FailedRequestError("No store found named: {}".format(name))
+            elif store is not False:
+                self._index[key] = store
+                return store
         # Create a list with potential workspaces to look into
         # if a workspace is defined, it will contain only that workspace
         # if no workspace is defined, the list will contain all workspaces.
@@ -246,7 +371,9 @@ class Catalog:
             msg = "Multiple stores found named '{}': {}"
             raise AmbiguousRequestError(msg.format(name, found_stores.keys()))
         else:
-            return list(found_stores.values())[0]
+            store = list(found_stores.values())[0]
+            self._index[key] = store
+            return store
 
     def get_stores(self, workspace=None):
         if workspace is not None:
@@ -309,7 +436,7 @@ class Catalog:
         data = d.format(name, nativeName)
         headers = {"Content-type": "text/xml", "Accept": "application/xml"}
         r = self.session.post(wms_url, data=data, headers=headers)
-        self._cache.clear()
+        self.invalidate(wms_url)
         status_code = r.status_code
         if status_code < 200 or status_code > 299:
             raise UploadError(r.text)
@@ -351,7 +478,7 @@ class Catalog:
                 r = self.session.put(
                     upload_url, params=params, data=data, headers=headers
                 )
-                self._cache.clear()
+                self._invalidate_store(workspace, "datastores", store)
                 if r.status_code != 201:
                     raise UploadError(r.text)
         finally:
@@ -392,14 +519,14 @@ class Catalog:
         else:
             LOGGER.debug("Data is a zipfile")
             archive = data
-        message = open(archive, "rb")
         try:
+            with open(archive, "rb") as f:
+                message = f.read()
             r = self.session.put(ds_url, data=message, headers=headers, params=params)
-            self._cache.clear()
+            self._invalidate_store(workspace, "datastores", name)
             if r.status_code != 201:
                 raise UploadError(r.text)
         finally:
-            message.close()
             os.unlink(archive)
 
     def create_imagemosaic(
@@ -431,12 +558,13 @@ class Catalog:
         # PUT /workspaces/<ws>/coveragestores/<name>/file.imagemosaic?configure=none
         headers = {"Content-type": "application/zip", "Accept": "application/xml"}
         if isinstance(data, str):
-            message = open(data, "rb")
+            with open(data, "rb") as f:
+                message = f.read()
         else:
             message = data
         try:
             r = self.session.put(cs_url, data=message, headers=headers, params=params)
-            self._cache.clear()
+            self._invalidate_store(workspace, "coveragestores", name)
             if r.status_code != 201:
                 raise UploadError(r.text)
         finally:
@@ -481,7 +609,8 @@ class Catalog:
         if not external:
             if isinstance(data, dict):
                 archive = prepare_upload_bundle(name, data)
-                message = open(archive, "rb")
+                with open(archive, "rb") as f:
+                    message = f.read()
                 if "tfw" in data:
                     # If application/archive was used, server crashes with
                     # a 500 error read in many sites that application/zip
@@ -489,7 +618,8 @@ class Catalog:
                     headers["Content-type"] = "application/zip"
                     ext = "worldimage"
             elif isinstance(data, str):
-                message = open(data, "rb")
+                with open(data, "rb") as f:
+                    message = f.read()
             else:
                 message = data
 
@@ -503,7 +633,7 @@ class Catalog:
 
         try:
             r = self.session.put(cs_url, data=message, headers=headers, params=params)
-            self._cache.clear()
+            self._invalidate_store(workspace.name, "coveragestores", name)
             if r.status_code != 201:
                 raise UploadError(r.text)
         finally:
@@ -526,7 +656,7 @@ class Catalog:
         # POST /workspaces/<ws>/coveragestores/<name>/external.imagemosaic
         headers = {"Content-type": "text/plain", "Accept": "application/xml"}
         r = self.session.post(cs_url, data=data, headers=headers, params=params)
-        self._cache.clear()
+        self._invalidate_store(store.workspace.name, "coveragestores", store.name)
         if r.status_code != 202:
             raise UploadError(r.text)
 
@@ -547,7 +677,9 @@ class Catalog:
         message = open(data, "rb")
         try:
             r = self.session.post(cs_url, data=message, headers=headers, params=params)
-            self._cache.clear()
+            self._invalidate_store(
+                store.workspace.name, "coveragestores", store.name
+            )
             if r.status_code != 202:
                 raise UploadError(r.text)
         finally:
@@ -568,7 +700,6 @@ class Catalog:
         # GET /workspaces/<ws>/coveragestores/<name>/coverages.json
         headers = {"Content-type": "application/json", "Accept": "application/json"}
         r = self.session.get(cs_url, headers=headers, params=params)
-        self._cache.clear()
         coverages = json.loads(r.text, object_hook=_decode_dict)
         return coverages
 
@@ -586,7 +717,6 @@ class Catalog:
         # GET /workspaces/<ws>/coveragestores/<name>/coverages/<coverage>/index.json
         headers = {"Content-type": "application/json", "Accept": "application/json"}
         r = self.session.get(cs_url, headers=headers, params=params)
-        self._cache.clear()
         schema = json.loads(r.text, object_hook=_decode_dict)
         return schema
 
@@ -608,7 +738,6 @@ class Catalog:
         # GET /workspaces/<ws>/coveragestores/<name>/coverages/<coverage>/index/granules.json
         headers = {"Content-type": "application/json", "Accept": "application/json"}
         r = self.session.get(cs_url, headers=headers, params=params)
-        self._cache.clear()
         granules = json.loads(r.text, object_hook=_decode_dict)
         return granules
 
@@ -625,7 +754,7 @@ class Catalog:
         # DELETE /workspaces/<ws>/coveragestores/<name>/coverages/<coverage>/index/granules/<granule_id>.json
         headers = {"Content-type": "application/json", "Accept": "application/json"}
         r = self.session.delete(cs_url, headers=headers, params=params)
-        self._cache.clear()
+        self.invalidate(cs_url)
         if r.status_code != 200:
             raise FailedRequestError(r.text)
 
@@ -673,6 +802,7 @@ class Catalog:
         r = self.session.post(
             resource_url, data=feature_type.message(), headers=headers, params=params
         )
+        self.invalidate(resource_url)
         if r.status_code < 200 or r.status_code > 299:
             raise UploadError(r.text)
         feature_type.fetch()
@@ -687,7 +817,24 @@ class Catalog:
             if store is not None:
                 return store.get_resources(name)
 
+        if isinstance(store, str):
+            store = self.get_store(store)
+
         if store is not None:
+            key = ("resource", store.workspace.name, store.name, name)
+            if key in self._index:
+                return self._index[key]
+
+            resource_class = RESOURCE_TYPES.get(store.resource_type)
+            if resource_class is not None:
+                resource = resource_class(self, store.workspace, store, name)
+                found = self._lookup(resource.href)
+                if found is not None:
+                    resource = resource if found else None
+                    if resource is not None:
+                        self._index[key] = resource
+                    return resource
+
             candids = [s for s in self.get_resources(store) if s.name == name]
             if len(candids) == 0:
                 return None
@@ -697,7 +844,20 @@ class Catalog:
                 return candids[0]
 
         if workspace is not None:
-            for store in self.get_stores(workspace):
+            if isinstance(workspace, str):
+                workspace = self.get_workspace(workspace)
+                if workspace is None:
+                    return None
+            resource = self._lookup_resource(name, workspace)
+            if resource is not None and resource is not False:
+                return resource
+
+            stores = self.get_stores(workspace)
+            if resource is None:
+                # featuretypes and coverages are looked up, wms layers not
+                stores = [s for s in stores if s.resource_type == "wmsStore"]
+
+            for store in stores:
                 resource = self.get_resource(name, store)
                 if resource is not None:
                     return resource
@@ -709,16 +869,42 @@ class Catalog:
                 return resource
         return None
 
+    def _lookup_resource(self, name, workspace):
+        """
+        GET a featuretype or coverage by name in a workspace.
+        :return: The resource, None if it does not exist and False if unknown.
+        """
+        for resource_class in (FeatureType, Coverage):
+            path = "workspaces/{}/{}/{}.xml".format(
+                workspace.name, resource_class.url_part_types, name
+            )
+            try:
+                dom = self.get_xml(urljoin(self.service_url, path))
+            except FailedRequestError as e:
+                if getattr(e, "status_code", None) == requests.codes.not_found:
+                    continue
+                return False
+
+            store_name = dom.find("store").find("name").text.split(":")[-1]
+            store = self.get_store(store_name, workspace)
+            key = ("resource", workspace.name, store.name, name)
+            resource = resource_class(self, workspace, store, name)
+            self._index[key] = resource
+            return resource
+        return None
+
     def get_resource_by_url(self, url):
         xml = self.get_xml(url)
         name = xml.find("name").text
         if xml.tag == "featureType":
-            resource = FeatureType
+            resource_class = FeatureType
         elif xml.tag == "coverage":
-            resource = Coverage
+            resource_class = Coverage
         else:
             raise Exception("drat")
-        return resource(self, None, None, name, href=url)
+        resource = resource_class(self, None, None, name, href=url)
+        resource.dom = xml
+        return resource
 
     def get_resources(self, store=None, workspace=None):
         if isinstance(workspace, str):
@@ -855,6 +1041,9 @@ class Catalog:
             r = self.session.post(style.create_href, data=xml, headers=headers)
             if r.status_code < 200 or r.status_code > 299:
                 raise UploadError(r.text)
+        else:
+            # put the body in the requested format, not the default format
+            style = Style(self, name, workspace, style_format)
         headers = {"Content-type": style.content_type, "Accept": "application/xml"}
         body_href = style.body_href
         if raw:
@@ -862,8 +1051,7 @@ class Catalog:
         r = self.session.put(body_href, data=data, headers=headers)
         if r.status_code < 200 or r.status_code > 299:
             raise UploadError(r.text)
-        self._cache.pop(style.href, None)
-        self._cache.pop(style.body_href, None)
+        self.invalidate(style.href)
 
     def create_workspace(self, name):
         xml = "<workspace><name>{name}</name></workspace>".format(name=name)
@@ -875,7 +1063,7 @@ class Catalog:
         assert (
             200 <= r.status_code < 300
         ), "Tried to create workspace but got {}: {}".format(r.status_code, r.text)
-        self._cache.pop(urljoin(self.service_url, "workspaces.xml"), None)
+        self.invalidate(urljoin(self.service_url, "workspaces/{}.xml".format(name)))
         return self.get_workspace(name)
 
     def get_workspaces(self):
@@ -887,6 +1075,19 @@ class Catalog:
         ]
 
     def get_workspace(self, name):
+        key = ("workspace", name)
+        if key in self._index:
+            return self._index[key]
+
+        found = self._lookup(
+            urljoin(self.service_url, "workspaces/{}.xml".format(name))
+        )
+        if found is not None:
+            workspace = Workspace(self, name) if found else None
+            if workspace is not None:
+                self._index[key] = workspace
+            return workspace
+
         candidates = [w for w in self.get_workspaces() if w.name == name]
         if len(candidates) == 0:
             return None
@@ -913,8 +1114,7 @@ class Catalog:
             assert (
                 200 <= r.status_code < 300
             ), "Error setting default workspace: {}: {}".format(r.status_code, r.text)
-            self._cache.pop(default_workspace_url, None)
-            self._cache.pop("{}/workspaces.xml".format(self.service_url), None)
+            self.invalidate(default_workspace_url)
         else:
             raise FailedRequestError("no workspace named '{}'".format(name))
 
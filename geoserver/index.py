@@ -0,0 +1,209 @@
+# coding: utf-8
+
+from urllib.parse import urljoin
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from geoserver.catalog import FailedRequestError
+
+
+DEFAULT_WORKERS = 8
+
+# (url part, list key, item key, store type) per workspace listing
+STORE_LISTINGS = [
+    ("datastores.json", "dataStores", "dataStore", "dataStore"),
+    ("coveragestores.json", "coverageStores", "coverageStore", "coverageStore"),
+    ("wmsstores.json", "wmsStores", "wmsStore", "wmsStore"),
+]
+
+
+class Record:
+    """
+    Name and href of a catalog object in a CatalogIndex.
+    """
+
+    __slots__ = ("name", "workspace", "href")
+
+    def __init__(self, name, workspace=None, href=None):
+        self.name = name
+        self.workspace = workspace
+        self.href = href
+
+    def __repr__(self):
+        return "{}({!r}, {!r})".format(type(self).__name__, self.workspace, self.name)
+
+
+class WorkspaceRecord(Record):
+    __slots__ = ()
+
+
+class StoreRecord(Record):
+    __slots__ = ("store_type",)
+
+    def __init__(self, name, workspace=None, href=None, store_type=None):
+        super(StoreRecord, self).__init__(name, workspace, href)
+        self.store_type = store_type
+
+
+class FeatureTypeRecord(Record):
+    __slots__ = ()
+
+
+class StyleRecord(Record):
+    __slots__ = ()
+
+
+class LayerRecord(Record):
+    __slots__ = ()
+
+
+class CatalogIndex:
+    """
+    In-memory index of the names in a GeoServer catalog.
+
+    Workspaces and layers are keyed on name, stores, featuretypes and styles
+    on (workspace, name). Global styles have workspace None.
+    """
+
+    def __init__(self):
+        self.workspaces = {}
+        self.layers = {}
+        self.stores = {}
+        self.featuretypes = {}
+        self.styles = {}
+
+    def add(self, record):
+        if isinstance(record, WorkspaceRecord):
+            self.workspaces[record.name] = record
+        elif isinstance(record, LayerRecord):
+            self.layers[record.name] = record
+        elif isinstance(record, StoreRecord):
+            self.stores[(record.workspace, record.name)] = record
+        elif isinstance(record, FeatureTypeRecord):
+            self.featuretypes[(record.workspace, record.name)] = record
+        elif isinstance(record, StyleRecord):
+            self.styles[(record.workspace, record.name)] = record
+
+    def store_names(self):
+        return set(name for workspace, name in self.stores)
+
+    def style_names(self):
+        return set(name for workspace, name in self.styles)
+
+    def __repr__(self):
+        return (
+            "CatalogIndex({} workspaces, {} stores, {} featuretypes, "
+            "{} styles, {} layers)"
+        ).format(
+            len(self.workspaces),
+            len(self.stores),
+            len(self.featuretypes),
+            len(self.styles),
+            len(self.layers),
+        )
+
+
+def get_json(catalog, path):
+    """
+    GET a json listing of the REST api.
+    :return: The decoded json.
+    """
+    url = urljoin(catalog.service_url, path)
+    r = catalog.session.get(url, headers={"Accept": "application/json"})
+    if r.status_code != requests.codes.ok:
+        msg = "Tried to make a GET request to {} but got a {} status code: \n{}"
+        raise FailedRequestError(msg.format(url, r.status_code, r.text))
+    return r.json()
+
+
+def list_items(listing, list_key, item_key):
+    """
+    GeoServer returns an empty string for an empty listing and a dictionary
+    instead of a list for some single items.
+    :return: The items of a json listing.
+    """
+    items = listing.get(list_key) or {}
+    if not isinstance(items, dict):
+        return []
+    items = items.get(item_key) or []
+    if isinstance(items, dict):
+        items = [items]
+    return items
+
+
+def _records(catalog, path, list_key, item_key, record_type, workspace=None):
+    listing = get_json(catalog, path)
+    return [
+        record_type(item["name"], workspace, item.get("href"))
+        for item in list_items(listing, list_key, item_key)
+    ]
+
+
+def _stores(catalog, workspace, path, list_key, item_key, store_type):
+    listing = get_json(catalog, "workspaces/{}/{}".format(workspace, path))
+    return [
+        StoreRecord(item["name"], workspace, item.get("href"), store_type)
+        for item in list_items(listing, list_key, item_key)
+    ]
+
+
+def load_index(catalog, max_workers=DEFAULT_WORKERS):
+    """
+    Fetch the workspaces, stores, featuretypes, styles and layers of a
+    catalog concurrently from the json endpoints.
+    :param max_workers: The maximum number of concurrent requests.
+    :return: A CatalogIndex.
+    """
+    index = CatalogIndex()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        workspaces = executor.submit(
+            _records,
+            catalog,
+            "workspaces.json",
+            "workspaces",
+            "workspace",
+            WorkspaceRecord,
+        )
+        futures = [
+            executor.submit(
+                _records, catalog, "layers.json", "layers", "layer", LayerRecord
+            ),
+            executor.submit(
+                _records, catalog, "styles.json", "styles", "style", StyleRecord
+            ),
+        ]
+
+        for workspace in workspaces.result():
+            index.add(workspace)
+            name = workspace.name
+            for listing in STORE_LISTINGS:
+                futures.append(executor.submit(_stores, catalog, name, *listing))
+            futures.append(
+                executor.submit(
+                    _records,
+                    catalog,
+                    "workspaces/{}/featuretypes.json".format(name),
+                    "featureTypes",
+                    "featureType",
+                    FeatureTypeRecord,
+                    name,
+                )
+            )
+            futures.append(
+                executor.submit(
+                    _records,
+                    catalog,
+                    "workspaces/{}/styles.json".format(name),
+                    "styles",
+                    "style",
+                    StyleRecord,
+                    name,
+                )
+            )
+
+        for future in futures:
+            for record in future.result():
+                index.add(record)
+
+    return index
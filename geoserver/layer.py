@@ -112,8 +112,12 @@ class Layer(ResourceInfo):
     def resource(self):
         if self.dom is None:
             self.fetch()
-        name = self.dom.find("resource/name").text
-        return self.catalog.get_resource(name)
+        # the atom link of the resource saves a lookup in every workspace
+        element = self.dom.find("resource")
+        atom_link = [n for n in element if "href" in n.attrib]
+        if atom_link and element.get("class") in ("featureType", "coverage"):
+            return self.catalog.get_resource_by_url(atom_link[0].attrib.get("href"))
+        return self.catalog.get_resource(element.find("name").text)
 
     @property
     def default_style(self):
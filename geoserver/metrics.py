@@ -0,0 +1,213 @@
+# coding: utf-8
+
+"""
+Request metrics of the REST api.
+
+A Catalog registers a response hook on its session that records the count,
+the bytes and a latency histogram per http method and url template, e.g.
+GET workspaces/{ws}/datastores/{ds}/featuretypes. All catalogs share METRICS
+unless given their own RequestMetrics. The metrics can be saved as a json
+summary and as a Prometheus text file. The count and bytes of the requests of
+the current thread are available for timing a stage, see thread_counts.
+"""
+
+import re
+import json
+import threading
+from urllib.parse import urlsplit
+
+
+# upper bounds in seconds of the latency histogram
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# placeholder of the name that follows a collection in an url
+PLACEHOLDERS = {
+    "workspaces": "{ws}",
+    "namespaces": "{ns}",
+    "datastores": "{ds}",
+    "coveragestores": "{cs}",
+    "wmsstores": "{store}",
+    "featuretypes": "{ft}",
+    "coverages": "{coverage}",
+    "wmslayers": "{wmslayer}",
+    "styles": "{style}",
+    "layers": "{layer}",
+    "layergroups": "{group}",
+}
+
+EXTENSION = re.compile(r"\.(xml|json|sld|html|zip)$")
+
+
+def url_template(url, service_url=None):
+    """
+    :return: The path of an url relative to the service url without the
+    extension and with the names replaced by placeholders.
+    """
+    path = urlsplit(url).path
+    if service_url is not None:
+        base = urlsplit(service_url).path
+        if path.startswith(base):
+            path = path[len(base) :]
+    parts = [p for p in EXTENSION.sub("", path).split("/") if p]
+    template = []
+    for i, part in enumerate(parts):
+        if i > 0 and parts[i - 1] in PLACEHOLDERS:
+            template.append(PLACEHOLDERS[parts[i - 1]])
+        else:
+            template.append(part)
+    return "/".join(template)
+
+
+class EndpointMetrics:
+    __slots__ = ("count", "sent", "received", "seconds", "max", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.sent = 0
+        self.received = 0
+        self.seconds = 0.0
+        self.max = 0.0
+        self.buckets = [0] * len(BUCKETS)
+
+    def add(self, seconds, sent, received):
+        self.count += 1
+        self.sent += sent
+        self.received += received
+        self.seconds += seconds
+        self.max = max(self.max, seconds)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "bytes_sent": self.sent,
+            "bytes_received": self.received,
+            "seconds": round(self.seconds, 3),
+            "mean": round(self.seconds / self.count, 4) if self.count else 0.0,
+            "max": round(self.max, 4),
+            "histogram": dict(zip([str(b) for b in BUCKETS], self.buckets)),
+        }
+
+
+class RequestMetrics:
+    """
+    Count, bytes and latency histogram per (method, url template).
+    """
+
+    def __init__(self):
+        self._endpoints = dict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def record(self, method, template, seconds, sent=0, received=0):
+        key = (method.upper(), template)
+        with self._lock:
+            if key not in self._endpoints:
+                self._endpoints[key] = EndpointMetrics()
+            self._endpoints[key].add(seconds, sent, received)
+
+        local = self._local
+        local.count = getattr(local, "count", 0) + 1
+        local.bytes = getattr(local, "bytes", 0) + sent + received
+
+    def thread_counts(self):
+        """
+        :return: The number of requests and bytes recorded by the current
+        thread, not reset by reset.
+        """
+        return getattr(self._local, "count", 0), getattr(self._local, "bytes", 0)
+
+    def hook(self, service_url=None):
+        """
+        :return: A requests response hook that records a response.
+        """
+
+        def record_response(r, *args, **kwargs):
+            request = r.request
+            sent = request.body if isinstance(request.body, (bytes, str)) else b""
+            if kwargs.get("stream"):
+                # do not read a streamed body
+                received = int(r.headers.get("Content-Length", 0))
+            else:
+                received = len(r.content or b"")
+            self.record(
+                request.method,
+                url_template(request.url, service_url),
+                r.elapsed.total_seconds(),
+                len(sent),
+                received,
+            )
+
+        return record_response
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+
+    def total(self):
+        with self._lock:
+            return sum(e.count for e in self._endpoints.values())
+
+    def summary(self):
+        """
+        :return: The metrics per "METHOD template", most requested first.
+        """
+        with self._lock:
+            items = sorted(
+                self._endpoints.items(), key=lambda x: x[1].count, reverse=True
+            )
+            return {
+                "{} {}".format(method, template): endpoint.as_dict()
+                for (method, template), endpoint in items
+            }
+
+    def save_json(self, path):
+        with open(path, "w") as json_file:
+            json.dump(self.summary(), json_file, indent=4)
+
+    def prometheus(self, prefix="geoserver_rest"):
+        """
+        :return: The metrics in the Prometheus text exposition format.
+        """
+        requests = "{}_requests_total".format(prefix)
+        sizes = "{}_bytes_total".format(prefix)
+        latency = "{}_request_duration_seconds".format(prefix)
+        with self._lock:
+            items = sorted(self._endpoints.items())
+
+        lines = [
+            "# HELP {} Requests per method and url template.".format(requests),
+            "# TYPE {} counter".format(requests),
+        ]
+        for (method, template), e in items:
+            labels = 'method="{}",template="{}"'.format(method, template)
+            lines.append("{}{{{}}} {}".format(requests, labels, e.count))
+
+        lines.append("# HELP {} Bytes sent and received.".format(sizes))
+        lines.append("# TYPE {} counter".format(sizes))
+        for (method, template), e in items:
+            labels = 'method="{}",template="{}"'.format(method, template)
+            for direction, value in (("sent", e.sent), ("received", e.received)):
+                line = '{}{{{},direction="{}"}} {}'
+                lines.append(line.format(sizes, labels, direction, value))
+
+        lines.append("# HELP {} Latency of the requests.".format(latency))
+        lines.append("# TYPE {} histogram".format(latency))
+        for (method, template), e in items:
+            labels = 'method="{}",template="{}"'.format(method, template)
+            bounds = [str(b) for b in BUCKETS] + ["+Inf"]
+            for bound, count in zip(bounds, e.buckets + [e.count]):
+                line = '{}_bucket{{{},le="{}"}} {}'
+                lines.append(line.format(latency, labels, bound, count))
+            lines.append("{}_sum{{{}}} {}".format(latency, labels, e.seconds))
+            lines.append("{}_count{{{}}} {}".format(latency, labels, e.count))
+        return "\n".join(lines) + "\n"
+
+    def save_prometheus(self, path):
+        with open(path, "w") as prom_file:
+            prom_file.write(self.prometheus())
+
+
+METRICS = RequestMetrics()
@@ -0,0 +1,426 @@
+# coding: utf-8
+
+"""
+In-memory stand-in of the GeoServer REST api to test the catalogs against.
+
+It keeps workspaces, datastores, featuretypes, styles and layers as xml and
+answers GET, POST, PUT and DELETE the way GeoServer does for the requests of
+Catalog and AsyncCatalog. Listings are also available as json. Every request
+is recorded, so the number of requests of an upload can be counted, and can
+be given a delay to simulate the latency of a real server:
+
+    with MockGeoServer() as server:
+        catalog = Catalog(server.service_url)
+        ...
+        print(server.count("GET"))
+"""
+
+import re
+import json
+import time
+import threading
+from collections import OrderedDict
+from socketserver import ThreadingMixIn
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+from xml.etree.ElementTree import (
+    XML,
+    Element,
+    SubElement,
+    tostring,
+    register_namespace,
+)
+
+
+ATOM = "http://www.w3.org/2005/Atom"
+register_namespace("atom", ATOM)
+
+REST_PATH = "/geoserver/rest/"
+DEFAULT_STYLE = "generic"
+
+EXTENSION = re.compile(r"\.(xml|json|sld|html)$")
+
+# listing element and item element per collection
+LISTINGS = {
+    "workspaces": ("workspaces", "workspace"),
+    "datastores": ("dataStores", "dataStore"),
+    "coveragestores": ("coverageStores", "coverageStore"),
+    "wmsstores": ("wmsStores", "wmsStore"),
+    "featuretypes": ("featureTypes", "featureType"),
+    "styles": ("styles", "style"),
+    "layers": ("layers", "layer"),
+}
+
+SLD_CONTENT_TYPE = "application/vnd.ogc.sld+xml"
+
+
+class MockCatalog:
+    """
+    The objects of the mock server, keyed on their rest path without
+    extension, e.g. workspaces/topp/datastores/states.
+    """
+
+    def __init__(self, service_url):
+        self.service_url = service_url
+        self.objects = OrderedDict()
+        self.bodies = dict()
+        self.lock = threading.RLock()
+        self.add("styles", DEFAULT_STYLE, Element("style"))
+        self.bodies["styles/" + DEFAULT_STYLE] = "<StyledLayerDescriptor/>"
+
+    def href(self, key, extension=".xml"):
+        return self.service_url + key + extension
+
+    def add(self, collection, name, element):
+        name_element = element.find("name")
+        if name_element is None:
+            name_element = SubElement(element, "name")
+        name_element.text = name
+        key = "{}/{}".format(collection, name)
+        self.objects[key] = element
+        return key
+
+    def find(self, key):
+        """
+        :return: The key of an object, GeoServer also finds layers on their
+        bare name and featuretypes without their datastore.
+        """
+        if key in self.objects:
+            return key
+
+        parts = key.split("/")
+        if len(parts) == 2 and parts[0] == "layers" and ":" not in parts[1]:
+            for k in self.objects:
+                if k.startswith("layers/") and k.split(":")[-1] == parts[1]:
+                    return k
+        if len(parts) == 4 and parts[0] == "workspaces" and parts[2] == "featuretypes":
+            name = parts[3].split(":")[-1]
+            for k in self.objects:
+                p = k.split("/")
+                if len(p) == 6 and p[1] == parts[1] and p[4:] == ["featuretypes", name]:
+                    return k
+        return None
+
+    def children(self, collection):
+        """
+        :return: The names and keys of the objects directly in a collection.
+        """
+        parts = collection.split("/")
+        depth = len(parts) + 1
+        items = []
+        for key in self.objects:
+            p = key.split("/")
+            if len(p) != depth:
+                # featuretypes of a workspace are listed over its datastores
+                aggregate = (
+                    len(parts) == 3
+                    and parts[2] == "featuretypes"
+                    and len(p) == 6
+                    and p[:2] == parts[:2]
+                    and p[4] == "featuretypes"
+                )
+                if not aggregate:
+                    continue
+            elif p[:-1] != parts:
+                continue
+            items.append((p[-1], key))
+        return items
+
+    def listing(self, collection, as_json=False):
+        list_key, item_key = LISTINGS[collection.split("/")[-1]]
+        items = self.children(collection)
+        if as_json:
+            if not items:
+                # GeoServer gives an empty string for an empty listing
+                return json.dumps({list_key: ""})
+            return json.dumps(
+                {
+                    list_key: {
+                        item_key: [
+                            {"name": name, "href": self.href(key, ".json")}
+                            for name, key in items
+                        ]
+                    }
+                }
+            )
+
+        root = Element(list_key)
+        for name, key in items:
+            item = SubElement(root, item_key)
+            SubElement(item, "name").text = name
+            SubElement(
+                item,
+                "{%s}link" % ATOM,
+                {"rel": "alternate", "href": self.href(key), "type": "application/xml"},
+            )
+        return tostring(root)
+
+    def style_element(self, tag, name, workspace=None):
+        element = Element(tag)
+        SubElement(element, "name").text = name
+        key = "styles/" + name
+        if workspace:
+            SubElement(element, "workspace").text = workspace
+            key = "workspaces/{}/styles/{}".format(workspace, name)
+        SubElement(
+            element,
+            "{%s}link" % ATOM,
+            {"rel": "alternate", "href": self.href(key), "type": "application/xml"},
+        )
+        return element
+
+    def publish(self, key):
+        """
+        Add the store of a published featuretype and its layer.
+        """
+        parts = key.split("/")
+        workspace, store, name = parts[1], parts[3], parts[5]
+        feature_type = self.objects[key]
+        for tag in ("namespace", "store"):
+            for old in feature_type.findall(tag):
+                feature_type.remove(old)
+        namespace = SubElement(feature_type, "namespace")
+        SubElement(namespace, "name").text = workspace
+        element = SubElement(feature_type, "store", {"class": "dataStore"})
+        SubElement(element, "name").text = "{}:{}".format(workspace, store)
+
+        layer = Element("layer")
+        SubElement(layer, "type").text = "VECTOR"
+        layer.append(self.style_element("defaultStyle", DEFAULT_STYLE))
+        resource = SubElement(layer, "resource", {"class": "featureType"})
+        SubElement(resource, "name").text = "{}:{}".format(workspace, name)
+        SubElement(
+            resource,
+            "{%s}link" % ATOM,
+            {"rel": "alternate", "href": self.href(key), "type": "application/xml"},
+        )
+        SubElement(layer, "enabled").text = "true"
+        self.add("layers", "{}:{}".format(workspace, name), layer)
+
+    def unpublish(self, key):
+        """
+        Remove a layer and its featuretype or a featuretype and its layer.
+        """
+        parts = key.split("/")
+        if parts[0] == "layers":
+            workspace, name = parts[1].split(":")
+            path = "workspaces/{}/featuretypes/{}".format(workspace, name)
+            resource = self.find(path)
+            if resource is not None:
+                self.delete(resource)
+        elif len(parts) == 6 and parts[4] == "featuretypes":
+            self.delete("layers/{}:{}".format(parts[1], parts[5]))
+
+    def update(self, key, element):
+        """
+        Replace the children of an object with those of a PUT message.
+        """
+        target = self.objects[key]
+        for child in list(element):
+            if key.startswith("layers/") and child.tag == "defaultStyle":
+                workspace = child.find("workspace")
+                child = self.style_element(
+                    "defaultStyle",
+                    child.find("name").text,
+                    workspace.text if workspace is not None else None,
+                )
+            for old in target.findall(child.tag):
+                target.remove(old)
+            target.append(child)
+
+    def delete(self, key):
+        for k in list(self.objects):
+            if k == key or k.startswith(key + "/"):
+                del self.objects[k]
+                self.bodies.pop(k, None)
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """
+    Handles the requests of a MockGeoServer.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def catalog(self):
+        return self.server.catalog
+
+    def parse(self):
+        """
+        :return: The rest path without extension, the extension and the query.
+        """
+        url = urlsplit(self.path)
+        path = url.path
+        if path.startswith(REST_PATH):
+            path = path[len(REST_PATH) :]
+        match = EXTENSION.search(path)
+        extension = match.group(1) if match else None
+        key = EXTENSION.sub("", path).strip("/")
+        return key, extension, parse_qs(url.query)
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length).decode("utf-8")
+
+    def respond(self, status, text="", content_type="application/xml"):
+        if isinstance(text, str):
+            text = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(text)))
+        self.end_headers()
+        self.wfile.write(text)
+
+    def not_found(self, key):
+        self.respond(404, "No such object: {}".format(key), "text/plain")
+
+    def handle_method(self, method):
+        # read the body of every request to keep the connection usable
+        self.data = self.read_body()
+        key, extension, query = self.parse()
+        self.server.record(self.command, key)
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        with self.catalog.lock:
+            method(key, extension, query)
+
+    def do_GET(self):
+        self.handle_method(self.get)
+
+    def do_POST(self):
+        self.handle_method(self.post)
+
+    def do_PUT(self):
+        self.handle_method(self.put)
+
+    def do_DELETE(self):
+        self.handle_method(self.delete)
+
+    def get(self, key, extension, query):
+        catalog = self.catalog
+        as_json = extension == "json" or "json" in self.headers.get("Accept", "")
+        found = catalog.find(key)
+        if extension == "sld":
+            if found is None or found not in catalog.bodies:
+                return self.not_found(key)
+            return self.respond(200, catalog.bodies[found], SLD_CONTENT_TYPE)
+        if found is not None:
+            return self.respond(200, tostring(catalog.objects[found]))
+        if key.split("/")[-1] in LISTINGS:
+            content_type = "application/json" if as_json else "application/xml"
+            return self.respond(200, catalog.listing(key, as_json), content_type)
+        self.not_found(key)
+
+    def post(self, key, extension, query):
+        catalog = self.catalog
+        if key in ("reload", "reset"):
+            return self.respond(200)
+
+        collection = key.split("/")[-1]
+        if collection not in LISTINGS or collection == "layers":
+            return self.respond(405, "Cannot POST to {}".format(key), "text/plain")
+
+        parts = key.split("/")
+        if len(parts) > 2 and catalog.find("/".join(parts[:-1])) is None:
+            return self.not_found("/".join(parts[:-1]))
+
+        element = XML(self.data)
+        name = query.get("name", [None])[0]
+        if name is None:
+            name = element.find("name").text
+        if catalog.find("{}/{}".format(key, name)) is not None:
+            msg = "{} '{}' already exists".format(collection, name)
+            return self.respond(409, msg, "text/plain")
+
+        added = catalog.add(key, name, element)
+        if collection == "featuretypes":
+            catalog.publish(added)
+        self.respond(201, name, "text/plain")
+
+    def put(self, key, extension, query):
+        catalog = self.catalog
+        found = catalog.find(key)
+        if found is None:
+            return self.not_found(key)
+        if extension == "sld":
+            catalog.bodies[found] = self.data
+        else:
+            catalog.update(found, XML(self.data))
+        self.respond(200)
+
+    def delete(self, key, extension, query):
+        catalog = self.catalog
+        found = catalog.find(key)
+        if found is None:
+            return self.not_found(key)
+        # GeoServer removes the featuretype of a deleted layer and vice versa
+        catalog.unpublish(found)
+        catalog.delete(found)
+        self.respond(200)
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class MockGeoServer:
+    """
+    A mock GeoServer in a thread, use it as a context manager or start and
+    stop it.
+    :param port: The port to listen on, 0 picks a free port.
+    :param delay: Seconds every request waits before it is handled.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, delay=0.0):
+        self._server = _Server((host, port), MockHandler)
+        self._server.record = self.record
+        self._server.delay = delay
+        self.host, self.port = self._server.server_address
+        self._server.catalog = MockCatalog(self.service_url)
+        self._thread = None
+        self._lock = threading.Lock()
+        self.requests = []
+
+    @property
+    def service_url(self):
+        return "http://{}:{}{}".format(self.host, self.port, REST_PATH)
+
+    @property
+    def catalog(self):
+        return self._server.catalog
+
+    def record(self, method, key):
+        with self._lock:
+            self.requests.append((method, key))
+
+    def count(self, method=None):
+        """
+        :return: The number of requests, of a method if given.
+        """
+        with self._lock:
+            return len([r for r in self.requests if method in (None, r[0])])
+
+    def reset_requests(self):
+        with self._lock:
+            self.requests = []
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -7,3 +7,21 @@ DEFAULT_PASSWORD = "geoserver"
 # Save methods
 POST = "POST"
 PUT = "PUT"
+
+# Response cache, seconds to live per resource type
+CACHE_SIZE = 512
+DEFAULT_CACHE_TTL = 5
+CACHE_TTL = {
+    "workspaces": 300,
+    "datastores": 60,
+    "coveragestores": 60,
+    "wmsstores": 60,
+    "featuretypes": 30,
+    "coverages": 30,
+    "layers": 30,
+    "layergroups": 30,
+    "styles": 60,
+}
+
+# Asynchronous catalog, concurrent requests per host
+MAX_PER_HOST = 8
@@ -109,3 +109,4 @@ class Style(ResourceInfo):
     def update_body(self, body):
         headers = {"Content-Type": self.content_type}
         self.catalog.session.put(self.body_href, data=body, headers=headers)
+        self.catalog.invalidate(self.body_href)
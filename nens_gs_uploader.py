@@ -28,9 +28,14 @@ NOTES:
 import os
 import sys
 import json
+import shutil
 import logging
-from time import sleep
+import multiprocessing as mp
+from copy import copy
+from queue import Empty
+from tempfile import mkdtemp
 from configparser import RawConfigParser
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Third-party imports
 import ogr
@@ -47,8 +52,8 @@ from glob import glob
 # Local imports
 from core.postgis import (
     PG_DATABASE,
-    copy2pg_database,
-    add_metadata_pgdatabase,
+    PG_CONNECTIONS,
+    add_fingerprint_columns,
     _clear_connections_database
 )
 from core.project import (
@@ -58,11 +63,28 @@ from core.project import (
     print_list,
     print_dictionary,
 )
-from core.vector import vector_to_geom
 from core.vector import vector as wrap_shape
+from core.temporary import TEMP_DATASOURCES
 from core.wrap import wrap_geoserver, REST
-from core.sld import wrap_sld
 from core.wmslayers import wmslayers
+from core.planner import (
+    throughput,
+    layer_info,
+    planned_stages,
+    estimate,
+    VERTEX_RATES,
+)
+from core.timing import timer, SUMMARY_SIZE
+from geoserver.metrics import METRICS
+from core.journal import journal
+from core.upload import (
+    COST_SAMPLE,
+    timed,
+    prepare,
+    publish,
+    set_fingerprints,
+    set_journal,
+)
 
 # Exceptions
 ogr.UseExceptions()
@@ -73,6 +95,32 @@ gdal.SetConfigOption("CPL_DEBUG", "ON")
 gdal.SetConfigOption("CPL_ERROR", "ON")
 gdal.SetConfigOption("CPL_CURL_VERBOSE", "ON")
 
+# Seconds between the checks of the background process of the pipeline
+QUEUE_TIMEOUT = 10
+
+# Settings send to the background process of the pipeline
+PREPARE_SETTINGS = [
+    "in_datasource",
+    "in_layer",
+    "layer_name",
+    "epsg",
+    "mask_path",
+    "in_sld_path",
+    "skip_correction",
+    "correct_engine",
+    "geometry_workers",
+    "skip_mask",
+    "skip_delete_excess_field_names",
+    "skip_gs_upload",
+    "skip_pg_upload",
+    "clear_connections",
+    "slug",
+    "journal",
+    "fingerprint",
+    "done",
+    "unchanged",
+]
+
 # Logging configuration options
 for handler in logging.root.handlers[:]:
     logging.root.removeHandler(handler)
@@ -82,6 +130,11 @@ def get_parser():
     """ Return argument parser. """
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument("inifile", metavar="INIFILE", help="Settings voor inifile.")
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        help="Toon per laag de input, stappen en geschatte tijd zonder te uploaden.",
+    )
     return parser
 
 
@@ -432,8 +485,8 @@ def add_output_settings(setting, onderwerp, in_path):
     return setting
 
 
-def batch_upload(inifile):
-    """ Returns batch upload shapes for one geoserver """
+def load_batch(inifile):
+    """ Returns the settings and the layers (path, subject) of a batch """
     setting = settings_object(inifile)
 
     # set logging
@@ -462,201 +515,396 @@ def batch_upload(inifile):
     print_list(subjects, "Subjects")
     print_list(in_paths, "Paths")
 
-    failures = {}
-    succes = {}
-    for count, (in_path, subject) in enumerate(zip(in_paths, subjects)):
+    # workers share the client address, clearing connections per layer would
+    # terminate the connections of the other workers and the pooled
+    # connections. These are cleared once per batch.
+    setting.workers = int(getattr(setting, "workers", 1))
+    setting.pipeline = getattr(setting, "pipeline", False)
+    setting.pool_connections = getattr(setting, "pool_connections", False)
+    setting.clear_connections = (
+        setting.workers == 1
+        and not setting.pipeline
+        and not setting.pool_connections
+    )
+
+    if getattr(setting, "use_journal", False):
+        journal_path = os.path.join(setting.ini_location, "journal.sqlite")
+        setting.journal = journal(journal_path)
+    else:
+        setting.journal = None
+
+    setting.skip_unchanged = getattr(setting, "skip_unchanged", False)
+    setting.overwrite_in_place = getattr(setting, "overwrite_in_place", False)
+    setting.skip_identical_sld = getattr(setting, "skip_identical_sld", False)
+    setting.shared_styles = getattr(setting, "shared_styles", False)
+    setting.correct_engine = getattr(setting, "correct_engine", "ogr")
+    setting.geometry_workers = int(getattr(setting, "geometry_workers", 1))
+    TEMP_DATASOURCES.configure(
+        getattr(setting, "temp_backend", "memory"),
+        int(getattr(setting, "temp_spill_mb", 1024)) * 1024 ** 2,
+    )
 
-        setting = add_output_settings(setting, subject, in_path)
+    throughput_path = os.path.join(setting.ini_location, "throughput.json")
+    setting.throughput = throughput(throughput_path)
+    setting.infos = {}
+    setting.timer = timer(os.path.join(setting.ini_location, "timing.jsonl"))
 
-        if not setting.skip:
-            log_time("info", percentage(count, len(in_paths)), subject, "l")
-            setting.server = wrap_geoserver(setting.server_naam)
-            print_dictionary(setting.__dict__, "Layer settings")
+    return setting, list(zip(in_paths, subjects))
 
-            pg_details = PG_DATABASE[setting.server_naam]
-            _clear_connections_database(pg_details)
 
-            try:
-                succes[setting.subject] = upload(setting)
+def batch_upload(inifile):
+    """ Returns batch upload shapes for one geoserver """
+    setting, layers = load_batch(inifile)
 
-            except Exception as e:
-                print(e)
-                failures[setting.subject] = e
+    if setting.skip_unchanged:
+        add_fingerprint_columns(PG_DATABASE[setting.server_naam])
 
-            finally:
-                _clear_connections_database(pg_details)
+    if getattr(setting, "order_by_cost", False):
+        layers = order_by_cost(setting, layers)
+
+    pg_details = PG_DATABASE[setting.server_naam]
+    if not setting.clear_connections:
+        _clear_connections_database(pg_details)
+
+    if setting.pool_connections:
+        log_time("info", "Reusing pg connections")
+        PG_CONNECTIONS.enable(size=setting.workers + 1)
+
+    # one catalog snapshot for all layers, updated by the layers themselves
+    setting.snapshot = None
+    if not (setting.skip_gs_upload or setting.wms_layer_only):
+        log_time("info", "Loading geoserver catalog")
+        setting.snapshot = wrap_geoserver(setting.server_naam).snapshot
+
+    METRICS.reset()
+    failures = {}
+    succes = {}
+    try:
+        if setting.pipeline:
+            log_time("info", "Uploading with a pipeline")
+            pipeline_upload(setting, layers, succes, failures)
+
+        elif setting.workers > 1:
+            log_time("info", "Uploading with {} workers".format(setting.workers))
+            with ThreadPoolExecutor(max_workers=setting.workers) as executor:
+                futures = [
+                    executor.submit(
+                        upload_layer, setting, in_path, subject, count, len(layers)
+                    )
+                    for count, (in_path, subject) in enumerate(layers)
+                ]
+                for future in as_completed(futures):
+                    add_result(future.result(), succes, failures)
 
-            log_time("info", "sleeping to decrease load on server....")
-            sleep(2)
         else:
-            log_time("info", "Skipping", subject, "l")
+            for count, (in_path, subject) in enumerate(layers):
+                result = upload_layer(setting, in_path, subject, count, len(layers))
+                add_result(result, succes, failures)
+
+    finally:
+        PG_CONNECTIONS.close()
+        TEMP_DATASOURCES.clear()
 
+    if not setting.clear_connections:
+        _clear_connections_database(pg_details)
+
+    setting.throughput.save()
+    print_timing(setting.timer)
+    save_metrics(setting, METRICS)
     print_dictionary(succes, "Succes")
     print_dictionary(failures, "Failures")
 
 
-def upload(setting):
-    log_time("info", setting.layer_name, "0. starting.....")
+def print_timing(timer):
+    """ Prints the slowest stages and layers of the batch """
+    summary = timer.summary()
+    print_dictionary(dict(summary["stages"]), "Seconds per stage, slowest first")
+    print_dictionary(dict(summary["layers"]), "Seconds per layer, slowest first")
+    slowest = {
+        "{} - {}".format(layer, stage): duration
+        for layer, stage, duration in summary["slowest"]
+    }
+    print_dictionary(slowest, "Slowest layer stages")
+    print(
+        "\n Http requests: {}, http bytes: {}".format(
+            summary["requests"], summary["bytes"]
+        )
+    )
+
+
+def save_metrics(setting, metrics):
+    """ Saves the geoserver request metrics and prints the busiest endpoints """
+    metrics.save_json(os.path.join(setting.ini_location, "requests.json"))
+    metrics.save_prometheus(os.path.join(setting.ini_location, "requests.prom"))
+    summary = metrics.summary()
+    busiest = {
+        endpoint: "{} requests, {}s mean".format(m["count"], m["mean"])
+        for endpoint, m in list(summary.items())[:SUMMARY_SIZE]
+    }
+    print_dictionary(busiest, "Geoserver requests per endpoint")
+
+
+def plan_upload(inifile):
+    """ Prints the input, stages and estimated time per layer of a batch """
+    setting, layers = load_batch(inifile)
+
+    totals = {}
+    for in_path, subject in layers:
+        layer_setting = add_output_settings(copy(setting), subject, in_path)
+        if layer_setting.skip:
+            log_time("info", "Skipping", subject, "l")
+            continue
+
+        layer_setting = set_journal(set_fingerprints(layer_setting))
+        try:
+            plan = layer_plan(layer_setting)
+        except Exception as e:
+            print(e)
+            totals[layer_setting.layer_name] = "failed to open input"
+            continue
+
+        print_dictionary(plan, "Plan " + layer_setting.layer_name)
+        totals[layer_setting.layer_name] = plan["total (s)"]
+
+    # failed layers have a message instead of seconds and go last
+    ordered = sorted(
+        totals.items(), key=lambda x: 1e12 if isinstance(x[1], str) else x[1]
+    )
+    print_dictionary(dict(ordered), "Estimated seconds, shortest first")
+    seconds = sum(v for v in totals.values() if not isinstance(v, str))
+    print("\n Estimated total: {} hours".format(round(seconds / 3600, 2)))
+
+
+def layer_plan(setting, sample=None):
+    """ Returns the input information, stages and estimated time of a layer """
+    stages = planned_stages(setting)
+    if any(stage in VERTEX_RATES for stage in stages):
+        info = layer_info(setting, sample)
+    else:
+        info = {"features": 0, "vertices": 0, "geometry": None, "fields": 0, "size": 0}
+
+    seconds = estimate(info, stages, setting.throughput)
+    plan = dict(info)
+    plan["stages"] = ", ".join(stages)
+    for stage in stages:
+        plan["{} (s)".format(stage)] = round(seconds[stage], 1)
+    plan["total (s)"] = float(round(sum(seconds.values()), 1))
+    return plan
+
+
+def order_by_cost(setting, layers):
+    """
+    Returns the layers ordered on estimated time, shortest first. The vertex
+    count is estimated from the first features of every layer.
+    """
+    costs = {}
+    for in_path, subject in layers:
+        layer_setting = add_output_settings(copy(setting), subject, in_path)
+        layer_setting.unchanged = False
+        layer_setting.done = set()
+        try:
+            plan = layer_plan(layer_setting, sample=COST_SAMPLE)
+        except Exception as e:
+            print(e)
+            continue
+
+        setting.infos[in_path] = plan
+        costs[in_path] = plan["total (s)"]
 
-    if isinstance(setting.in_datasource, dict):
-        _clear_connections_database(setting.in_datasource)
+    # layers without an estimate go last
+    layers = sorted(layers, key=lambda layer: costs.get(layer[0], float("inf")))
+    print_list([subject for in_path, subject in layers], "Ordered subjects")
+    return layers
 
-    if not (setting.skip_gs_upload and setting.skip_pg_upload):
-        vector = wrap_shape(setting.in_datasource, setting.in_layer)
 
-    if not setting.skip_correction:
-        log_time("info", setting.layer_name, "1. vector corrections")
-        vector.correct(
-            vector.layer, setting.layer_name, setting.epsg
+def add_result(result, succes, failures):
+    """ Adds the result of upload_layer to the succes or failures """
+    if result is None:
+        return
+
+    subject, output, error = result
+    if error is None:
+        succes[subject] = output
+    else:
+        failures[subject] = error
+
+
+def upload_layer(setting, in_path, subject, count, total):
+    """
+    Uploads a single layer with its own copy of the settings and its own
+    geoserver session. Returns subject, output and exception or None when
+    the layer is skipped.
+    """
+    setting = add_output_settings(copy(setting), subject, in_path)
+
+    if setting.skip:
+        log_time("info", "Skipping", subject, "l")
+        return None
+
+    setting = set_journal(set_fingerprints(setting))
+    setting.info = setting.infos.get(in_path)
+
+    log_time("info", percentage(count, total), subject, "l")
+    with timed(setting, "0. Load geoserver catalog."):
+        setting.server = wrap_geoserver(
+            setting.server_naam, easy=True, snapshot=setting.snapshot
         )
-        setting.layer_name = vector.layer_name
-
-    if not setting.skip_mask:
-        log_time("info", setting.layer_name, "1.2 vector corrections - mask")
-        vector_geom = vector_to_geom(setting.mask_path, setting.epsg)
-        vector.clip(vector.layer, vector_geom)
-
-    if (not setting.skip_mask) or (not setting.skip_correction):
-        if vector.ds[0].GetFeatureCount() == 0:
-            log_time("error", setting.layer_name, "vector feature count is 0")
-        if vector.ds == None:
-            log_time("error", setting.layer_name, "Datasource is none")
-        if vector.ds[0][0] == None:
-            log_time("error", setting.layer_name, "Feature is none")
-
-    if not setting.skip_delete_excess_field_names:
-        vector = wrap_shape(vector.ds)
-        field_names = vector.get_all_field_names()
-        field_names_lowered = [f.lower() for f in field_names]
-
-        sld = wrap_sld(setting.in_sld_path, _type="path")
-        sld.lower_all_property_names()
-        sld_fields = sld.get_all_property_names()
-    
-        if len(sld_fields) > 0:
-            for idx, field_name in enumerate(field_names_lowered):
-                if field_name not in sld_fields:
-                    vector.delete_fields([field_names[idx]])
-                    continue
-                else:
-                    log_time("info", f"Keeping '{field_name}' field in vector")
-
-    if not setting.skip_pg_upload:
-        log_time("info", setting.layer_name, "2. Upload shape to pg database.")
-
-        pg_details = PG_DATABASE[setting.server_naam]
+    print_dictionary(setting.__dict__, "Layer settings")
+
+    pg_details = PG_DATABASE[setting.server_naam]
+    if setting.clear_connections:
         _clear_connections_database(pg_details)
 
-        if setting.database_name is not None:
-            pg_details["database"] = setting.database_name
+    try:
+        return setting.subject, upload(setting), None
 
-        pg_database = wrap_shape(pg_details)
-        if not setting.product_naam == "flooding" and setting.set_metadata:
-            add_metadata_pgdatabase(setting, pg_database)
+    except Exception as e:
+        print(e)
+        return setting.subject, None, e
 
-        schema_layers = [layer.split(".")[-1] for layer in pg_database.layers]
-        pg_layer_present = setting.layer_name in schema_layers
+    finally:
+        if setting.clear_connections:
+            _clear_connections_database(pg_details)
 
-        if not pg_layer_present or setting.overwrite_postgres:
-            copy2pg_database(
-                pg_database.ds,
-                vector.ds,
-                vector.layer,
-                setting.layer_name,
-                setting.schema_name,
-            )
 
+def pipeline_upload(setting, layers, succes, failures):
+    """
+    Runs the cpu stages of the next layers in a background process while the
+    current layer is uploaded. The prepared layers are written to a temporary
+    directory, the bounded queue keeps the number of waiting layers capped.
+    """
+    layer_settings = []
+    for in_path, subject in layers:
+        layer_setting = add_output_settings(copy(setting), subject, in_path)
+        if layer_setting.skip:
+            log_time("info", "Skipping", subject, "l")
         else:
-            log_time("info", setting.layer_name, "Layer already in database.")
+            layer_setting = set_journal(set_fingerprints(layer_setting))
+            layer_setting.info = setting.infos.get(in_path)
+            layer_settings.append(layer_setting)
+
+    directory = mkdtemp(prefix="nens_gs_uploader_")
+    queue = mp.Queue(maxsize=int(getattr(setting, "pipeline_queue_size", 2)))
+    jobs = [prepare_job(layer_setting) for layer_setting in layer_settings]
+    producer = mp.Process(target=prepare_worker, args=(jobs, queue, directory))
+    producer.daemon = True
+    producer.start()
+
+    try:
+        for count, layer_setting in enumerate(layer_settings):
+            prepared = next_prepared(queue, producer)
+            if prepared is None:
+                error = RuntimeError(
+                    "Pipeline stopped with exit code {}".format(producer.exitcode)
+                )
+                log_time("error", str(error))
+                for remaining in layer_settings[count:]:
+                    failures[remaining.subject] = error
+                break
+
+            path, layer_name, error, records = prepared
+            setting.timer.add(records)
+            progress = percentage(count, len(layer_settings))
+            log_time("info", progress, layer_name, "l")
+
+            if error is not None:
+                failures[layer_setting.subject] = error
+                continue
+
+            layer_setting.layer_name = layer_name
+            with timed(layer_setting, "0. Load geoserver catalog."):
+                layer_setting.server = wrap_geoserver(
+                    layer_setting.server_naam,
+                    easy=True,
+                    snapshot=layer_setting.snapshot,
+                )
+            print_dictionary(layer_setting.__dict__, "Layer settings")
+
+            vector = None
+            if path is not None:
+                vector = wrap_shape(path)
 
-        pg_database.get_layer(setting.layer_name.lower())
-        pg_database.lower_all_field_names()
+            try:
+                succes[layer_setting.subject] = publish(layer_setting, vector)
 
-    if not setting.skip_gs_upload:
-        log_time("info", setting.layer_name, "3. Create workspace.")
-        server = setting.server
-        server.create_workspace(setting.workspace_name)
+            except Exception as e:
+                print(e)
+                failures[layer_setting.subject] = e
 
-        log_time("info", setting.layer_name, "4. Create store.")
-        pg_details = PG_DATABASE[setting.server_naam]
-        server.create_postgis_datastore(
-            setting.store_name, setting.workspace_name, pg_details
-        )
+            finally:
+                if vector is not None:
+                    vector.close()
+                    os.remove(path)
 
-        log_time("info", setting.layer_name, "5. Publish featuretype.")
-        server.publish_layer(
-            setting.layer_name,
-            setting.workspace_name,
-            setting.overwrite_feature,
-            setting.epsg,
-            reload=True,
-        )
+    finally:
+        if producer.is_alive():
+            producer.terminate()
+        producer.join()
+        shutil.rmtree(directory, ignore_errors=True)
 
-        if setting.use_existing_geoserver_sld:
-            log_time("info", setting.layer_name, "6-9. Setting existing sld.")
-            server.set_sld_for_layer(
-                workspace_name=None, style_name=setting.existing_sld, use_custom=True
-            )
-        else:
-            log_time("info", setting.layer_name, "6. Load Style Layer Descriptor.")
 
-            sld = wrap_sld(setting.in_sld_path, _type="path")
-            if not setting.skip_sld_check:
-                log_time("info", setting.layer_name, "7. Check sld.")
+def next_prepared(queue, producer):
+    """ Returns the next prepared layer, None if the producer is gone """
+    while True:
+        try:
+            return queue.get(timeout=QUEUE_TIMEOUT)
+        except Empty:
+            if not producer.is_alive():
+                # the last result can arrive after the producer has exited
+                try:
+                    return queue.get(timeout=1)
+                except Empty:
+                    return None
+
+
+def prepare_job(setting):
+    """ Returns the settings needed by prepare as a picklable dictionary """
+    return {key: getattr(setting, key, None) for key in PREPARE_SETTINGS}
+
+
+def prepare_worker(jobs, queue, directory):
+    """ Runs prepare for every job and puts the written results on the queue """
+    PG_CONNECTIONS.disable()
+    for count, job in enumerate(jobs):
+        setting = settings_object()
+        for key, value in job.items():
+            setting.add(key, value)
+        setting.timer = timer()
 
-                # lower all and cut field names to esri shape standards
-                sld.lower_all_property_names()
-                sld.cut_len_all_property_names(_len=10)
+        try:
+            vector = prepare(setting)
+            path = None
+            if vector is not None:
+                path = os.path.join(directory, "{}.gpkg".format(count))
+                out_datasource = ogr.GetDriverByName("GPKG").CreateDataSource(path)
+                out_datasource.CopyLayer(vector.layer, setting.layer_name)
+                out_datasource = None
+                vector.close()
 
-            log_time("info", setting.layer_name, "8. Upload sld.")
-            style_name = setting.layer_name + "_style"
-            server.upload_sld(
-                style_name, setting.workspace_name, sld.get_xml(), setting.overwrite_sld
-            )
+            queue.put((path, setting.layer_name, None, setting.timer.records))
 
-            log_time("info", "9. Connect sld to layer.")
-            server.set_sld_for_layer()
-
-        # log_time("info", setting.layer_name, "10. Add to abstract.")
-        # if setting.overwrite_abstract:
-        #     server.write_abstract(setting.abstract_data)
-
-        # log_time("info", setting.layer_name, "11. Add to title.")
-        # if setting.overwrite_title:
-        #     server.write_title(setting.title_data)
-
-    if not setting.skip_lizard_wms_layer:
-        log_time("info", setting.layer_name, "12. Add wms layer.")
-        if not setting.skip_gs_upload:
-            gs_wms_server = setting.server
-            gs_wms_server.get_layer(setting.slug)
-            setting.wmslayer.configuration["wms_url"] = setting.wms_url
-            download_url = setting.wmslayer.get_download_url(
-                setting.wms_url, setting.slug
-            )
-            setting.wmslayer.configuration["download_url"] = download_url
-            setting.wmslayer.configuration["slug"] = setting.slug[:64]
+        except Exception as e:
+            print(e)
+            queue.put((None, setting.layer_name, str(e), setting.timer.records))
 
-        else:
-            gs_wms_server = wrap_geoserver(setting.wmsserver)
-            gs_wms_server.get_layer(setting.wmsslug)
-
-        latlon_bbox = gs_wms_server.layer_latlon_bbox
-        setting.wmslayer.configuration["spatial_bounds"] = {
-            "south": latlon_bbox[2],
-            "west": latlon_bbox[0],
-            "north": latlon_bbox[3],
-            "east": latlon_bbox[1],
-        }
+    TEMP_DATASOURCES.clear()
 
-        setting.wmslayer.create(setting.wmslayer.configuration, overwrite=True)
 
-    log_time("info", setting.layer_name, "13. Returning wms, slug")
-    return setting.wms_url, setting.slug
+def upload(setting):
+    vector = prepare(setting)
+    try:
+        return publish(setting, vector)
+    finally:
+        if vector is not None:
+            vector.close()
+        count, size = TEMP_DATASOURCES.live()
+        log_time("info", setting.layer_name, f"{count} temporary files, {size} bytes")
 
 
 if __name__ == "__main__":
-    #batch_upload(**vars(get_parser().parse_args()))
-    print(sys.argv[-1])
-    inifile=sys.argv[-1]
-    batch_upload(inifile)
\ No newline at end of file
+    args = get_parser().parse_args()
+    inifile = args.inifile
+    if args.plan:
+        plan_upload(inifile)
+    else:
+        batch_upload(inifile)
\ No newline at end of file
@@ -6,7 +6,9 @@ CREATE TABLE metadata (
     gs_layer	    varchar(255),
     uploader        varchar(255),
     projectnummer   varchar(255),
-    einddatum       varchar(255)
+    einddatum       varchar(255),
+    data_hash       varchar(64),
+    style_hash      varchar(64)
   
 	
   );
\ No newline at end of file
@@ -38,7 +38,7 @@ setup(
     zip_safe=False,
     install_requires=install_requires,
     tests_require=tests_require,
-    extras_require={"test": tests_require},
+    extras_require={"test": tests_require, "async": ["aiohttp"]},
     entry_points={
         "console_scripts": [
             "run-nens-gs-uploader = nens_gs_uploader.nens_gs_uploader:main"
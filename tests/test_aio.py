@@ -0,0 +1,99 @@
+# coding: utf-8
+
+"""
+AsyncCatalog against the mock GeoServer.
+"""
+
+import asyncio
+
+import pytest
+
+pytest.importorskip("aiohttp")
+
+from geoserver.aio import AsyncCatalog  # noqa: E402
+from geoserver.catalog import ConflictingDataError  # noqa: E402
+from geoserver.mock import MockGeoServer  # noqa: E402
+
+SLD = "<StyledLayerDescriptor><Name>{}</Name></StyledLayerDescriptor>"
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+@pytest.fixture
+def server():
+    with MockGeoServer() as server:
+        yield server
+
+
+def test_workspace(server):
+    async def workspace():
+        async with AsyncCatalog(server.service_url) as catalog:
+            assert await catalog.get_workspace("topp") is None
+            await catalog.create_workspace("topp")
+            found = await catalog.get_workspace("topp")
+            await catalog.delete(found)
+            return found, await catalog.get_workspace("topp")
+
+    found, deleted = run(workspace())
+    assert found.name == "topp"
+    assert deleted is None
+
+
+def test_datastore(server):
+    async def datastore():
+        async with AsyncCatalog(server.service_url) as catalog:
+            workspace = await catalog.create_workspace("topp")
+            store = catalog.create_datastore("states", workspace)
+            store.connection_parameters.update(host="localhost", port="5432")
+            await catalog.save(store)
+            found = await catalog.get_store("states", workspace)
+            await catalog.delete(found)
+            return found, await catalog.get_store("states", workspace)
+
+    found, deleted = run(datastore())
+    assert found.name == "states"
+    assert found.connection_parameters["host"] == "localhost"
+    assert deleted is None
+
+
+def test_featuretype(server):
+    async def featuretype():
+        async with AsyncCatalog(server.service_url) as catalog:
+            workspace = await catalog.create_workspace("topp")
+            await catalog.save(catalog.create_datastore("states", workspace))
+            store = await catalog.get_store("states", workspace)
+            published = await catalog.publish_featuretype("roads", store, "EPSG:28992")
+            found = await catalog.get_resource("roads", store)
+            layer = await catalog.get_layer("topp:roads")
+            await catalog.delete(found)
+            deleted = (
+                await catalog.get_resource("roads", store),
+                await catalog.get_layer("topp:roads"),
+            )
+            return published, found, layer, deleted
+
+    published, found, layer, deleted = run(featuretype())
+    assert published.name == "roads"
+    assert found.projection == "EPSG:28992"
+    assert layer is not None
+    assert deleted == (None, None)
+
+
+def test_style(server):
+    async def style():
+        async with AsyncCatalog(server.service_url) as catalog:
+            await catalog.create_style("roads", SLD.format("roads"))
+            with pytest.raises(ConflictingDataError):
+                await catalog.create_style("roads", SLD.format("roads"))
+            await catalog.create_style("roads", SLD.format("new"), overwrite=True)
+            return await catalog.get_style("roads")
+
+    found = run(style())
+    assert found.name == "roads"
+    assert server.catalog.bodies["styles/roads"] == SLD.format("new")
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+"""
+Request-count regression test of the geoserver stages of an upload.
+"""
+import pytest
+
+pytest.importorskip("ogr")
+pytest.importorskip("psycopg2")
+
+# Globals
+LAYERS = 3
+# measured 13.7 and 18.0 requests per layer with three layers
+MAX_REQUESTS_PER_LAYER = {"first": 15, "rerun": 19}
+
+
+@pytest.fixture
+def benchmark_upload(monkeypatch):
+    # core.credentials asks for the lizard credentials on import
+    monkeypatch.setattr("builtins.input", lambda prompt="": "benchmark")
+    monkeypatch.setattr("getpass.getpass", lambda prompt="": "benchmark")
+    import benchmark_upload
+
+    return benchmark_upload
+
+
+def test_requests_per_layer(benchmark_upload):
+    args = benchmark_upload.get_parser().parse_args(["--layers", str(LAYERS)])
+    results = benchmark_upload.benchmark(args)
+    for name, maximum in MAX_REQUESTS_PER_LAYER.items():
+        assert 0 < results[name]["requests_per_layer"] <= maximum
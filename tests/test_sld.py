@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+The cut of the sld property names and the column names of the published layer.
+"""
+from core.sld import wrap_sld, cut_field_names
+
+# Globals
+SLD = """<?xml version="1.0" encoding="UTF-8"?>
+<StyledLayerDescriptor version="1.0.0"
+    xmlns="http://www.opengis.net/sld"
+    xmlns:ogc="http://www.opengis.net/ogc">
+  <NamedLayer>
+    <UserStyle>
+      <FeatureTypeStyle>
+        <Rule>
+          <ogc:Filter>
+            <ogc:PropertyIsEqualTo>
+              <ogc:PropertyName>{}</ogc:PropertyName>
+              <ogc:Literal>1</ogc:Literal>
+            </ogc:PropertyIsEqualTo>
+          </ogc:Filter>
+        </Rule>
+      </FeatureTypeStyle>
+    </UserStyle>
+  </NamedLayer>
+</StyledLayerDescriptor>
+"""
+
+
+def test_long_field_name():
+    field_name = "Waterdiepte_Maximaal"
+    sld = wrap_sld(SLD.format(field_name), _type="body")
+    sld.lower_all_property_names()
+    sld.cut_len_all_property_names()
+
+    columns = cut_field_names(["ogc_fid", field_name.lower()])
+    assert columns == ["ogc_fid", "waterdiept"]
+    assert sld.get_all_property_names() == ["waterdiept"]
+
+
+def test_taken_field_name():
+    columns = cut_field_names(["waterdiepte_min", "waterdiepte_max", "waterdiepte"])
+    assert columns == ["waterdiept", "waterdie_1", "waterdie_2"]
+    assert cut_field_names(["naam"]) == ["naam"]